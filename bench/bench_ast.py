@@ -0,0 +1,73 @@
+# Memory and traversal time of the AST of a program with about a million nodes, as node objects and as an ASTArena
+# Usage: python bench/bench_ast.py [nodes]
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "maple"))
+
+from MapleLexer import MapleLexer
+from MapleParser import MapleParser, iter_nodes
+from MapleTranspiler import MapleTranspiler
+from MapleArena import ASTArena
+from generate_corpus import generate
+
+def node_memory(ast):
+    # Bytes taken by the node objects and their block lists, the operand values (names, literals) are left out
+    # since they're shared with the tokens
+    size = 0
+    for node in iter_nodes(ast):
+        size += sys.getsizeof(node) + (sys.getsizeof(node.__dict__) if hasattr(node, "__dict__") else 0)
+        for block in (node.children, getattr(node, "body", None)):
+            if isinstance(block, list):
+                size += sys.getsizeof(block)
+        condition = getattr(node, "condition", None)
+        if condition is not None:
+            size += sys.getsizeof(condition) + (sys.getsizeof(condition.__dict__) if hasattr(condition, "__dict__") else 0)
+    return size
+
+def parse(program_path, arena=None):
+    with open(program_path, "r") as f:
+        return MapleParser(MapleLexer(f).iter_tokens(), arena=arena).parse()
+
+def peak_memory(function):
+    # Most bytes allocated at once while the function runs, everything it allocates counted
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def best_of(runs, function):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == "__main__":
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        program_path = generate(nodes, directory) # About one node per line
+        os.chdir(directory) # The libraries are found relative to the working directory
+        ast = parse(program_path)
+        arena = ASTArena()
+        arena_ast = parse(program_path, arena)
+
+        node_count = sum(1 for _ in iter_nodes(ast))
+        print(f"nodes:              {node_count:,}")
+        size = node_memory(ast)
+        print(f"node objects:       {size / 2 ** 20:8.1f} MB  {size / node_count:6.1f} bytes/node")
+        size = arena.memory()
+        print(f"arena:              {size / 2 ** 20:8.1f} MB  {size / node_count:6.1f} bytes/node")
+        print(f"parse peak objects: {peak_memory(lambda: parse(program_path)) / 2 ** 20:8.1f} MB")
+        print(f"parse peak arena:   {peak_memory(lambda: parse(program_path, ASTArena())) / 2 ** 20:8.1f} MB")
+        print(f"walk node objects:  {best_of(3, lambda: sum(1 for _ in iter_nodes(ast))):8.3f} s")
+        print(f"walk arena:         {best_of(3, lambda: sum(1 for _ in arena.preorder(arena_ast))):8.3f} s  (by index)")
+        print(f"transpile objects:  {best_of(3, lambda: MapleTranspiler(ast).transpile()):8.3f} s")
+        print(f"transpile arena:    {best_of(3, lambda: MapleTranspiler(arena_ast).transpile()):8.3f} s")
@@ -0,0 +1,148 @@
+# Per-statement overhead of MapleParser.parse and MapleTranspiler.transpile on a 100k-statement program
+# Usage: python bench/bench_dispatch.py [statements] [--baseline]
+# --baseline also times the if/elif dispatch the handler tables replaced, on the same program and the same handlers
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "maple"))
+
+from MapleLexer import MapleLexer
+from MapleParser import MapleParser
+from MapleTranspiler import MapleTranspiler
+
+def generate_program(statements):
+    lines = ["init @bench"]
+    for i in range(statements // 4):
+        lines.append(f"dec ch i32 v{i} {i}")
+        lines.append(f"add v{i} 1")
+        lines.append(f"set v{i} 2")
+        lines.append(f"out v{i}")
+    return "\n".join(lines) + "\n"
+
+class BaselineParser(MapleParser):
+    # The dispatch before the handler tables: every top-level statement is checked for a call, then the chain is walked
+    def parse(self):
+        while self.has_token():
+            if self.is_function_call():
+                self.nodes.append(self.parse_call())
+            else:
+                self.parse_statement()
+        return self.nodes
+
+    def parse_statement(self, top_level=False):
+        token = self.token()
+        if token.type == "RUN":
+            self.parse_run()
+        elif token.type == "DEC":
+            self.parse_dec()
+        elif token.type == "OUT":
+            self.parse_out()
+        elif token.type == "IF":
+            self.parse_if()
+        elif token.type == "ELIF":
+            self.parse_elif()
+        elif token.type == "ELSE":
+            self.parse_else()
+        elif token.type == "END":
+            self.parse_end()
+        elif token.type == "SET":
+            self.parse_set()
+        elif token.type == "LOOP":
+            self.parse_loop()
+        elif token.type == "ROLL":
+            self.parse_roll()
+        elif token.type == "BACK":
+            self.parse_back()
+        elif token.type == "LOAD":
+            self.parse_load()
+        elif token.type == "FUNC":
+            self.parse_fnc()
+        elif token.type == "RETURN":
+            self.parse_return()
+        elif self.is_function_call():
+            self.parse_call()
+        elif token.type == "ADD" or token.type == "SUB" or token.type == "MUL" or token.type == "DIV" or token.type == "MOD":
+            self.parse_expression()
+        elif token.type == "LIB":
+            self.parse_lib()
+        elif token.type == "INIT":
+            self.parse_init()
+        elif token.type == "LIBACCESS":
+            self.parse_libaccess()
+        elif token.type == "FLUSH":
+            self.parse_flush()
+        else:
+            self.current_position += 1
+
+class BaselineTranspiler(MapleTranspiler):
+    def transpile_node(self, node):
+        if node.type == "RUN":
+            self.transpile_RUNnode(node)
+        elif node.type == "DEC":
+            self.transpile_DECnode(node)
+        elif node.type == "OUT":
+            self.transpile_OUTnode(node)
+        elif node.type == "IF":
+            self.transpile_IFnode(node)
+        elif node.type == "ELSE":
+            self.transpile_ELSEnode(node)
+        elif node.type == "ELIF":
+            self.transpile_ELIFnode(node)
+        elif node.type == "END":
+            self.transpile_ENDnode(node)
+        elif node.type == "SET":
+            self.transpile_SETnode(node)
+        elif node.type == "LOOP":
+            self.transpile_LOOPnode(node)
+        elif node.type == "ROLL":
+            self.transpile_ROLLnode(node)
+        elif node.type == "BACK":
+            self.transpile_BACKnode(node)
+        elif node.type == "LOAD":
+            self.transpile_LOADnode(node)
+        elif node.type == "FUNC":
+            self.transpile_FNCnode(node)
+        elif node.type == "RETURN":
+            self.transpile_RETURNnode(node)
+        elif node.type == "CALL":
+            self.transpile_CALLnode(node)
+        elif node.type == "EXPRESSION":
+            self.transpile_EXPRESSIONnode(node)
+        elif node.type == "LIB":
+            self.transpile_LIBnode(node)
+        elif node.type == "INIT":
+            self.transpile_INITnode(node)
+        elif node.type == "LIBACCESS":
+            self.transpile_LIBACCESSnode(node)
+        elif node.type == "FLUSH":
+            self.transpile_FLUSHnode(node)
+        elif node.type == "BLOCK":
+            self.transpile_BLOCKnode(node)
+        else:
+            raise Exception(f"Invalid node type: {node.type}")
+
+def best_of(runs, function):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def report(name, parser, transpiler, tokens, statements):
+    parse_time, ast = best_of(3, lambda: parser(tokens).parse())
+    transpile_time, _ = best_of(3, lambda: transpiler(ast).transpile())
+    print(f"{name} parse:     {parse_time:.3f}s  {parse_time / statements * 1e6:.2f} us/statement")
+    print(f"{name} transpile: {transpile_time:.3f}s  {transpile_time / statements * 1e6:.2f} us/statement")
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != "--baseline"]
+    statements = int(arguments[0]) if arguments else 100_000
+    tokens = MapleLexer(generate_program(statements)).tokenize()
+
+    print(f"statements: {statements}")
+    if "--baseline" in sys.argv:
+        report("if/elif", BaselineParser, BaselineTranspiler, tokens, statements)
+    report("tables ", MapleParser, MapleTranspiler, tokens, statements)
@@ -0,0 +1,110 @@
+# Throughput (lines/s) and peak memory (tracemalloc) of the lexer, parser and transpiler on synthetic corpora, see generate_corpus.py
+# Usage: python bench/bench_pipeline.py [--sizes 1k 100k 1M] [--runs 3] [--threshold 0.25] [--save] [--baselines bench/baselines.json]
+# --save stores the results as the baselines, otherwise they are compared with the baselines and the script exits with 1 when a phase
+# is slower, or uses more memory, than its baseline by more than the threshold. Baselines only make sense on the machine they were saved on
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "maple"))
+
+import MapleParser
+from MapleLexer import MapleLexer
+from MapleTranspiler import MapleTranspiler
+from generate_corpus import generate, sizes
+
+default_baselines = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+def measure(runs, function):
+    # Best time of the runs, then the peak memory of one more run under tracemalloc (which slows it down too much to time it)
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+def parse(tokens):
+    # Every parser gets a new loader, so the imports are part of the parsing
+    return MapleParser.MapleParser(tokens).parse()
+
+def bench_size(size, directory, runs):
+    # Phase -> {"lines_per_second", "peak_bytes"} for the corpus of that size
+    program_path = generate(sizes[size], os.path.join(directory, size))
+    with open(program_path, "r") as f:
+        source = f.read()
+    lines = source.count("\n")
+
+    results = {}
+    previous = os.getcwd()
+    os.chdir(os.path.dirname(program_path)) # The libraries are found relative to the working directory
+    try:
+        seconds, peak, tokens = measure(runs, lambda: MapleLexer(source).tokenize())
+        results["lex"] = (seconds, peak)
+        seconds, peak, ast = measure(runs, lambda: parse(tokens))
+        results["parse"] = (seconds, peak)
+        seconds, peak, _ = measure(runs, lambda: MapleTranspiler(ast).transpile())
+        results["transpile"] = (seconds, peak)
+    finally:
+        os.chdir(previous)
+    return {phase: {"lines_per_second": lines / seconds, "peak_bytes": peak} for phase, (seconds, peak) in results.items()}
+
+def regressions(results, baselines, threshold):
+    # Descriptions of every phase worse than its baseline by more than the threshold
+    found = []
+    for size, phases in results.items():
+        for phase, result in phases.items():
+            baseline = baselines.get(size, {}).get(phase)
+            if baseline is None:
+                continue
+            if result["lines_per_second"] < baseline["lines_per_second"] * (1 - threshold):
+                found.append(f"{size} {phase}: {result['lines_per_second']:,.0f} lines/s, baseline {baseline['lines_per_second']:,.0f} lines/s")
+            if result["peak_bytes"] > baseline["peak_bytes"] * (1 + threshold):
+                found.append(f"{size} {phase}: peak {result['peak_bytes'] / 2 ** 20:.1f} MB, baseline {baseline['peak_bytes'] / 2 ** 20:.1f} MB")
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the Maple compiler phases on synthetic programs")
+    parser.add_argument("--sizes", nargs="+", choices=list(sizes), default=["1k", "100k"], help="Corpus sizes to run")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs of every phase, the best one counts")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed regression, as a fraction of the baseline")
+    parser.add_argument("--baselines", default=default_baselines, help="JSON file the baselines are stored in")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baselines of the sizes that were run")
+    parser.add_argument("--corpus-dir", default=None, help="Where the corpora are generated, a temporary directory by default")
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, "r") as f:
+            baselines = json.load(f)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {size: bench_size(size, args.corpus_dir or directory, args.runs) for size in args.sizes}
+
+    print(f"{'size':>6}  {'phase':<10} {'lines/s':>12} {'peak MB':>9} {'baseline':>12}")
+    for size, phases in results.items():
+        for phase, result in phases.items():
+            baseline = baselines.get(size, {}).get(phase)
+            change = f"{result['lines_per_second'] / baseline['lines_per_second'] - 1:+.1%}" if baseline else "none"
+            print(f"{size:>6}  {phase:<10} {result['lines_per_second']:>12,.0f} {result['peak_bytes'] / 2 ** 20:>9.1f} {change:>12}")
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=4)
+        print(f"Baselines saved to {args.baselines}")
+        sys.exit(0)
+
+    found = regressions(results, baselines, args.threshold)
+    for regression in found:
+        print(f"Regression: {regression}", file=sys.stderr)
+    sys.exit(1 if found else 0)
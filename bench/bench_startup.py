@@ -0,0 +1,58 @@
+# Startup latency of a small program, from launching the compiler to the first line the program prints
+# Compares the bytecode interpreter (--interp) with compiling and running the native binary, cold (--no-cache) and cached
+# Usage: python bench/bench_startup.py [runs], run from anywhere (the compiler is started from the repository root)
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+compiler = os.path.join(root, "src", "maple", "MapleCompiler.py")
+
+program = """init @startup
+dec ch i32 total 0
+loop i 0 .. 100
+    add total i
+end
+out total
+"""
+
+def first_output(program_path, flags):
+    # Milliseconds from starting the compiler to the first line written by the program
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, compiler, program_path, *flags], cwd=root, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    elapsed = (time.perf_counter() - start) * 1000
+    process.communicate()
+    if process.returncode != 0 or not line:
+        raise RuntimeError(f"{' '.join(flags) or 'compile'} failed")
+    return elapsed
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    modes = {
+        "interp": ["--interp", "--no-cache"],
+        "compile+run (cold)": ["--no-cache"],
+        "compile+run (cached)": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="maple_startup_") as directory:
+        program_path = os.path.join(directory, "startup.mpl")
+        with open(program_path, "w") as f:
+            f.write(program)
+        try:
+            first_output(program_path, []) # Fills the cache for the cached runs
+            for mode, flags in modes.items():
+                times = [first_output(program_path, flags) for _ in range(runs)]
+                print(f"{mode:<22} median {median(times):8.1f} ms  best {min(times):8.1f} ms")
+        finally:
+            # The compiler writes the C++ code and the binary next to the other generated programs
+            for extension in (".cpp", ".cpp.exe"):
+                path = os.path.join(root, "src", "files", "cpp", "startup_Maple" + extension)
+                if os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,120 @@
+# Synthetic Maple programs for the pipeline benchmarks: many functions, deep if/loop nesting, large array literals and lots of lib @ imports
+# Usage: python bench/generate_corpus.py lines directory [seed]
+# Writes directory/corpus.mpl and the libraries it imports into directory/lib/
+import os
+import sys
+import random
+
+sizes = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+
+class CorpusGenerator:
+    # Every variable and loop variable gets a new name, the parser doesn't allow declaring a name twice
+    def __init__(self, seed=0, libraries=16, library_functions=8, max_depth=8, array_size=256):
+        self.random = random.Random(seed)
+        self.libraries = libraries
+        self.library_functions = library_functions
+        self.max_depth = max_depth
+        self.array_size = array_size
+        self.names = 0
+        self.functions = [] # (name, number of arguments) of the program functions generated so far
+
+    def name(self, prefix):
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def block(self, lines, depth, indent, variables, budget, declared=()):
+        # Appends about budget lines of statements, nesting ifs and loops up to max_depth
+        # Only the declared variables can be changed, the arguments are only read
+        spaces = "    " * indent
+        declared = list(declared)
+        end = len(lines) + budget
+        while len(lines) < end:
+            choice = self.random.random()
+            if choice < 0.2 or not declared:
+                variable = self.name("v")
+                lines.append(f"{spaces}dec ch i32 {variable} {self.random.randint(0, 1000)}")
+                variables = variables + [variable]
+                declared.append(variable)
+            elif choice < 0.45:
+                operation = self.random.choice(("add", "sub", "mul", "div", "mod"))
+                right = str(self.random.randint(1, 9)) if operation in ("div", "mod") else self.random.choice(variables)
+                lines.append(f"{spaces}{operation} {self.random.choice(variables)} {right} => {self.random.choice(declared)}")
+            elif choice < 0.55:
+                lines.append(f"{spaces}set {self.random.choice(declared)} {self.random.randint(0, 100)}")
+            elif choice < 0.65:
+                lines.append(f"{spaces}out {self.random.choice(variables)}")
+            elif choice < 0.8 and depth < self.max_depth:
+                comparison = self.random.choice(("<", ">", "<=", ">=", "==", "!="))
+                lines.append(f"{spaces}if {self.random.choice(variables)} {comparison} {self.random.randint(0, 500)}")
+                self.block(lines, depth + 1, indent + 1, variables, max(1, budget // 4), declared)
+                lines.append(f"{spaces}end")
+                if self.random.random() < 0.3:
+                    lines.append(f"{spaces}else")
+                    self.block(lines, depth + 1, indent + 1, variables, max(1, budget // 8), declared)
+                    lines.append(f"{spaces}end")
+            elif depth < self.max_depth:
+                lines.append(f"{spaces}loop {self.name('i')} 0 .. {self.random.randint(1, 16)}")
+                self.block(lines, depth + 1, indent + 1, variables, max(1, budget // 4), declared)
+                lines.append(f"{spaces}end")
+            else:
+                lines.append(f"{spaces}out {self.random.choice(variables)}")
+
+    def function(self, lines, prefix="f"):
+        name = self.name(prefix)
+        arguments = [self.name("a") for _ in range(self.random.randint(0, 3))]
+        lines.append(f"fnc i32 {name} : " + ", ".join(f"i32 {argument}" for argument in arguments) + " :")
+        self.block(lines, 0, 1, arguments, self.random.randint(5, 40))
+        lines.append(f"    rtn {arguments[0] if arguments else 0}")
+        lines.append("end")
+        return name, len(arguments)
+
+    def array(self, lines):
+        size = self.random.randint(self.array_size // 2, self.array_size)
+        values = ", ".join(str(self.random.randint(0, 30000)) for _ in range(size))
+        lines.append(f"dec i16 {self.name('arr')}[] {size} -> {{{values}}}")
+
+    def library(self, index):
+        # The source of a library, with its function names and number of arguments
+        lines = [f"init @benchlib{index}"]
+        functions = [self.function(lines, "l") for _ in range(self.library_functions)]
+        return "\n".join(lines) + "\n", functions
+
+    def program(self, line_count, library_functions):
+        lines = ["init @corpus"]
+        lines.extend(f"lib @{library}" for library in library_functions)
+        while len(lines) < line_count:
+            choice = self.random.random()
+            if choice < 0.4:
+                self.functions.append(self.function(lines))
+            elif choice < 0.5:
+                self.array(lines)
+            elif choice < 0.75 and library_functions:
+                library = self.random.choice(list(library_functions))
+                name, arguments = self.random.choice(library_functions[library])
+                lines.append(f"@{library}::{name} : " + ", ".join(str(self.random.randint(0, 9)) for _ in range(arguments)) + " :")
+            elif choice < 0.85 and self.functions:
+                name, arguments = self.random.choice(self.functions)
+                lines.append(f"{name} : " + ", ".join(str(self.random.randint(0, 9)) for _ in range(arguments)) + " :")
+            else:
+                self.block(lines, 0, 0, [], self.random.randint(5, 60))
+        return "\n".join(lines) + "\n"
+
+def generate(line_count, directory, seed=0):
+    # Writes the corpus and its libraries, returns the path of the program
+    generator = CorpusGenerator(seed)
+    os.makedirs(os.path.join(directory, "lib"), exist_ok=True)
+    library_functions = {}
+    for index in range(generator.libraries):
+        source, functions = generator.library(index)
+        with open(os.path.join(directory, "lib", f"benchlib{index}.mal"), "w") as f:
+            f.write(source)
+        library_functions[f"benchlib{index}"] = functions
+
+    program_path = os.path.join(directory, "corpus.mpl")
+    with open(program_path, "w") as f:
+        f.write(generator.program(line_count, library_functions))
+    return program_path
+
+if __name__ == "__main__":
+    line_count = sizes.get(sys.argv[1]) or int(sys.argv[1])
+    print(generate(line_count, sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 0))
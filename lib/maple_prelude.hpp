@@ -0,0 +1,16 @@
+// Every standard header a Maple program can use, precompiled once into maple_prelude.hpp.gch
+#ifndef MAPLE_PRELUDE_HPP
+#define MAPLE_PRELUDE_HPP
+
+#include <iostream>
+#include <string>
+#include <vector>
+#include <fstream>
+#include <sstream>
+#include <algorithm>
+#include <random>
+#include <chrono>
+#include <map>
+#include <cstdint>
+
+#endif
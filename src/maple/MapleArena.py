@@ -0,0 +1,179 @@
+import sys
+from array import array
+
+class NodeIndex(int):
+    # An operand that is a node of the arena, like the condition of an if or the call of a declaration
+    __slots__ = ()
+
+class ASTArena:
+    # The AST in parallel arrays instead of node objects, for programs whose tree doesn't fit in memory as objects
+    # The parser packs every node as soon as it's appended to a block (see BlockBuilder), so the tree never exists as objects
+    # Nodes are stored in the order they're finished: the nodes of a block come before the node owning the block
+    # The operands of a node are the values of the slots of its class, in the order of the slots
+    # The block of a node (its children, or the body of a function) is the range [block_starts, block_ends) of block_items
+    def __init__(self):
+        self.classes = [] # Kind -> node class
+        self.type_names = [] # Kind -> node type, like "DEC"
+        self.fields = [] # Kind -> slots stored as operands, the body of a function is its block instead
+        self.has_block = [] # Kind -> whether the nodes of that kind have a block, even an empty one
+        self.kind_codes = {} # Node class -> kind
+        self.kinds = array("B")
+        self.operand_starts = array("I") # Position of the first operand of every node in the operands
+        self.block_starts = array("I")
+        self.block_ends = array("I")
+        self.block_items = array("I") # Indexes of the nodes of every block, each block in one piece
+        self.operands = []
+        self.strings = {} # Every operand string once, the names and literals repeat a lot
+
+    def block(self):
+        return BlockBuilder(self)
+
+    def add(self, node):
+        # Packs the node and the nodes its operands refer to, returns its index
+        # Its block was packed while it was parsed, only the indexes of its nodes are copied
+        node_class = type(node)
+        kind = self.kind_codes.get(node_class)
+        if kind is None:
+            kind = self.kind_codes[node_class] = len(self.classes)
+            self.classes.append(node_class)
+            self.type_names.append(node.type)
+            self.fields.append(tuple(field for field in node_class.__slots__ if field != "body"))
+            self.has_block.append(node.type == "FUNC" or not isinstance(node.children, tuple))
+        index = len(self.kinds)
+        self.kinds.append(kind)
+        self.operand_starts.append(0)
+        self.block_starts.append(0)
+        self.block_ends.append(0)
+
+        operands = []
+        for field in self.fields[kind]:
+            value = getattr(node, field)
+            if isinstance(value, str):
+                value = self.strings.setdefault(value, value)
+            elif hasattr(value, "type"): # A node
+                value = NodeIndex(self.add(value))
+            operands.append(value)
+        self.operand_starts[index] = len(self.operands) # After the operands of the nodes they refer to
+        self.operands.extend(operands)
+
+        if self.has_block[kind]:
+            block = node.body if node.type == "FUNC" else node.children
+            indexes = block.indexes if isinstance(block, BlockBuilder) else [self.add(child) for child in block]
+            self.block_starts[index] = len(self.block_items)
+            self.block_items.extend(indexes)
+            self.block_ends[index] = len(self.block_items)
+        return index
+
+    def root(self, builder):
+        # The top level block, once the whole file is parsed
+        start = len(self.block_items)
+        self.block_items.extend(builder.indexes)
+        return ArenaBlock(self, self.block_items, start, len(self.block_items))
+
+    def node(self, index):
+        # A node object for one visit, its block stays in the arena and its own nodes are made when it's iterated
+        kind = self.kinds[index]
+        node_class = self.classes[kind]
+        node = node_class.__new__(node_class)
+        node.type = self.type_names[kind]
+        fields = self.fields[kind]
+        start = self.operand_starts[index]
+        for field, value in zip(fields, self.operands[start:start + len(fields)]):
+            setattr(node, field, self.node(value) if value.__class__ is NodeIndex else value)
+        block = ArenaBlock(self, self.block_items, self.block_starts[index], self.block_ends[index]) if self.has_block[kind] else ()
+        if node.type == "FUNC":
+            node.body, node.children = block, ()
+        else:
+            node.children = block
+        return node
+
+    def preorder(self, block):
+        # Index of every node of the block and of the blocks inside it, like iter_nodes without making any node
+        items, starts, ends = self.block_items, self.block_starts, self.block_ends
+        pending = [iter(block.indexes())]
+        while pending:
+            for index in pending[-1]:
+                yield index
+                if starts[index] != ends[index]:
+                    pending.append(iter(items[starts[index]:ends[index]]))
+                    break
+            else:
+                pending.pop()
+
+    def walk(self, block, node_types=None):
+        # The nodes of the block and of the blocks inside it, only the ones of the given types are made
+        kinds = self.kinds
+        wanted = [node_types is None or type_name in node_types for type_name in self.type_names] # Kind -> made or not
+        for index in self.preorder(block):
+            if wanted[kinds[index]]:
+                yield self.node(index)
+
+    def memory(self):
+        # Bytes taken by the arrays and the operand list, the operand strings are left out like for the node objects
+        parts = (self.kinds, self.operand_starts, self.block_starts, self.block_ends, self.block_items, self.operands)
+        return sum(sys.getsizeof(part) for part in parts) + sum(sys.getsizeof(value) for value in self.operands if value.__class__ is NodeIndex)
+
+class BlockBuilder:
+    # Block being parsed into an arena, each node is packed when it's appended and only its index is kept
+    __slots__ = ("arena", "indexes")
+
+    def __init__(self, arena):
+        self.arena = arena
+        self.indexes = array("I")
+
+    def append(self, node):
+        self.indexes.append(self.arena.add(node))
+
+class ArenaBlock:
+    # A block of an arena, iterating it makes the node objects one at a time
+    # It's made again every time the node owning it is, the position of its items tells the copies apart
+    __slots__ = ("arena", "items", "start", "end")
+
+    def __init__(self, arena, items, start, end):
+        self.arena = arena
+        self.items = items
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        node, items = self.arena.node, self.items
+        for position in range(self.start, self.end):
+            yield node(items[position])
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.end - self.start:
+            raise IndexError(position)
+        return self.arena.node(self.items[self.start + position])
+
+    @property
+    def key(self):
+        return (id(self.items), self.start, self.end)
+
+    def indexes(self):
+        return self.items[self.start:self.end]
+
+    def only(self, *node_types):
+        # The block with only the nodes of the given types, found by their kind without making the others
+        kinds = {kind for kind, type_name in enumerate(self.arena.type_names) if type_name in node_types}
+        node_kinds = self.arena.kinds
+        items = array("I", (index for index in self.indexes() if node_kinds[index] in kinds))
+        return ArenaBlock(self.arena, items, 0, len(items))
+
+    def without(self, *node_types):
+        # The block without the nodes of the given types, found by their kind without making them
+        kinds = {kind for kind, type_name in enumerate(self.arena.type_names) if type_name in node_types}
+        node_kinds = self.arena.kinds
+        items = array("I", (index for index in self.indexes() if node_kinds[index] not in kinds))
+        return ArenaBlock(self.arena, items, 0, len(items))
+
+    def retain(self, keep):
+        # Keeps only the nodes keep returns True for, the nodes removed stay in the arena but no block has them anymore
+        items = array("I", (index for index in self.indexes() if keep(self.arena.node(index))))
+        self.items, self.start, self.end = items, 0, len(items)
+
+def block_key(block):
+    # Identity of a block for the passes keying things by block, node lists are the same object on every visit
+    return block.key if isinstance(block, ArenaBlock) else id(block)
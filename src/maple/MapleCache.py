@@ -0,0 +1,205 @@
+import os
+import re
+import glob
+import shutil
+import pickle
+import hashlib
+import threading
+import subprocess
+from functools import lru_cache
+
+from MapleError import MapleError
+
+folders = ("sources", "cpp", "bin", "libraries", "profiles")
+
+library_regex = re.compile(rb"\blib @(\w+)") # Libraries imported by a source file
+
+def hash_file(path, digest=None):
+    # Hashes the file in blocks, so big sources are never fully loaded in memory
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 16):
+            digest.update(block)
+    return digest
+
+@lru_cache(maxsize=None)
+def compiler_version(compiler):
+    # The first line of "g++ --version", a different compiler means different binaries
+    try:
+        result = subprocess.run([compiler, "--version"], capture_output=True, text=True)
+    except OSError:
+        raise MapleError(f"C++ compiler '{compiler}' not found")
+    return result.stdout.split("\n")[0]
+
+@lru_cache(maxsize=None)
+def transpiler_version():
+    # Hash of the Maple compiler itself, so a change to the transpiler never reuses old C++ code
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+        hash_file(path, digest)
+    return digest.hexdigest()
+
+def library_sources(file_path, library_dir="lib"):
+    # Every library the file imports, following the imports of the libraries too
+    libraries = []
+    pending = [file_path]
+    while pending:
+        with open(pending.pop(), "rb") as f:
+            names = library_regex.findall(f.read())
+        for name in names:
+            library_path = os.path.join(library_dir, name.decode() + ".mal")
+            if library_path not in libraries and os.path.exists(library_path):
+                libraries.append(library_path)
+                pending.append(library_path)
+    return sorted(libraries)
+
+def library_header(library_path, buffered_output=False):
+    # Header a library is transpiled to, next to it, one for each output mode since out doesn't flush in buffered programs
+    return os.path.splitext(library_path)[0] + (".buffered.hpp" if buffered_output else ".hpp")
+
+def write_if_changed(path, text):
+    # Leaves the file (and its modification time) alone when it already has this content
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            if f.read() == text:
+                return False
+    with open(path, "w") as f:
+        f.write(text)
+    return True
+
+def replace_file(temporary_path, path):
+    # Moves a fully written file over the cache entry, so parallel builds never read a half written entry
+    os.replace(temporary_path, path)
+    return path
+
+def temporary_path(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp" # Unique for every process and thread
+
+class MapleCache:
+    # Content-addressed build cache
+    # sources/<key> maps the hash of a source (and everything it depends on) to the hash of the C++ code it transpiled to
+    # cpp/<key>.cpp and bin/<key>.exe are keyed by the hash of the C++ code, so sources giving the same code share the binary
+    # libraries/<key>.pickle holds the AST and the header code of a library, keyed by the hash of the library source
+    # profiles/<key>.gcda holds the profile of a PGO training run, keyed by the hash of the C++ code and of the training
+    def __init__(self, cache_dir=".maple_cache", max_size=512 * 1024 * 1024):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size # In bytes, the least recently used entries are evicted past it
+        for folder in folders:
+            os.makedirs(os.path.join(self.cache_dir, folder), exist_ok=True)
+
+    def path(self, folder, key, extension=""):
+        return os.path.join(self.cache_dir, folder, key + extension)
+
+    def source_key(self, file_path, compiler, flags, options=()): # Options change the generated code, like the prelude
+        digest = hashlib.sha256()
+        digest.update(transpiler_version().encode())
+        digest.update(" ".join(options).encode())
+        digest.update(compiler_version(compiler).encode())
+        digest.update(" ".join(flags).encode())
+        hash_file(file_path, digest)
+        for library_path in library_sources(file_path):
+            digest.update(library_path.encode())
+            hash_file(library_path, digest)
+        return digest.hexdigest()
+
+    def cpp_key(self, cpp_path, compiler, flags, headers=()):
+        # The included library headers are part of what g++ compiles, so they are part of the key
+        digest = hashlib.sha256()
+        digest.update(compiler_version(compiler).encode())
+        digest.update(" ".join(flags).encode())
+        hash_file(cpp_path, digest)
+        for header_path in headers:
+            hash_file(header_path, digest)
+        return digest.hexdigest()
+
+    @staticmethod
+    def library_key(library_path, buffered_output=False):
+        digest = hashlib.sha256()
+        digest.update(transpiler_version().encode())
+        digest.update(b"buffered" if buffered_output else b"flushed") # Same source, different code
+        return hash_file(library_path, digest).hexdigest()
+
+    def touch(self, path):
+        os.utime(path) # The modification time is used as the last use time for the LRU eviction
+        return path
+
+    def lookup_source(self, source_key):
+        # Returns the key of the C++ code the source transpiled to, if it's still cached
+        source_path = self.path("sources", source_key)
+        if not os.path.exists(source_path):
+            return None
+        with open(source_path, "r") as f:
+            cpp_key = f.read()
+        if not os.path.exists(self.path("cpp", cpp_key, ".cpp")):
+            return None
+        self.touch(source_path)
+        return cpp_key
+
+    def lookup_cpp(self, cpp_key):
+        cpp_path = self.path("cpp", cpp_key, ".cpp")
+        return self.touch(cpp_path) if os.path.exists(cpp_path) else None
+
+    def lookup_binary(self, cpp_key):
+        binary_path = self.path("bin", cpp_key, ".exe")
+        return self.touch(binary_path) if os.path.exists(binary_path) else None
+
+    def store_source(self, source_key, cpp_key, cpp_path):
+        cache_path = self.path("cpp", cpp_key, ".cpp")
+        shutil.copyfile(cpp_path, temporary_path(cache_path))
+        replace_file(temporary_path(cache_path), cache_path)
+        source_path = self.path("sources", source_key)
+        with open(temporary_path(source_path), "w") as f:
+            f.write(cpp_key)
+        replace_file(temporary_path(source_path), source_path)
+        self.evict()
+
+    def store_binary(self, cpp_key, binary_path):
+        cache_path = self.path("bin", cpp_key, ".exe")
+        shutil.copy2(binary_path, temporary_path(cache_path))
+        self.touch(replace_file(temporary_path(cache_path), cache_path))
+        self.evict()
+
+    def lookup_library(self, library_key):
+        # Returns the (AST, header code) of the library, if it's still cached
+        library_path = self.path("libraries", library_key, ".pickle")
+        if not os.path.exists(library_path):
+            return None
+        with open(self.touch(library_path), "rb") as f:
+            return pickle.load(f)
+
+    def store_library(self, library_key, nodes, cpp_code):
+        library_path = self.path("libraries", library_key, ".pickle")
+        with open(temporary_path(library_path), "wb") as f:
+            pickle.dump((nodes, cpp_code), f)
+        replace_file(temporary_path(library_path), library_path)
+        self.evict()
+
+    def lookup_profile(self, profile_key):
+        profile_path = self.path("profiles", profile_key, ".gcda")
+        return self.touch(profile_path) if os.path.exists(profile_path) else None
+
+    def store_profile(self, profile_key, profile_path):
+        cache_path = self.path("profiles", profile_key, ".gcda")
+        shutil.copyfile(profile_path, temporary_path(cache_path))
+        replace_file(temporary_path(cache_path), cache_path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for folder in folders:
+            for entry in os.scandir(os.path.join(self.cache_dir, folder)):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # Evicted by another build running at the same time
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries): # Oldest first
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import subprocess
+
+# Thin client of the MapleServer, it only imports the standard library so it starts as fast as Python does
+# Messages are JSON objects, one per line
+
+default_socket = ".maple_server.sock"
+
+def send_message(stream, message):
+    stream.write(json.dumps(message).encode() + b"\n")
+    stream.flush()
+
+def receive_message(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+def request(message, socket_path=default_socket):
+    # Sends one request to the server and waits for its response
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile("rwb") as stream:
+            send_message(stream, message)
+            response = receive_message(stream)
+    if response is None:
+        raise ConnectionError("The server closed the connection without answering")
+    return response
+
+if __name__ == "__main__":
+    # The options of MapleCompiler.py for one file, --watch is left out since the server doesn't keep watching files for a client
+    parser = argparse.ArgumentParser(description="Compiles Maple code through a running MapleServer")
+    parser.add_argument("file", help="The .mpl file to compile and run")
+    parser.add_argument("--socket", default=default_socket, help="Unix socket the server listens on")
+    parser.add_argument("--cpp", action="store_true", help="Only transpile, printing the C++ code")
+    parser.add_argument("--no-cache", action="store_true", help="Always rebuild, without reading or writing the build cache")
+    parser.add_argument("--cache-size", type=int, default=512, help="Maximum size of the build cache in MB")
+    parser.add_argument("--prelude", action="store_true", help="Include the shared precompiled prelude instead of only the needed headers")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Parallel library imports in the worker, one by default since the workers are the parallelism")
+    parser.add_argument("--incremental", action="store_true", help="Compile every function on its own and only recompile the functions that changed")
+    parser.add_argument("--profile", default="debug", help="Compiler flags to build with")
+    parser.add_argument("--no-run", action="store_true", help="Only build the program, without running it")
+    parser.add_argument("--pgo", action="store_true", help="Profile guided build, trains an instrumented binary then rebuilds with its profile")
+    parser.add_argument("--pgo-train", default=None, help="Shell command of the training run, {binary} is replaced by the instrumented binary")
+    parser.add_argument("--pgo-input", default=None, help="File given as the input of the training run")
+    parser.add_argument("--no-optimize", action="store_true", help="Transpile the code as it's written, without folding the constants")
+    parser.add_argument("--no-shake", action="store_true", help="Emit every function, even the ones the program never calls")
+    parser.add_argument("--buffered-output", action=argparse.BooleanOptionalAction, default=None, help="Print through a big buffer instead of flushing every out, on by default in release profiles")
+    parser.add_argument("--bench", action="store_true", help="Benchmark the code after run, printing min, median, mean and p99 instead of the output")
+    parser.add_argument("--bench-warmup", type=int, default=1, help="Runs discarded before the measured ones")
+    parser.add_argument("--interp", action="store_true", help="Run the program in the bytecode interpreter of the server instead of compiling it with g++")
+    parser.add_argument("--timings", default=None, help="Write the time of every step and the counters (tokens, nodes, bytes emitted) to this JSON file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the compiler diagnostics and the time of every build step")
+    args = parser.parse_args()
+
+    message = {
+        "file": os.path.abspath(args.file),
+        "cwd": os.getcwd(), # The libraries and the output directory are relative to it
+        "output": "cpp" if args.cpp else "binary",
+        "run": not args.no_run, # Only used by the interpreter, the binaries run here
+        "options": {
+            "use_cache": not args.no_cache,
+            "cache_size": args.cache_size,
+            "prelude": args.prelude,
+            "incremental": args.incremental,
+            "profile": args.profile,
+            "pgo": args.pgo,
+            "train_command": args.pgo_train,
+            "train_input": os.path.abspath(args.pgo_input) if args.pgo_input else None,
+            "optimize": not args.no_optimize,
+            "shake": not args.no_shake,
+            "buffered_output": args.buffered_output,
+            "bench": args.bench_warmup if args.bench else None,
+            "interp": args.interp,
+        },
+    }
+    if args.jobs is not None:
+        message["options"]["jobs"] = args.jobs
+    try:
+        response = request(message, args.socket)
+    except OSError as error:
+        sys.exit(f"Can't reach the Maple server on {args.socket}: {error}")
+
+    if args.verbose:
+        print("".join(note + "\n" for note in response.get("notes", [])), end="", file=sys.stderr)
+        print(response.get("diagnostics", ""), end="", file=sys.stderr)
+        print("".join(f"{seconds * 1000:10.1f} ms  {name}\n" for name, seconds in response.get("steps", [])), end="", file=sys.stderr)
+        print("".join(f"{amount:13,}  {name}\n" for name, amount in response.get("counters", {}).items()), end="", file=sys.stderr)
+    if not response["ok"]:
+        sys.exit(response["error"])
+    if args.timings:
+        with open(args.timings, "w") as f:
+            json.dump(response["metrics"], f, indent=4)
+
+    if args.cpp:
+        print(response["cpp"], end="")
+    elif args.interp:
+        print(response["output"], end="")
+    elif not args.no_run:
+        # The program runs here, so it prints to this terminal
+        binary_path = response["binary"]
+        if not args.bench:
+            sys.exit(subprocess.run([binary_path], cwd=os.path.dirname(binary_path), stdin=subprocess.DEVNULL).returncode)
+        # The benchmark prints its report as text on stderr and as JSON on stdout, the JSON is written next to the binary
+        result = subprocess.run([binary_path], cwd=os.path.dirname(binary_path), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            sys.exit(result.returncode)
+        with open(binary_path + ".bench.json", "w") as f:
+            json.dump(json.loads(result.stdout.strip().splitlines()[-1]), f, indent=4)
+        print(f"Benchmark results written to {binary_path}.bench.json", file=sys.stderr)
@@ -1,47 +1,399 @@
 import os
+import sys
+import json
+import time
+import shutil
+import hashlib
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from MapleLexer import MapleLexer
-from MapleParser import MapleParser
+from MapleParser import MapleParser, MapleLoader, LibraryTable, load_library, library_nodes, iter_nodes
 from MapleTranspiler import MapleTranspiler
+from MapleOptimizer import MapleOptimizer
+from MapleTreeShaker import MapleTreeShaker
+from MapleArena import ASTArena
+from MapleVM import MapleBytecodeCompiler, MapleVM
+from MapleWatch import MapleWatcher
 from MapleError import MapleError
+import MapleProject
+from MapleCache import MapleCache, library_header, library_sources, compiler_version, hash_file, write_if_changed
+from MapleDriver import MapleDriver, profiles
+
+prelude_path = "lib/maple_prelude.hpp"
+
+def build_prelude(driver):
+    # Precompiles the prelude into a .gch next to it, g++ only uses it when it was built with the same flags
+    # so it's rebuilt when the compiler or the flags change
+    gch_path = prelude_path + ".gch"
+    signature_path = gch_path + ".flags"
+    signature = f"{compiler_version(driver.compiler)} {' '.join(driver.flags)}"
+
+    if os.path.exists(gch_path) and os.path.exists(signature_path) and os.path.getmtime(gch_path) >= os.path.getmtime(prelude_path):
+        with open(signature_path, "r") as f:
+            if f.read() == signature:
+                return
+
+    driver.compile([prelude_path], gch_path, ["-x", "c++-header"])
+    with open(signature_path, "w") as f:
+        f.write(signature)
+
+def build_units(ast, base_name, cpp_dir, binary_path, headers, driver, prelude=False, libraries=None, bench=None):
+    # Incremental build: every function is its own translation unit in src/files/cpp/{name}_units/
+    # only the units whose code (or the declarations and headers they include) changed are compiled again, then everything is linked
+    units_dir = os.path.join(cpp_dir, base_name + "_units")
+    os.makedirs(units_dir, exist_ok=True)
+    with driver.timed("transpile"):
+        transpiler = MapleTranspiler(ast, prelude=prelude, libraries=libraries, buffered_output=driver.buffered_output, bench=bench is not None, bench_warmup=bench or 0)
+        units = transpiler.transpile_units(base_name)
+    driver.count("cpp_bytes", sum(len(code.encode()) for code in units.values()))
+
+    # Every unit includes the declarations header and the library headers
+    digest = hashlib.sha256()
+    digest.update(compiler_version(driver.compiler).encode())
+    digest.update(" ".join(driver.flags).encode())
+    digest.update(units[f"{base_name}_decls.hpp"].encode())
+    for header_path in headers:
+        hash_file(header_path, digest)
+    shared_key = digest.hexdigest()
+
+    objects = []
+    relink = not os.path.exists(binary_path)
+    for unit_name, code in units.items():
+        unit_path = os.path.join(units_dir, unit_name)
+        write_if_changed(unit_path, code)
+        if not unit_name.endswith(".cpp"):
+            continue
+
+        # The key of the code an object was compiled from is stored next to it
+        object_path = os.path.splitext(unit_path)[0] + ".o"
+        key_path = object_path + ".key"
+        key = hashlib.sha256((shared_key + code).encode()).hexdigest()
+        objects.append(object_path)
+        if os.path.exists(object_path) and os.path.exists(key_path):
+            with open(key_path, "r") as f:
+                if f.read() == key:
+                    continue
+
+        # The library includes are relative to src/files/cpp, so it's added to the include path
+        driver.compile([unit_path], object_path, ["-I", cpp_dir, "-c"])
+        with open(key_path, "w") as f:
+            f.write(key)
+        relink = True
+
+    # Removing the units of functions that don't exist anymore
+    kept = set(units) | {os.path.basename(path) for path in objects} | {os.path.basename(path) + ".key" for path in objects}
+    for entry in os.scandir(units_dir):
+        if entry.name not in kept:
+            os.remove(entry.path)
+            relink = True
+
+    if relink:
+        driver.compile(objects, binary_path)
+
+def parse_source(file, driver, cache=None, optimize=True, shake=True, jobs=1, loader=None, inline_libraries=False, arena=False):
+    # Returns the AST and, when tree shaking, the libraries with only the functions the program uses
+    # With arena the program is parsed into an ASTArena and an ArenaBlock of its top level is returned, the optimizer rewrites
+    # node objects so it doesn't run on it
+    # With inline_libraries the libraries are returned whole when they aren't shaken, so they're emitted in the program too
+    # The libraries are loaded before the file is parsed, up to jobs of them at once, the ones the loader already has are reused
+    # The tokens are streamed from the file straight into the parser, the file is never fully loaded in memory
+    # so the lexer and the imports time themselves, and the parsing is what's left
+    start = time.perf_counter()
+    loader = loader or MapleLoader(cache, jobs=jobs, buffered_output=driver.buffered_output)
+    loader.preload(file)
+    with open(file, "r") as source_file:
+        lexer = MapleLexer(source_file)
+        parser = MapleParser(lexer.iter_tokens(), cache, loader, ASTArena() if arena else None)
+        ast = parser.parse() # Abstract Syntax Tree
+    seconds = time.perf_counter() - start
+    driver.record("lex", lexer.seconds)
+    if loader.modules:
+        driver.record("import libraries", loader.seconds)
+    driver.record("parse", seconds - lexer.seconds - loader.seconds)
+    driver.count("tokens", lexer.token_count)
+    driver.count("nodes", len(parser.arena.block_items) if arena else sum(1 for _ in iter_nodes(ast))) # Every node of the arena is in one block
+    driver.count("libraries", len(loader.modules))
+
+    if optimize and arena:
+        driver.note("The optimizer doesn't run on the arena, the code is transpiled as it's written")
+    elif optimize:
+        with driver.timed("optimize"):
+            MapleOptimizer(ast).optimize()
+
+    libraries = None
+    if shake: # After the optimizer, the calls in the branches it removed don't count
+        with driver.timed("shake"):
+            shaker = MapleTreeShaker(ast, library_nodes(ast, loader=loader))
+            libraries = shaker.shake()
+        driver.note(shaker.report())
+    elif inline_libraries:
+        libraries = library_nodes(ast, loader=loader)
+
+    return ast, libraries
+
+def transpile_source(file, driver, cache=None, prelude=False, optimize=True, shake=True, bench=None, jobs=1, loader=None, name=None, arena=False): # bench is the number of warm-up runs
+    # Transpiles the .mpl file into src/files/cpp/{name}_Maple.cpp, returns its path and the cache key of the code
+    # The name defaults to the file name without its extension
+    file_name = (name or os.path.splitext(os.path.basename(file))[0]) + "_Maple.cpp"
+    cpp_dir = os.path.abspath("src/files/cpp") # Goes back one directory, then into files/
+    file_path = os.path.join(cpp_dir, file_name) # Gets the file path
+
+    # Same source, libraries, compiler and flags as a previous build means the same C++ code
+    source_key = cpp_key = None
+    if cache is not None:
+        options = [option for option, enabled in (("prelude", prelude), ("optimize", optimize and not arena), ("shake", shake), ("buffered", driver.buffered_output), (f"bench{bench}", bench is not None)) if enabled]
+        source_key = cache.source_key(file, driver.compiler, driver.flags, options)
+        cpp_key = cache.lookup_source(source_key)
+        if cpp_key is not None and cache.lookup_binary(cpp_key) is None:
+            cpp_key = None # The library headers might be gone too, so the source is transpiled again
+
+    if cpp_key is not None:
+        shutil.copyfile(cache.lookup_cpp(cpp_key), file_path)
+        return file_path, cpp_key
+
+    # The shared library headers are transpiled without bench mode, their out would print instead of keeping the value alive
+    ast, libraries = parse_source(file, driver, cache, optimize, shake, jobs, loader, inline_libraries=bench is not None, arena=arena)
+
+    # Creates the file, the C++ code is written into it while it's being transpiled
+    transpiler = MapleTranspiler(ast, prelude=prelude, libraries=libraries, buffered_output=driver.buffered_output, bench=bench is not None, bench_warmup=bench or 0)
+    with driver.timed("transpile"), open(file_path, "w") as cpp_file:
+        transpiler.transpile(cpp_file)
+    driver.count("cpp_bytes", os.path.getsize(file_path))
+
+    if cache is not None:
+        headers = [library_header(library_path, driver.buffered_output) for library_path in library_sources(file)]
+        if prelude:
+            headers.append(prelude_path)
+        cpp_key = cache.cpp_key(file_path, driver.compiler, driver.flags, headers)
+        cache.store_source(source_key, cpp_key, file_path)
+    return file_path, cpp_key
+
+def compile_cpp(file_path, driver, cpp_key=None, cache=None):
+    # Compiles the C++ file into {file_path}.exe, unless the same C++ code was already compiled
+    # The includes are relative to the C++ file, so this works from any directory
+    binary_path = file_path + ".exe"
+    cached_path = cache.lookup_binary(cpp_key) if cache is not None else None
+    if cached_path is not None:
+        shutil.copy2(cached_path, binary_path)
+        return binary_path
+
+    driver.compile([file_path], binary_path)
+    if cache is not None:
+        cache.store_binary(cpp_key, binary_path)
+    return binary_path
+
+def build_pgo(file_path, driver, cpp_key=None, cache=None, train_command=None, train_input=None):
+    # Profile guided build: an instrumented binary is run on the training workload, then the code is compiled again using its profile
+    # The profile is cached with the C++ code and the training, so it's reused as long as neither changes
+    binary_path = file_path + ".exe"
+    object_path = file_path + ".o" # Compiled on its own, so g++ names the profile after the object both times
+    profile_dir = file_path + ".pgo"
+    profile_path = os.path.join(profile_dir, os.path.splitdrive(os.path.splitext(object_path)[0])[1].lstrip(os.sep) + ".gcda")
+
+    profile_key = None
+    if cache is not None and cpp_key is not None:
+        digest = hashlib.sha256(f"{cpp_key} {train_command}".encode())
+        if train_input is not None:
+            hash_file(train_input, digest)
+        profile_key = digest.hexdigest()
+    cached_path = cache.lookup_profile(profile_key) if profile_key is not None else None
+
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    if cached_path is not None:
+        os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+        shutil.copyfile(cached_path, profile_path)
+    else:
+        instrumented_path = file_path + ".instrumented.exe"
+        driver.compile([file_path], object_path, [f"-fprofile-generate={profile_dir}", "-c"])
+        driver.compile([object_path], instrumented_path, [f"-fprofile-generate={profile_dir}"])
+
+        # The training command gets the instrumented binary in place of {binary}, by default it's just run
+        command = (train_command or "{binary}").replace("{binary}", instrumented_path)
+        with open(train_input or os.devnull, "r") as input_file:
+            driver.run("train", command, capture=False, shell=True, stdin=input_file, cwd=os.path.dirname(file_path))
+        if not os.path.exists(profile_path):
+            raise MapleError("The training run didn't write a profile, the program has to exit normally")
+        if profile_key is not None:
+            cache.store_profile(profile_key, profile_path)
+
+    driver.compile([file_path], object_path, [f"-fprofile-use={profile_dir}", "-Wno-missing-profile", "-c"])
+    driver.compile([object_path], binary_path)
+    return binary_path
 
 # :!python src\maple\MapleCompiler.py src\files\mpl\Test.mpl
-def MapleCompile(file) -> None:
-    with open(file, "r") as file:
-        source_code = file.read()
-        
-    lexer = MapleLexer(source_code)
-    tokens = lexer.tokenize()
-    print(tokens)
-    parser = MapleParser(tokens)
-    ast = parser.parse() # Abstract Syntax Tree
-    transpiler = MapleTranspiler(ast)
-    cpp_code = transpiler.transpile() 
-    
-    # Going back one directory, then going to files/ and creating a file called {file_Maple}.cpp
-    file_name = os.path.basename(file.name) # Gets the file name
+def MapleCompile(file, use_cache=True, cache_size=512, prelude=False, incremental=False, profile="debug", run=True, pgo=False, train_command=None, train_input=None, optimize=True, shake=True, buffered_output=None, bench=None, interp=False, hooks=(), jobs=None, name=None, library_table=None, arena=False) -> MapleDriver: # cache_size is in MB
+    # Returns the driver, with the time and the diagnostics of every step
+    # The outputs are named src/files/cpp/{name}_Maple.cpp(.exe), the name defaults to the file name without its extension
+    # With bench (the number of warm-up runs) the code after run is benchmarked, the results are written to {name}_Maple.cpp.bench.json
+    # With interp the program is compiled to bytecode and run by the MapleVM, without g++
+    # The hooks get every step and counter as it's recorded, see MapleDriver
+    # jobs is the number of libraries parsed at once, defaults to the number of cores
+    # library_table is the LibraryTable of a long running process, the libraries it has aren't loaded again
+    file_name = os.path.basename(file) # Gets the file name
     file_extension = os.path.splitext(file_name)[1] # Gets the file extension
 
     if file_extension != ".mpl":
         raise MapleError(f"Invalid file extension: {file_extension}", 0, 0)
 
-    file_name = os.path.splitext(file_name)[0] # Gets the file name without the extension
-    file_name = file_name + "_Maple.cpp" # Adds the _Maple.cpp extension
-    os.chdir("src/files/cpp") # Goes back one directory, then into files/
-    file_path = os.path.join(os.getcwd(), file_name) # Gets the file path
+    cache = MapleCache(max_size=cache_size * 1024 * 1024) if use_cache else None
+    cpp_dir = os.path.abspath("src/files/cpp")
+    driver = MapleDriver(profile, buffered_output=buffered_output, hooks=hooks)
+    jobs = jobs or os.cpu_count()
+    loader = MapleLoader(cache, jobs=jobs, buffered_output=driver.buffered_output, library_table=library_table) # Every step of the build gets the libraries from it, so each is parsed once
+    if interp:
+        if bench is not None:
+            raise MapleError("Benchmarks measure the native program, they can't run in the interpreter")
+        # The optimizer replaces constants by C++ literals, so the interpreter runs the code as it's written
+        ast, _ = parse_source(file, driver, cache, optimize=False, shake=False, loader=loader)
+        with driver.timed("compile bytecode"):
+            program = MapleBytecodeCompiler(ast, library_nodes(ast, loader=loader)).compile()
+        driver.count("bytecode_bytes", sum(len(function.code) * function.code.itemsize for function in [*program.functions, program.main]))
+        if run:
+            with driver.timed("interpret"):
+                MapleVM(program).run()
+        return driver
+
+    if prelude:
+        build_prelude(driver)
 
-    # Creates the file
-    with open(file_path, "w") as file:
-        file.write(cpp_code)
+    if incremental:
+        # The objects of the units are the cache here, the whole program cache is skipped
+        ast, libraries = parse_source(file, driver, cache, optimize, shake, loader=loader, inline_libraries=bench is not None, arena=arena)
 
-    # Compiles the file
-    os.system(f"g++ {file_path} -o {file_name}.exe")
-    os.system(f"{file_name}.exe")
+        headers = [library_header(library_path, driver.buffered_output) for library_path in library_sources(file)]
+        if prelude:
+            headers.append(prelude_path)
+        base_name = name or os.path.splitext(file_name)[0]
+        binary_path = os.path.join(cpp_dir, base_name + "_Maple.cpp.exe")
+        build_units(ast, base_name, cpp_dir, binary_path, headers, driver, prelude, libraries, bench)
+    else:
+        file_path, cpp_key = transpile_source(file, driver, cache, prelude, optimize, shake, bench, loader=loader, name=name, arena=arena)
+        if pgo:
+            binary_path = build_pgo(file_path, driver, cpp_key, cache, train_command, train_input)
+        else:
+            binary_path = compile_cpp(file_path, driver, cpp_key, cache)
+    driver.binary = binary_path
+
+    if run and bench is not None:
+        # The program prints the report as text on stderr and as JSON on stdout
+        step = driver.execute(binary_path, cwd=cpp_dir, capture_stdout=True)
+        results = json.loads(step.output.strip().splitlines()[-1])
+        with open(binary_path + ".bench.json", "w") as f:
+            json.dump(results, f, indent=4)
+        driver.note(f"Benchmark results written to {binary_path}.bench.json")
+    elif run:
+        driver.execute(binary_path, cwd=cpp_dir)
+    return driver
+
+def transpile_module(file, is_library, libraries, name, use_cache, cache_size, prelude, profile, optimize, shake, buffered_output, arena):
+    # Runs in a worker process of MapleBuild, so it gets its own handle on the build cache
+    # libraries has the (AST, header code) of every library the module imports, loaded by other workers before it, so they aren't parsed again
+    # Returns the result and the steps, the driver of the worker doesn't come back to the main process
+    cache = MapleCache(max_size=cache_size * 1024 * 1024) if use_cache else None
+    driver = MapleDriver(profile, buffered_output=buffered_output)
+    if is_library:
+        with driver.timed(f"load {os.path.basename(file)}"):
+            result = load_library(file, cache, MapleLoader(cache, resolved=libraries, buffered_output=driver.buffered_output)) # Writes the header of the library
+        return result, (driver.steps, driver.notes, driver.counters)
+    loader = MapleLoader(cache, modules=libraries, buffered_output=driver.buffered_output)
+    return transpile_source(file, driver, cache, prelude, optimize, shake, loader=loader, name=name, arena=arena), (driver.steps, driver.notes, driver.counters)
+
+def MapleBuild(paths, jobs=None, use_cache=True, cache_size=512, prelude=False, profile="debug", optimize=True, shake=True, buffered_output=None, hooks=(), arena=False) -> MapleDriver: # cache_size is in MB
+    # Builds every .mpl file of the given directories and files, without running them
+    # A module is transpiled in the process pool as soon as the libraries it imports are, and compiled by g++ in the
+    # job pool as soon as it's transpiled. Libraries are header only, so their header is written before any module including it is compiled
+    jobs = jobs or os.cpu_count()
+    modules = MapleProject.dependency_graph(paths)
+    order = MapleProject.build_order(modules) # Also makes sure there are no import cycles
+    names = MapleProject.output_names(modules)
+    cache = MapleCache(max_size=cache_size * 1024 * 1024) if use_cache else None
+    driver = MapleDriver(profile, buffered_output=buffered_output, hooks=hooks)
+    if prelude:
+        build_prelude(driver)
+
+    binaries = {} # Source path -> binary path
+    loaded = {} # Library path -> (AST, header code), as the library workers loaded it
+    transpiled = set()
+    pending = list(order)
+    futures = {} # Future -> (step, module)
+    with ProcessPoolExecutor(jobs) as transpilers, ThreadPoolExecutor(jobs) as compilers:
+        while pending or futures:
+            for path in [path for path in pending if all(dependency in transpiled for dependency in modules[path].dependencies)]:
+                pending.remove(path)
+                module = modules[path]
+                libraries = {library_path: loaded[library_path] for library_path in MapleProject.imported_libraries(modules, path)}
+                future = transpilers.submit(transpile_module, path, module.is_library, libraries, names.get(path), use_cache, cache_size, prelude, profile, optimize, shake, buffered_output, arena)
+                futures[future] = ("transpile", module)
+
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step, module = futures.pop(future)
+                result = future.result() # Raises the MapleError of the worker
+                if step == "transpile":
+                    result, (steps, notes, counters) = result
+                    driver.merge(steps, notes, counters)
+                    transpiled.add(module.path)
+                    if module.is_library:
+                        loaded[module.path] = result
+                    else:
+                        file_path, cpp_key = result
+                        futures[compilers.submit(compile_cpp, file_path, driver, cpp_key, cache)] = ("compile", module)
+                else:
+                    binaries[module.path] = result
+
+    driver.binaries = binaries
+    return driver
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Compiles Maple code")
-    parser.add_argument("file", help="The .mpl file to compile")
+    parser.add_argument("files", nargs="+", help="The .mpl file to compile and run, or the files and directories of a project to build")
+    parser.add_argument("--no-cache", action="store_true", help="Always rebuild, without reading or writing the build cache")
+    parser.add_argument("--cache-size", type=int, default=512, help="Maximum size of the build cache in MB")
+    parser.add_argument("--prelude", action="store_true", help="Include the shared precompiled prelude instead of only the needed headers")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Parallel jobs for project builds and library imports, defaults to the number of cores")
+    parser.add_argument("--incremental", action="store_true", help="Compile every function on its own and only recompile the functions that changed")
+    parser.add_argument("--profile", choices=list(profiles), default="debug", help="Compiler flags to build with")
+    parser.add_argument("--no-run", action="store_true", help="Only build the program, without running it")
+    parser.add_argument("--pgo", action="store_true", help="Profile guided build, trains an instrumented binary then rebuilds with its profile")
+    parser.add_argument("--pgo-train", default=None, help="Shell command of the training run, {binary} is replaced by the instrumented binary")
+    parser.add_argument("--pgo-input", default=None, help="File given as the input of the training run")
+    parser.add_argument("--no-optimize", action="store_true", help="Transpile the code as it's written, without folding the constants")
+    parser.add_argument("--no-shake", action="store_true", help="Emit every function, even the ones the program never calls")
+    parser.add_argument("--buffered-output", action=argparse.BooleanOptionalAction, default=None, help="Print through a big buffer instead of flushing every out, on by default in release profiles")
+    parser.add_argument("--bench", action="store_true", help="Benchmark the code after run, printing min, median, mean and p99 instead of the output")
+    parser.add_argument("--bench-warmup", type=int, default=1, help="Runs discarded before the measured ones")
+    parser.add_argument("--interp", action="store_true", help="Run the program in the bytecode interpreter instead of compiling it with g++")
+    parser.add_argument("--watch", action="store_true", help="Keep running, rebuilding (and running) every .mpl file when it or a library it imports changes")
+    parser.add_argument("--watch-interval", type=float, default=0.2, help="Seconds between two looks at the watched files")
+    parser.add_argument("--arena", action="store_true", help="Parse the program into flat arrays instead of node objects, for very big programs (skips the optimizer)")
+    parser.add_argument("--timings", default=None, help="Write the time of every step and the counters (tokens, nodes, bytes emitted) to this JSON file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print the compiler diagnostics and the time of every build step")
     args = parser.parse_args()
 
-    MapleCompile(args.file)
+    def print_report(driver):
+        if args.timings:
+            with open(args.timings, "w") as f:
+                json.dump(driver.metrics(), f, indent=4)
+        if args.verbose:
+            print("".join(note + "\n" for note in driver.notes), end="", file=sys.stderr)
+            print(driver.diagnostics(), end="", file=sys.stderr)
+            print(driver.report(), file=sys.stderr)
+
+    if args.watch:
+        library_table = LibraryTable() # The parsed libraries stay in memory between rebuilds, the watcher evicts the ones that change
+        def build(file):
+            driver = MapleCompile(file, not args.no_cache, args.cache_size, args.prelude, args.incremental, args.profile, not args.no_run, args.pgo, args.pgo_train, args.pgo_input, not args.no_optimize, not args.no_shake, args.buffered_output, args.bench_warmup if args.bench else None, args.interp, jobs=args.jobs, library_table=library_table, arena=args.arena)
+            print_report(driver)
+        try:
+            MapleWatcher(args.files, build, args.watch_interval, libraries=library_table).watch()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if len(args.files) == 1 and not os.path.isdir(args.files[0]):
+        driver = MapleCompile(args.files[0], not args.no_cache, args.cache_size, args.prelude, args.incremental, args.profile, not args.no_run, args.pgo, args.pgo_train, args.pgo_input, not args.no_optimize, not args.no_shake, args.buffered_output, args.bench_warmup if args.bench else None, args.interp, jobs=args.jobs, arena=args.arena)
+    else:
+        driver = MapleBuild(args.files, args.jobs, not args.no_cache, args.cache_size, args.prelude, args.profile, not args.no_optimize, not args.no_shake, args.buffered_output, arena=args.arena)
+
+    print_report(driver)
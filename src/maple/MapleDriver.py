@@ -0,0 +1,115 @@
+import os
+import time
+import subprocess
+from contextlib import contextmanager
+
+from MapleError import MapleError
+
+# Named sets of C++ compiler flags
+profiles = {
+    "debug": ["-O0", "-g"],
+    "release": ["-O2", "-march=native"],
+    "release-O3": ["-O3", "-march=native"],
+    "release-LTO": ["-O3", "-march=native", "-flto=auto"], # The flags are passed to the link too, where the LTO happens
+}
+
+class BuildStep:
+    # A step of the build, how long it took and what the tool printed
+    def __init__(self, name, seconds, command=None, returncode=0, output=""):
+        self.name = name
+        self.seconds = seconds
+        self.command = command
+        self.returncode = returncode
+        self.output = output
+
+    def __repr__(self):
+        return f"BuildStep(name={self.name}, seconds={self.seconds:.3f}, returncode={self.returncode})"
+
+class MapleDriver:
+    # Runs the compiler and the compiled programs, timing every step and keeping the compiler diagnostics
+    # Hooks are called with every step and counter as soon as it's recorded, as hook("step", name, seconds) and hook("counter", name, amount)
+    def __init__(self, profile="debug", compiler="g++", extra_flags=(), buffered_output=None, hooks=()):
+        if profile not in profiles:
+            raise MapleError(f"Unknown build profile: {profile} (expected one of {', '.join(profiles)})")
+        self.profile = profile
+        self.compiler = compiler
+        self.flags = profiles[profile] + list(extra_flags)
+        self.buffered_output = profile.startswith("release") if buffered_output is None else buffered_output # Release builds print through a buffer by default
+        self.steps = [] # Every BuildStep, in the order they finished
+        self.notes = [] # What the compiler passes have to say about the build, like what the tree shaking removed
+        self.counters = {} # Name -> amount, like the tokens lexed or the bytes of C++ code emitted
+        self.hooks = list(hooks)
+
+    def record(self, name, seconds, command=None, returncode=0, output=""):
+        step = BuildStep(name, seconds, command, returncode, output)
+        self.steps.append(step) # Appending is atomic, so the steps of parallel builds can be recorded from any thread
+        for hook in self.hooks:
+            hook("step", name, seconds)
+        return step
+
+    def count(self, name, amount):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        for hook in self.hooks:
+            hook("counter", name, amount)
+
+    def note(self, text):
+        self.notes.append(text)
+
+    def merge(self, steps, notes, counters):
+        # Adds what the driver of a worker process recorded, the hooks of this driver see it as if it was recorded here
+        for step in steps:
+            self.record(step.name, step.seconds, step.command, step.returncode, step.output)
+        self.notes.extend(notes)
+        for name, amount in counters.items():
+            self.count(name, amount)
+
+    @contextmanager
+    def timed(self, name):
+        # Times a step running in Python, like the transpiling
+        start = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - start)
+
+    def run(self, name, command, capture=True, **kwargs):
+        # Runs a tool, failing with its diagnostics when it returns an error
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(command, capture_output=capture, text=True, **kwargs)
+        except OSError as error:
+            raise MapleError(f"{name} failed: {error}")
+        output = (result.stdout or "") + (result.stderr or "") # Also what was piped without capturing everything
+        step = self.record(name, time.perf_counter() - start, command, result.returncode, output)
+        if result.returncode != 0:
+            raise MapleError(f"{name} failed with exit code {result.returncode}\n{output}".rstrip())
+        return step
+
+    def compile(self, sources, output_path, options=()):
+        # Compiles (or links) the sources with the flags of the profile
+        command = [self.compiler, *self.flags, *options, *sources, "-o", output_path]
+        return self.run(f"compile {os.path.basename(output_path)}", command)
+
+    def execute(self, binary_path, arguments=(), cwd=None, capture_stdout=False):
+        # Runs a compiled program, its output goes straight to the terminal unless stdout is captured into the step
+        # The programs wait for a key at the end, so stdin is closed to let them exit on their own
+        stdout = subprocess.PIPE if capture_stdout else None
+        return self.run(f"run {os.path.basename(binary_path)}", [binary_path, *arguments], capture=False, stdin=subprocess.DEVNULL, stdout=stdout, cwd=cwd)
+
+    def diagnostics(self):
+        # Everything the compiler printed, warnings included
+        return "".join(step.output for step in self.steps if step.output and step.name.startswith("compile"))
+
+    def metrics(self):
+        # Everything measured, for the --timings JSON
+        return {
+            "profile": self.profile,
+            "steps": [{"name": step.name, "seconds": step.seconds, "command": step.command, "returncode": step.returncode} for step in self.steps],
+            "counters": self.counters,
+            "notes": self.notes,
+            "total_seconds": sum(step.seconds for step in self.steps),
+        }
+
+    def report(self):
+        lines = [f"{step.seconds * 1000:10.1f} ms  {step.name}" for step in self.steps]
+        lines.append(f"{sum(step.seconds for step in self.steps) * 1000:10.1f} ms  all steps ({self.profile})")
+        lines.extend(f"{amount:13,}  {name}" for name, amount in self.counters.items())
+        return "\n".join(lines)
@@ -1,8 +1,16 @@
 import re
+import sys
+import mmap
+import time
+from array import array
+from bisect import bisect_right
+from collections import deque
 
 from MapleError import MapleError
 
 class Token:
+    __slots__ = ("type", "value", "line_num", "char_pos") # No per-token __dict__, there are a lot of tokens
+
     def __init__(self, type_, value, line_num, char_pos):
         self.type = type_
         self.value = value
@@ -12,106 +20,319 @@ class Token:
     def __repr__(self):
         return f"Token({repr(self.type)}, {repr(self.value)}, {repr(self.line_num)}, {repr(self.char_pos)})"
 
-class MapleLexer:
+class TokenStream:
+    # Lookahead buffer over a token iterator, indexed with absolute positions just like a token list
+    # Only the last few tokens are kept, the parser never looks more than one token behind the furthest one it read
+    def __init__(self, tokens, history=4):
+        self.tokens = iter(tokens)
+        self.buffer = deque()
+        self.buffer_start = 0 # Position of the first token in the buffer
+        self.history = history
+
+    def __getitem__(self, position):
+        while position >= self.buffer_start + len(self.buffer):
+            token = next(self.tokens, None)
+            if token is None:
+                raise IndexError("token position out of range")
+            self.buffer.append(token)
+            if len(self.buffer) > self.history:
+                self.buffer.popleft()
+                self.buffer_start += 1
+
+        if position < self.buffer_start:
+            raise MapleError(f"Token {position} is no longer buffered")
+        return self.buffer[position - self.buffer_start]
+
+class TokenBuffer:
+    # Struct-of-arrays token list: a type code and the start/end offsets in the source for every token
+    # Nothing is copied out of the source until a token is looked at, indexing it gives back a TokenView
     def __init__(self, source_code):
+        self.source_code = source_code
+        self.types = array("B") # Type codes, see token_types
+        self.starts = array("q") # Offset of the first character of every token
+        self.ends = array("q") # Offset right after the last character of every token
+        self.newlines = array("q") # Offset of every newline, used to find the line and column of a token
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        return TokenView(self, index, token_types[self.types[index]]) # The array raises the IndexError past the last token
+
+    def value(self, index):
+        value = self.source_code[self.starts[index]:self.ends[index]]
+        if self.types[index] == type_codes["ID"]:
+            value = sys.intern(value) # Every use of a variable shares the same string
+        return value
+
+    def line_num(self, index):
+        return bisect_right(self.newlines, self.starts[index]) + 1
+
+    def char_pos(self, index):
+        line = bisect_right(self.newlines, self.starts[index])
+        line_start = self.newlines[line - 1] if line > 0 else 0 # Columns are counted from the previous newline
+        return self.starts[index] - line_start
+
+class TokenView:
+    # Thin view of a single token inside a TokenBuffer, with the same attributes as Token
+    # The type is looked at all the time by the parser so it is stored, everything else is read from the buffer when needed
+    __slots__ = ("buffer", "index", "type")
+
+    def __init__(self, buffer, index, type_):
+        self.buffer = buffer
+        self.index = index
+        self.type = type_
+
+    @property
+    def value(self):
+        return self.buffer.value(self.index)
+
+    @property
+    def line_num(self):
+        return self.buffer.line_num(self.index)
+
+    @property
+    def char_pos(self):
+        return self.buffer.char_pos(self.index)
+
+    def __repr__(self):
+        return f"Token({repr(self.type)}, {repr(self.value)}, {repr(self.line_num)}, {repr(self.char_pos)})"
+
+# Keywords that come before ranges, a word is only a keyword if it is its own word and not a substring (same as \bword\b)
+keywords = {
+    "run": "RUN", # Run keyword
+    "dec": "DEC", # Declare keyword
+    "set": "SET", # Set keyword
+    "ch": "CH", # Not constant keyword
+    "i8": "INTEGER8", # 8-bit integer keyword
+    "i16": "INTEGER16", # 16-bit integer keyword
+    "i32": "INTEGER32", # 32-bit integer keyword
+    "i64": "INTEGER64", # 64-bit integer keyword
+    "bool": "BOOLEAN", # Boolean keyword
+    "str": "STRING", # String keyword
+    "f32": "FLOAT32", # 32-bit float keyword
+    "f64": "FLOAT64", # 64-bit float keyword
+    "char": "CHAR", # Character keyword
+    "empty": "EMPTY", # No return
+    "true": "TRUE", # True keyword
+    "false": "FALSE", # False keyword
+    "out": "OUT", # Output keyword
+    "if": "IF", # If keyword
+    "else": "ELSE", # Else keyword
+    "elif": "ELIF", # Elif keyword
+    "end": "END", # End keyword (end of if statement)
+    "loop": "LOOP", # Loop keyword (for loops)
+    "roll": "ROLL", # Roll keyword (end of for loop)
+    "back": "BACK", # Back keyword (save current variable value)
+    "load": "LOAD", # Load keyword (load saved variable value)
+    "flush": "FLUSH", # Flush keyword (write out the buffered output)
+}
+
+# Keywords that come after ranges, so "add..b" is a range and not an addition
+operation_keywords = {
+    "add": "ADD", # Add keyword (add to variable)
+    "sub": "SUB", # Subtract keyword (subtract from variable)
+    "mul": "MUL", # Multiply keyword (multiply variable)
+    "div": "DIV", # Divide keyword (divide variable)
+    "mod": "MOD", # Modulo keyword (modulo variable)
+    "fnc": "FUNC", # Function keyword
+    "rtn": "RETURN", # Return keyword
+}
+
+# Keywords followed by a namespace, like "lib @sugar", the whole thing is a single token
+namespace_keywords = {
+    "lib": "LIB", # Library keyword (import libraries)
+    "init": "INIT", # Init keyword (initialize library namespace)
+}
+
+# Operators and punctuation
+symbols = {
+    ">=": "GREATER_EQUAL", # Greater than or equal to operator
+    "<=": "LESS_EQUAL", # Less than or equal to operator
+    "!=": "NOT_EQUAL", # Not equal operator
+    "==": "EQUAL", # Equal operator
+    ">": "GREATER", # Greater than operator
+    "<": "LESS", # Less than operator
+    "->": "ARROW", # Array assign operator
+    "=>": "INSIDE", # Inside variable operator
+    ",": "COMMA", # Comma
+    ":": "COLON", # Colon
+    "..": "DOTDOT", # Dot dot operator, used for ranges
+    "(": "LEFT_PAREN", # Left parenthesis
+    "[": "LEFT_SQR_BRACKET", # Left square bracket
+    "]": "RIGHT_SQR_BRACKET", # Right square bracket
+    "{": "LEFT_CRLY_BRACKET", # Left curly bracket
+    "}": "RIGHT_CRLY_BRACKET", # Right curly bracket
+    "+": "OP", # Arithmetic operators
+    "-": "OP",
+    "*": "OP",
+    "/": "OP",
+}
+
+# Regex for tokens, compiled once when the module is imported
+# Words are matched once and then classified through the tables above instead of trying every keyword
+token_specification = [
+    ("WORD", r"(?<!\w)[A-Za-z_][A-Za-z0-9_]*(?!\w)"), # Keywords, identifiers and ranges (first, they are the most common)
+    ("NUMBER", r"\d+(?:\.\d*)?"), # Integer or decimal numbers
+    ("GLUED", r"[A-Za-z_][A-Za-z0-9_]*"), # A word glued to a number can't be a keyword (same as failing \bword\b)
+    ("NEWLINE", r"\n"), # Line endings
+    ("COMMENT", r"//.*"), # Comment (before symbols, so it doesn't become a division)
+    ("LIBACCESS", r"@\w+::"), # Library access keyword (access library namespace)
+    ("SYMBOL", r">=|<=|!=|==|->|=>|\.\.|[><,:(\[\]{}+\-*/]"), # Longest operators first
+    ("MISMATCH", r"[^ \t]"), # Anything else is an illegal character
+]
+token_names = [None] + [name for name, _ in token_specification] # Group number -> token type
+token_regex = re.compile(r"[ \t]*(?:%s)" % "|".join("(?P<%s>%s)" % pair for pair in token_specification)) # Spaces and tabs are skipped with the token
+
+namespace_regex = re.compile(r" @\w+") # Rest of a "lib @name" or "init @name" token
+range_regex = re.compile(r"\.\.(?:[A-Za-z0-9_]+|\d+(?:\.\d*)?)") # Rest of a range expression like "i..n"
+
+# Every token type, the position in the list is the type code used by TokenBuffer
+token_types = ["ID", "NUMBER", "RANGE", "COMMENT", "LIBACCESS", *keywords.values(), *namespace_keywords.values(), *operation_keywords.values(), *dict.fromkeys(symbols.values())]
+type_codes = {type_: code for code, type_ in enumerate(token_types)}
+
+def scan_word(text, start, end, glued):
+    # Namespaces and ranges are the only words that go past the end of the regex match, they are rare so they are handled here
+    # Returns the type of the token and where it ends
+    word = text[start:end]
+    if not glued and word in namespace_keywords and (namespace := namespace_regex.match(text, end)) is not None:
+        return namespace_keywords[word], namespace.end()
+    elif text.startswith("..", end) and (range_ := range_regex.match(text, end)) is not None: # Range expression, like "i..n"
+        return "RANGE", range_.end()
+    elif glued:
+        return "ID", end
+    return operation_keywords.get(word, "ID"), end
+
+chunk_size = 1 << 16 # Characters read at a time from a file, always completed up to the end of the line
+
+class MapleLexer:
+    def __init__(self, source_code): # The source code can be a string, a file object or a memory-mapped file
         self.source_code = source_code
         self.tokens = []
         self.current_position = 0
+        self.line_num = 1
+        self.seconds = 0.0 # Time spent lexing
+        self.token_count = 0
 
     def tokenize(self):
-        # Regex for tokens
-        token_specification = [
-            ("NUMBER", r"\d+(\.\d*)?"), # Integer or decimal numbers
-
-            # Keywords, the \b means that the keyword must be its own word and not substrings
-            ("RUN", r"\brun\b"), # Run keyword
-            ("DEC", r"\bdec\b"), # Declare keyword
-            ("SET", r"\bset\b"), # Set keyword
-            ("CH", r"\bch\b"), # Not constant keyword
-            ("INTEGER8", r"\bi8\b"), # 8-bit integer keyword
-            ("INTEGER16", r"\bi16\b"), # 16-bit integer keyword
-            ("INTEGER32", r"\bi32\b"), # 32-bit integer keyword
-            ("INTEGER64", r"\bi64\b"), # 64-bit integer keyword
-            ("BOOLEAN", r"\bbool\b"), # Boolean keyword
-            ("STRING", r"\bstr\b"), # String keyword
-            ("FLOAT32", r"\bf32\b"), # 32-bit float keyword
-            ("FLOAT64", r"\bf64\b"), # 64-bit float keyword
-            ("CHAR", r"\bchar\b"), # Character keyword
-            ("EMPTY", r"\bempty\b"), # No return
-            ("TRUE", r"\btrue\b"), # True keyword
-            ("FALSE", r"\bfalse\b"), # False keyword
-            ("OUT", r"\bout\b"), # Output keyword
-            ("IF", r"\bif\b"), # If keyword            ("END", r"\bend\b"), # End keyword (end of if statement)
-            ("ELSE", r"\belse\b"), # Else keyword
-            ("ELIF", r"\belif\b"), # Elif keyword
-            ("END", r"\bend\b"), # End keyword (end of if statement)
-            ("LOOP", r"\bloop\b"), # Loop keyword (for loops)
-            ("ROLL", r"\broll\b"), # Roll keyword (end of for loop)
-            ("BACK", r"\bback\b"), # Back keyword (save current variable value)
-            ("LOAD", r"\bload\b"), # Load keyword (load saved variable value)
-            ("LIB", r"\blib @\w+"), # Library keyword (import libraries)
-            ("LIBACCESS", r"@(\w+)::"), # Library access keyword (access library namespace)
-            ("INIT", r"\binit @\w+"), # Init keyword (initialize library namespace)
-            ("RANGE", r"([A-Za-z0-9_]+|\d+(\.\d*)?)\.\.([A-Za-z0-9_]+|\d+(\.\d*)?)"), # Range expression
-            ("ADD", r"\badd\b"), # Add keyword (add to variable)
-            ("SUB", r"\bsub\b"), # Subtract keyword (subtract from variable)
-            ("MUL", r"\bmul\b"), # Multiply keyword (multiply variable)
-            ("DIV", r"\bdiv\b"), # Divide keyword (divide variable)
-            ("MOD", r"\bmod\b"), # Modulo keyword (modulo variable)
-            ("FUNC", r"\bfnc\b"), # Function keyword
-            ("RETURN", r"\brtn\b"), # Return keyword
-            ("GREATER_EQUAL", r">="), # Greater than or equal to operator
-            ("LESS_EQUAL", r"<="), # Less than or equal to operator
-            ("NOT_EQUAL", r"!="), # Not equal operator
-            ("EQUAL", r"=="), # Equal operator
-            ("GREATER", r">"), # Greater than operator
-            ("LESS", r"<"), # Less than operator
-            ("ARROW", r"->"), # Array assign operator
-            ("INSIDE", "=>" ), # Inside variable operator
-            ("COMMA", r","), # Comma
-            ("COLON", r":"), # Colon
-            ("DOTDOT", r"\.\."), # Dot dot operator, used for ranges
-            ("LEFT_PAREN", r"\("), # Left parenthesis
-            ("LEFT_SQR_BRACKET", r"\["), # Left square bracket
-            ("RIGHT_SQR_BRACKET", r"\]"), # Right square bracket
-            ("LEFT_CRLY_BRACKET", r"\{"), # Left curly bracket
-            ("RIGHT_CRLY_BRACKET", r"\}"), # Right curly bracket
-            ("COMPARISON", r"\b==\b"), # Equal comparison operator
-            ("COMMENT" , r"//.*"), # Comment
-
-            # Other
-            ("ID", r"[A-Za-z0-9_]+"),  # Identifiers (allowing alphanumeric characters and underscore)
-            ("OP", r"[+\-*/]"), # Arithmetic operators
-            ("NEWLINE", r"\n"), # Line endings
-            ("SKIP", r"[ \t]+"), # Skip over spaces and tabs
-        ]
-
-        # Compile regex
-        tok_regex = "|".join("(?P<%s>%s)" % pair for pair in token_specification)
-        get_token = re.compile(tok_regex).match # Match regex to source code
-
-        # Tokenize
-        line_num = 1
-        line_start = 0
-
-        while self.current_position < len(self.source_code):
-            match = get_token(self.source_code, self.current_position)
-            if match is not None: # If the token is valid
-                type_ = match.lastgroup
-                char_pos = match.start() - line_start
-
-                if type_ == "NEWLINE":
-                    line_start = self.current_position
-                    line_num += 1
-                elif type_ != "SKIP":
-                    value = match.group(type_) # Get the value of the token
-                    if type_ == "NUMBER":
-                        val = float(value) if "." in value else int(value)
-                    self.tokens.append(Token(type_, value, line_num, char_pos)) # Appending the token
-                self.current_position = match.end()
-            else:
-                raise MapleError("Illegal character '%s'" % self.source_code[self.current_position], line_num, self.current_position)
-                self.current_position += 1
-
+        for chunk_tokens in self.iter_chunk_tokens():
+            self.tokens += chunk_tokens
         return self.tokens
 
+    def iter_tokens(self):
+        for chunk_tokens in self.iter_chunk_tokens():
+            yield from chunk_tokens
+
+    def iter_chunks(self):
+        source_code = self.source_code
+        if isinstance(source_code, str): # Already in memory, no need to split it
+            yield source_code
+            return
+
+        # Tokens never span more than one line, so files are read in chunks of whole lines
+        while chunk := source_code.read(chunk_size) + source_code.readline():
+            if isinstance(chunk, bytes): # Binary files and memory-mapped files
+                chunk = chunk.decode().replace("\r\n", "\n") # Same newlines as a file opened in text mode
+            yield chunk
+
+    def iter_chunk_tokens(self):
+        # Also times the lexing (reading the source included) apart from whatever pulls the tokens, and counts them
+        line_start = 0 # Columns are counted from the last newline, so every chunk after the first one starts at -1
+        chunks = self.iter_chunks()
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            if chunk is None:
+                self.seconds += time.perf_counter() - start
+                return
+            chunk_tokens = self.tokenize_chunk(chunk, line_start)
+            self.seconds += time.perf_counter() - start
+            self.token_count += len(chunk_tokens)
+            yield chunk_tokens
+            self.current_position += len(chunk)
+            line_start = -1
+
+    def tokenize_chunk(self, chunk, line_start):
+        get_token = token_regex.match # Match regex to source code
+        tokens = []
+        append = tokens.append # Avoiding the attribute lookup for every token
+        line_num = self.line_num
+
+        position = 0 # Kept in a local while scanning, much faster than the attribute
+        while (match := get_token(chunk, position)) is not None: # No match means only spaces and tabs are left
+            group = match.lastindex # Group numbers are much faster to work with than group names
+            type_ = token_names[group]
+            start, position = match.span(group) # The token is always the end of the match
+            value = chunk[start:position]
+
+            if type_ == "WORD":
+                if value in keywords:
+                    type_ = keywords[value]
+                elif value in namespace_keywords or chunk.startswith("..", position):
+                    type_, position = scan_word(chunk, start, position, False)
+                    value = chunk[start:position]
+                else:
+                    type_ = operation_keywords.get(value, "ID")
+            elif type_ == "GLUED":
+                type_, position = scan_word(chunk, start, position, True)
+                value = chunk[start:position]
+            elif type_ == "NEWLINE":
+                line_start = start
+                line_num += 1
+                continue
+            elif type_ == "SYMBOL":
+                type_ = symbols[value]
+            elif type_ == "MISMATCH":
+                self.current_position += start
+                raise MapleError("Illegal character '%s'" % chunk[start], line_num, self.current_position)
+
+            append(Token(type_, value, line_num, start - line_start)) # Appending the token
+
+        self.line_num = line_num
+        return tokens
+
+    def tokenize_buffer(self):
+        # Same tokens as tokenize(), stored in a TokenBuffer instead of a list of Token objects
+        source_code = self.source_code if isinstance(self.source_code, str) else "".join(self.iter_chunks()) # Offsets need the whole source
+        buffer = TokenBuffer(source_code)
+        get_token = token_regex.match # Match regex to source code
+        add_type, add_start, add_end = buffer.types.append, buffer.starts.append, buffer.ends.append
+        id_code = type_codes["ID"]
+
+        position = 0
+        while (match := get_token(source_code, position)) is not None: # No match means only spaces and tabs are left
+            group = match.lastindex
+            type_ = token_names[group]
+            start, position = match.span(group)
+
+            if type_ == "WORD":
+                word = source_code[start:position]
+                if word in keywords:
+                    type_ = keywords[word]
+                elif word in namespace_keywords or source_code.startswith("..", position):
+                    type_, position = scan_word(source_code, start, position, False)
+                elif word in operation_keywords:
+                    type_ = operation_keywords[word]
+                else: # Most common case, no need to look up the type code
+                    add_type(id_code)
+                    add_start(start)
+                    add_end(position)
+                    continue
+            elif type_ == "GLUED":
+                type_, position = scan_word(source_code, start, position, True)
+            elif type_ == "NEWLINE":
+                buffer.newlines.append(start)
+                continue
+            elif type_ == "SYMBOL":
+                type_ = symbols[source_code[start:position]]
+            elif type_ == "MISMATCH":
+                self.current_position = start
+                raise MapleError("Illegal character '%s'" % source_code[start], len(buffer.newlines) + 1, start)
+
+            add_type(type_codes[type_])
+            add_start(start)
+            add_end(position)
+
+        self.current_position = len(source_code)
+        self.line_num = len(buffer.newlines) + 1
+        return buffer
@@ -0,0 +1,395 @@
+import re
+import math
+import struct
+
+from MapleParser import ASTnode, SETnode, BLOCKnode, IFnode, CALLnode
+
+integer_regex = re.compile(r"\d+")
+decimal_regex = re.compile(r"\d+\.\d*")
+identifier_regex = re.compile(r"[A-Za-z_]\w*")
+
+# Range of the integer types, a constant declared out of its range is left alone
+integer_ranges = {
+    "i8": (-2 ** 7, 2 ** 7 - 1),
+    "i16": (-2 ** 15, 2 ** 15 - 1),
+    "i32": (-2 ** 31, 2 ** 31 - 1),
+    "i64": (-2 ** 63, 2 ** 63 - 1),
+}
+
+# What C++ computes arithmetic in: i8 and i16 are promoted to int (same as i32), literals are int or double
+arithmetic_types = {"i8": "i32", "i16": "i32", "i32": "i32", "i64": "i64", "f32": "f32", "f64": "f64"}
+
+comparisons = {
+    "<": lambda left, right: left < right,
+    ">": lambda left, right: left > right,
+    "<=": lambda left, right: left <= right,
+    ">=": lambda left, right: left >= right,
+    "==": lambda left, right: left == right,
+    "!=": lambda left, right: left != right,
+}
+
+type_names = {"i8": "int8_t", "i16": "int16_t", "i64": "int64_t"}
+
+def round_f32(value):
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+def cpp_literal(value, variable_type):
+    # C++ code giving exactly this value with exactly this type, so replacing a variable by it never changes what C++ computes
+    if variable_type == "i32":
+        return str(value)
+    if variable_type in integer_ranges:
+        return f"{type_names[variable_type]}({value})"
+    if variable_type == "f32":
+        return f"{value!r}f"
+    return repr(value)
+
+def referenced_names(value, names):
+    # Adds every name the node (and the nodes inside it) reads or writes to names, a declaration doesn't count its own name
+    if isinstance(value, str):
+        names.update(identifier_regex.findall(value))
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            referenced_names(item, names)
+    elif isinstance(value, ASTnode):
+        for node_class in type(value).__mro__:
+            for field in getattr(node_class, "__slots__", ()):
+                if field != "type" and not (field == "variable_name" and value.type == "DEC"):
+                    referenced_names(getattr(value, field, None), names)
+
+class Constant:
+    # A value known at compile time and its Maple type
+    __slots__ = ("value", "type")
+
+    def __init__(self, value, type_):
+        self.value = value
+        self.type = type_
+
+    def literal(self):
+        return cpp_literal(self.value, self.type)
+
+node_optimizers = {} # Node type -> method optimizing the node
+
+def optimizes(*node_types):
+    # Registers a MapleOptimizer method as the optimizer of the given node types
+    def register(method):
+        for node_type in node_types:
+            node_optimizers[node_type] = method
+        return method
+    return register
+
+class MapleOptimizer:
+    # Runs between the parser and the transpiler: propagates the values of the constant variables,
+    # folds the arithmetic on constants and removes the if branches and loops that can be decided at compile time
+    # The values of the changeable variables are followed through straight-line code too, only to fold the arithmetic on them
+    def __init__(self, ast):
+        self.ast = ast
+        self.constants = {} # Variable name -> Constant, for the block being optimized
+        self.variables = {} # Changeable variable name -> Constant, what it holds at this point of the block
+        self.types = {} # Changeable variable name -> type, for the values assigned to it
+        self.propagated = set() # Declarations of constants replaced by their value wherever it's used
+        self.folded = 0 # Number of expressions, conditions and bounds replaced by constants
+        self.removed = 0 # Number of constant declarations removed once nothing uses them
+
+    def optimize(self):
+        # Functions are emitted before main, so they only see their own constants
+        for node in self.ast:
+            if node.type == "FUNC":
+                self.constants, self.variables, self.types = {}, {}, {}
+                node.body = self.optimize_block(node.body)
+
+        self.constants, self.variables, self.types = {}, {}, {}
+        # The transpiler picks the functions, libraries and namespace out of the AST, only the order of the main nodes matters
+        declarations = [node for node in self.ast if node.type == "FUNC" or node.type == "LIB" or node.type == "INIT"]
+        main = self.optimize_block([node for node in self.ast if node.type != "FUNC" and node.type != "LIB" and node.type != "INIT"])
+        self.ast[:] = declarations + main
+        return self.ast
+
+    def optimize_block(self, nodes):
+        # Returns the optimized list of nodes, constants declared inside a block don't leak out of it
+        # The block might not run, or run more than once, so nothing is known of the changeable variables after it
+        outer_constants, outer_types = self.constants, self.types
+        self.constants, self.types = dict(outer_constants), dict(outer_types)
+        optimized = []
+        position = 0
+        while position < len(nodes):
+            node = nodes[position]
+            if node.type == "IF":
+                position = self.optimize_branches(nodes, position, optimized)
+                continue
+            if node.type == "LOOP" and self.is_empty_loop(node):
+                self.folded += 1
+                position += 2 if position + 1 < len(nodes) and nodes[position + 1].type == "ROLL" else 1 # Dropping the loop and its ROLL
+                continue
+
+            optimize = node_optimizers.get(node.type)
+            optimized.append(optimize(self, node) if optimize is not None else node)
+            position += 1
+
+        # A constant replaced everywhere doesn't need its declaration, unless something still names it (like back and load)
+        if any(node in self.propagated for node in optimized):
+            names = set()
+            for node in optimized:
+                referenced_names(node, names)
+            kept = [node for node in optimized if node not in self.propagated or node.variable_name in names]
+            self.removed += len(optimized) - len(kept)
+            optimized = kept
+
+        self.constants, self.types = outer_constants, outer_types
+        self.variables = {}
+        return optimized
+
+    def constant(self, operand):
+        # The Constant an operand (a literal or a variable name) is known to be, None if it isn't known
+        if not isinstance(operand, str):
+            return None
+        if operand in self.constants:
+            return self.constants[operand]
+        if operand in self.variables:
+            return self.variables[operand]
+        if integer_regex.fullmatch(operand):
+            return Constant(int(operand), "i32" if int(operand) <= integer_ranges["i32"][1] else "i64")
+        if decimal_regex.fullmatch(operand):
+            return Constant(float(operand), "f64")
+        return None
+
+    def substitute(self, operand):
+        # Replaces a constant variable by its value, everything else is left as it is
+        if isinstance(operand, str) and operand in self.constants:
+            self.folded += 1
+            return self.constants[operand].literal()
+        return operand
+
+    def evaluate(self, left, operator, right):
+        # Computes "left operator right" the way C++ would, None when it can't be done safely at compile time
+        # The usual arithmetic conversions: double wins over float, float over the integers, and int64_t over int
+        operand_types = {arithmetic_types[left.type], arithmetic_types[right.type]}
+        result_type = next(variable_type for variable_type in ("f64", "f32", "i64", "i32") if variable_type in operand_types)
+
+        if result_type in integer_ranges:
+            left_value, right_value = int(left.value), int(right.value)
+            if operator == "+":
+                value = left_value + right_value
+            elif operator == "-":
+                value = left_value - right_value
+            elif operator == "*":
+                value = left_value * right_value
+            elif right_value == 0:
+                return None # Left to fail at run time, like it would without the optimizer
+            else:
+                # C++ rounds the quotient towards zero and gives the remainder the sign of the left operand
+                quotient = abs(left_value) // abs(right_value)
+                if (left_value < 0) != (right_value < 0):
+                    quotient = -quotient
+                value = quotient if operator == "/" else left_value - right_value * quotient
+
+            low, high = integer_ranges[result_type]
+            if not low < value <= high: # Overflowing is undefined in C++, so it's not folded (and the lowest value has no literal of its type)
+                return None
+            return Constant(value, result_type)
+
+        if operator == "%": # Not valid on floating point numbers
+            return None
+        left_value, right_value = float(left.value), float(right.value) # Converted to the result type before the operation, like C++ does
+        if result_type == "f32":
+            left_value, right_value = round_f32(left_value), round_f32(right_value)
+        if operator == "/" and right_value == 0:
+            return None
+        if operator == "+":
+            value = left_value + right_value
+        elif operator == "-":
+            value = left_value - right_value
+        elif operator == "*":
+            value = left_value * right_value
+        else:
+            value = left_value / right_value
+        if result_type == "f32":
+            value = round_f32(value)
+        if not math.isfinite(value):
+            return None
+        return Constant(value, result_type)
+
+    def converted(self, value, variable_type):
+        # The Constant a variable of the type holds once the value is assigned to it, None when it's not known for sure
+        if variable_type in integer_ranges:
+            low, high = integer_ranges[variable_type]
+            if isinstance(value.value, float) or not low <= value.value <= high:
+                return None
+            return Constant(value.value, variable_type)
+        if variable_type not in arithmetic_types:
+            return None
+        constant = Constant(float(value.value), variable_type)
+        if variable_type == "f32":
+            constant.value = round_f32(constant.value)
+        return constant
+
+    def assign(self, name, value):
+        # Follows the value of a changeable variable, value is None when it isn't known
+        constant = self.converted(value, self.types[name]) if value is not None and name in self.types else None
+        if constant is None:
+            self.variables.pop(name, None)
+        else:
+            self.variables[name] = constant
+        return constant
+
+    def decide(self, condition):
+        # True or False when the condition is known at compile time, None otherwise
+        left = self.constant(condition.left)
+        right = self.constant(condition.right)
+        if left is None or right is None or condition.operator not in comparisons:
+            condition.left = self.substitute(condition.left)
+            condition.right = self.substitute(condition.right)
+            return None
+        left_value, right_value = left.value, right.value
+        if isinstance(left_value, float) or isinstance(right_value, float):
+            left_value, right_value = float(left_value), float(right_value)
+        return comparisons[condition.operator](left_value, right_value)
+
+    def optimize_branches(self, nodes, position, optimized):
+        # An if, the elifs and the else after it, every one of them followed by its END
+        # The branches known to be false are removed, and the first one known to be true replaces the whole chain
+        branches = []
+        while position < len(nodes) and (nodes[position].type == "IF" if not branches else nodes[position].type in ("ELIF", "ELSE")):
+            end = nodes[position + 1] if position + 1 < len(nodes) and nodes[position + 1].type == "END" else None
+            branches.append((nodes[position], end))
+            position += 2 if end is not None else 1
+            if branches[-1][0].type == "ELSE":
+                break
+
+        kept = [] # Branches that can't be decided, in order
+        for branch, end in branches:
+            decision = True if branch.type == "ELSE" else self.decide(branch.condition)
+            if decision is False:
+                self.folded += 1
+                continue
+            if decision is True and not kept:
+                # Every branch before it was removed, so its body always runs
+                self.folded += 1
+                block = BLOCKnode()
+                block.children = self.optimize_block(branch.children)
+                optimized.append(block)
+                if end is not None:
+                    optimized.append(end)
+                return position
+
+            if not kept and branch.type == "ELIF": # The branches before it were removed, so it starts the chain now
+                if_node = IFnode(branch.condition)
+                if_node.children = branch.children
+                branch = if_node
+            branch.children = self.optimize_block(branch.children)
+            kept.append(branch)
+            optimized.append(branch)
+            if end is not None:
+                optimized.append(end)
+            if decision is True: # Always taken when it's reached, the branches after it are never reached
+                return position
+        return position
+
+    def is_empty_loop(self, node):
+        # The loop variable is an int, so the start is truncated before it's compared with the end
+        start = self.constant(str(node.start_index))
+        end = self.constant(node.times_to_run)
+        return start is not None and end is not None and not int(start.value) < end.value
+
+    @optimizes("DEC")
+    def optimize_DECnode(self, node):
+        self.constants.pop(node.variable_name, None) # Not known until it's shown otherwise, and it hides a constant with the same name
+        self.variables.pop(node.variable_name, None)
+        self.types.pop(node.variable_name, None)
+        if node.is_array:
+            return node
+        if not node.is_constant:
+            self.types[node.variable_name] = node.variable_type
+        if isinstance(node.variable_value, CALLnode):
+            node.variable_value.args = [self.substitute(argument) for argument in node.variable_value.args]
+            return node
+
+        value = self.constant(node.variable_value)
+        node.variable_value = self.substitute(node.variable_value)
+        if not node.is_constant:
+            self.assign(node.variable_name, value)
+            return node
+
+        # The value the variable ends up with once it's converted to its type
+        constant = self.converted(value, node.variable_type) if value is not None else None
+        if constant is not None:
+            self.constants[node.variable_name] = constant
+            self.propagated.add(node)
+        return node
+
+    @optimizes("EXPRESSION")
+    def optimize_EXPRESSIONnode(self, node):
+        if node.array_size is not None: # Element-wise, only the scalar operands can be constants
+            node.left = self.substitute(node.left)
+            node.right = self.substitute(node.right)
+            return node
+        if node.store_variable is None: # "left op= right", the left side is the variable being changed
+            left = self.variables.get(node.left) # A constant can't be changed, C++ reports it
+            right = self.constant(node.right)
+            result = self.evaluate(left, node.operator, right) if left is not None and right is not None else None
+            if self.assign(node.left, result) is None:
+                node.right = self.substitute(node.right)
+                return node
+            self.folded += 1
+            return SETnode(node.left, self.variables[node.left].literal())
+
+        left = self.constant(node.left)
+        right = self.constant(node.right)
+        result = self.evaluate(left, node.operator, right) if left is not None and right is not None else None
+        self.assign(node.store_variable, result)
+        if result is None:
+            node.left = self.substitute(node.left)
+            node.right = self.substitute(node.right)
+            return node
+        self.folded += 1
+        return SETnode(node.store_variable, result.literal())
+
+    @optimizes("SET")
+    def optimize_SETnode(self, node):
+        if not node.target_is_array:
+            self.assign(node.target, self.constant(node.value) if not node.value_is_array else None)
+        node.value = self.substitute(node.value)
+        return node
+
+    @optimizes("LOAD")
+    def optimize_LOADnode(self, node):
+        self.variables.pop(node.variable_name, None) # Back to whatever it was backed up with
+        return node
+
+    @optimizes("RUN")
+    def optimize_RUNnode(self, node):
+        self.variables = {} # The rest of the block runs again and again, the variables keep their values from one run to the next
+        return node
+
+    @optimizes("OUT")
+    def optimize_OUTnode(self, node):
+        if not node.is_array:
+            node.variable_name = self.substitute(node.variable_name)
+        return node
+
+    @optimizes("RETURN")
+    def optimize_RETURNnode(self, node):
+        node.value = self.substitute(node.value)
+        return node
+
+    @optimizes("CALL", "LIBACCESS")
+    def optimize_CALLnode(self, node):
+        node.args = [self.substitute(argument) for argument in node.args]
+        return node
+
+    @optimizes("LOOP")
+    def optimize_LOOPnode(self, node):
+        node.start_index = self.substitute(node.start_index)
+        node.times_to_run = self.substitute(node.times_to_run)
+        outer_constants, outer_types = self.constants, self.types
+        self.constants = {name: constant for name, constant in outer_constants.items() if name != node.variable} # The loop variable hides a constant with its name
+        self.types = {**outer_types, node.variable: "i32"} # And a variable, the loop variable is an int
+        self.variables = {} # The body runs more than once
+        node.children = self.optimize_block(node.children)
+        self.constants, self.types = outer_constants, outer_types
+        return node
+
+    @optimizes("ELSE", "ELIF")
+    def optimize_branch(self, node):
+        # Only reached when the branch isn't right after an if, which the transpiler emits as it is
+        node.children = self.optimize_block(node.children)
+        return node
@@ -1,21 +1,30 @@
 from MapleError import MapleError
-from MapleLexer import MapleLexer
+from MapleLexer import MapleLexer, TokenStream
 from MapleTranspiler import MapleTranspiler
 from MapleTypes import *
+from MapleCache import MapleCache, library_header, write_if_changed
+from MapleArena import ArenaBlock
+import MapleProject
 
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 # The parser will be used to transpile the JoshLang code into C++ code
 class ASTnode:
+    __slots__ = ("type", "children") # No per-node __dict__, big programs have millions of nodes
+
     def __init__(self, type_):
         self.type = type_
-        self.children = []
+        self.children = () # Nodes with a block replace it with their own list, the others share the empty tuple
 
     def __repr__(self):
         return f"ASTnode({repr(self.type)}, {repr(self.children)})"
 
 
 class RUNnode(ASTnode):
+    __slots__ = ("times_to_run",)
+
     def __init__(self, times_to_run):
         super().__init__('RUN')
         self.times_to_run = times_to_run
@@ -24,6 +33,8 @@ class RUNnode(ASTnode):
         return f"RUNnode(times_to_run={self.times_to_run})"
 
 class DECnode(ASTnode):
+    __slots__ = ("variable_type", "variable_name", "variable_value", "is_constant", "is_array", "array_values")
+
     def __init__(self, variable_type, variable_name, variable_value, is_constant=True, is_array=False, array_values=None):
         super().__init__('DEC')
         self.variable_type = variable_type
@@ -37,6 +48,8 @@ class DECnode(ASTnode):
         return f"DECnode(variable_type={self.variable_type}, variable_name={self.variable_name}, variable_value={self.variable_value}, is_constant={self.is_constant}, is_array={self.is_array}, array_values={self.array_values}"
 
 class SETnode(ASTnode):
+    __slots__ = ("target", "value", "target_is_array", "target_array_index", "value_is_array", "value_array_index")
+
     def __init__(self, target, value, target_is_array=False, target_array_index=None, value_is_array=False, value_array_index=None):
         super().__init__('SET')
         self.target = target
@@ -50,6 +63,8 @@ class SETnode(ASTnode):
         return f"SETnode(target={self.target}, value={self.value})"
 
 class OUTnode(ASTnode):
+    __slots__ = ("variable_name", "is_array", "array_index")
+
     def __init__(self, variable_name, is_array=False, array_index=None):
         super().__init__('OUT')
         self.variable_name = variable_name
@@ -59,7 +74,18 @@ class OUTnode(ASTnode):
     def __repr__(self):
         return f"OUTnode(variable_name={self.variable_name}, is_array={self.is_array}, array_index={self.array_index})"
         
+class FLUSHnode(ASTnode):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__('FLUSH')
+
+    def __repr__(self):
+        return f"FLUSHnode()"
+
 class IFnode(ASTnode):
+    __slots__ = ("condition",)
+
     def __init__(self, condition):
         super().__init__('IF')
         self.condition = condition
@@ -69,6 +95,8 @@ class IFnode(ASTnode):
         return f"IFnode(condition={self.condition})"
 
 class ELIFnode(ASTnode):
+    __slots__ = ("condition",)
+
     def __init__(self, condition):
         super().__init__('ELIF')
         self.condition = condition
@@ -78,6 +106,8 @@ class ELIFnode(ASTnode):
         return f"ELIFnode(condition={self.condition})"
 
 class ELSEnode(ASTnode):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__('ELSE')
         self.children = []
@@ -85,7 +115,19 @@ class ELSEnode(ASTnode):
     def __repr__(self):
         return f"ELSEnode()"
 
+class BLOCKnode(ASTnode): # Scope of a branch the optimizer knows is always taken
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__('BLOCK')
+        self.children = []
+
+    def __repr__(self):
+        return f"BLOCKnode()"
+
 class CONDITIONnode(ASTnode):
+    __slots__ = ("left", "operator", "right")
+
     def __init__(self, left, operator, right):
         super().__init__('CONDITION')
         self.left = left
@@ -96,6 +138,8 @@ class CONDITIONnode(ASTnode):
         return f"CONDITIONnode(left={self.left}, operator={self.operator}, right={self.right})"
 
 class ENDnode(ASTnode):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__('END')
 
@@ -103,6 +147,8 @@ class ENDnode(ASTnode):
         return f"ENDnode()"
 
 class LOOPnode(ASTnode):
+    __slots__ = ("variable", "start_index", "times_to_run")
+
     def __init__(self, variable, times_to_run, start_index=0):
         super().__init__('LOOP')
         self.variable = variable
@@ -114,6 +160,8 @@ class LOOPnode(ASTnode):
         return f"LOOPnode(times_to_run={self.times_to_run})"
 
 class ROLLnode(ASTnode):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__('ROLL')
 
@@ -121,22 +169,30 @@ class ROLLnode(ASTnode):
         return f"ROLLnode()"
 
 class BACKnode(ASTnode):
-    def __init__(self, variable_name):
+    __slots__ = ("variable_name", "variable_type")
+
+    def __init__(self, variable_name, variable_type):
         super().__init__('BACK')
         self.variable_name = variable_name
+        self.variable_type = variable_type # Type of the backup, the same as the variable
 
     def __repr__(self):
         return f"BACKnode(variable_name={self.variable_name})"
 
 class LOADnode(ASTnode):
-    def __init__(self, variable_name):
+    __slots__ = ("variable_name", "variable_type")
+
+    def __init__(self, variable_name, variable_type):
         super().__init__('LOAD')
         self.variable_name = variable_name
+        self.variable_type = variable_type
 
     def __repr__(self):
         return f"LOADnode(variable_name={self.variable_name})"
 
 class FNCnode(ASTnode):
+    __slots__ = ("function_type", "function_name", "args", "body")
+
     def __init__(self, function_type, function_name, args: dict):
         super().__init__('FUNC')
         self.function_type = function_type
@@ -148,6 +204,8 @@ class FNCnode(ASTnode):
         return f"FNCnode(function_name={self.function_name}, args={self.args}, body={self.body})"
 
 class RETURNnode(ASTnode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         super().__init__('RETURN')
         self.value = value
@@ -156,6 +214,8 @@ class RETURNnode(ASTnode):
         return f"RETURNnode(value={self.value})"
 
 class CALLnode(ASTnode): # Function call
+    __slots__ = ("function_name", "args")
+
     def __init__(self, function_name, args: list):
         super().__init__('CALL')
         self.function_name = function_name
@@ -165,6 +225,8 @@ class CALLnode(ASTnode): # Function call
         return f"CALLnode(function_name={self.function_name}, args={self.args})"
 
 class RANGEnode(ASTnode):
+    __slots__ = ("start", "end")
+
     def __init__(self, start, end):
         super().__init__('RANGE')
         self.start = start
@@ -174,17 +236,24 @@ class RANGEnode(ASTnode):
         return f"RANGEnode(start={self.start}, end={self.end})"
 
 class EXPRESSIONnode(ASTnode): # If there's no store variable, the value will be stored inside the left variable
-    def __init__(self, left, operator, right, store_variable=None):
+    __slots__ = ("left", "operator", "right", "store_variable", "left_is_array", "right_is_array", "array_size")
+
+    def __init__(self, left, operator, right, store_variable=None, left_is_array=False, right_is_array=False, array_size=None):
         super().__init__('EXPRESSION')
         self.left = left
         self.operator = operator
         self.right = right
         self.store_variable = store_variable
+        self.left_is_array = left_is_array
+        self.right_is_array = right_is_array
+        self.array_size = array_size # Size of the arrays for element-wise operations, None for scalar ones
 
     def __repr__(self):
-        return f"EXPRESSIONnode(left={self.left}, operator={self.operator}, right={self.right}, store_variable={self.store_variable})"
+        return f"EXPRESSIONnode(left={self.left}, operator={self.operator}, right={self.right}, store_variable={self.store_variable}, left_is_array={self.left_is_array}, right_is_array={self.right_is_array}, array_size={self.array_size})"
 
 class LIBnode(ASTnode):
+    __slots__ = ("library_name", "main_function")
+
     def __init__(self, library_name, main_function="main"): # The library name is basically the name of the file (hpp)
         super().__init__('LIB')
         self.library_name = library_name
@@ -194,6 +263,8 @@ class LIBnode(ASTnode):
         return f"LIBnode(library_name={self.library_name})"
 
 class INITnode(ASTnode):
+    __slots__ = ("namespace_name",)
+
     def __init__(self, namespace_name):
         super().__init__('INIT')
         self.namespace_name = namespace_name
@@ -202,6 +273,8 @@ class INITnode(ASTnode):
         return f"INITnode(namespace_name={self.namespace_name})"
 
 class LIBACCESSnode(ASTnode):
+    __slots__ = ("library_name", "function_name", "args")
+
     def __init__(self, library_name, function_name, args: list):
         super().__init__('LIBACCESS')
         self.library_name = library_name
@@ -211,129 +284,274 @@ class LIBACCESSnode(ASTnode):
     def __repr__(self):
         return f"LIBACCESSnode(library_name={self.library_name}, function_name={self.function_name}, args={self.args})"
 
+def iter_nodes(nodes, node_types=None):
+    # Every node of the AST, including the ones inside blocks and function bodies, or only the ones of node_types
+    # The nodes of an arena are walked by index, only the ones returned are made
+    if isinstance(nodes, ArenaBlock):
+        yield from nodes.arena.walk(nodes, node_types)
+        return
+    for node in nodes:
+        if node_types is None or node.type in node_types:
+            yield node
+        if node.children:
+            yield from iter_nodes(node.children, node_types)
+        if node.type == "FUNC":
+            yield from iter_nodes(node.body, node_types)
+
+def main_nodes(ast):
+    # The top level nodes main runs, without the functions, the libraries and the namespace
+    # An arena filters them by kind, so they're only made when they're visited
+    if isinstance(ast, ArenaBlock):
+        return ast.without("FUNC", "LIB", "INIT")
+    return [node for node in ast if node.type != "FUNC" and node.type != "LIB" and node.type != "INIT"]
+
+class LibraryTable:
+    # Parsed libraries a long running process (the watcher, a server worker) keeps in memory from one build to the next
+    # Keyed by the hash of their content, storing a new version of a library evicts the old one, so there's one per library and output mode
+    def __init__(self):
+        self.libraries = {} # Library key -> (AST, header code)
+        self.keys = {} # (absolute library path, buffered output) -> key of the version kept
+
+    def get(self, library_key):
+        return self.libraries.get(library_key)
+
+    def store(self, library_path, buffered_output, library_key, library):
+        previous_key = self.keys.get((library_path, buffered_output))
+        if previous_key is not None and previous_key != library_key:
+            self.libraries.pop(previous_key, None)
+        self.keys[(library_path, buffered_output)] = library_key
+        self.libraries[library_key] = library
+
+    def evict(self, library_path):
+        # Forgets every version of the library, like when its file changed or was removed
+        for buffered_output in (False, True):
+            library_key = self.keys.pop((library_path, buffered_output), None)
+            if library_key is not None:
+                self.libraries.pop(library_key, None)
+
+def load_library(library_path, cache=None, loader=None, buffered_output=False):
+    # Transpiles the library into C++ code, unless the same library source was already transpiled by a previous run
+    # The libraries it imports are loaded through the loader, a new one when it's not part of a build
+    # The ASTs are kept by the loader of the build, and from one build to the next only in the LibraryTable of the loader
+    # With buffered_output out doesn't flush, like in the program including the library
+    loader = loader or MapleLoader(cache, buffered_output=buffered_output)
+    buffered_output = loader.buffered_output
+    library_key = MapleCache.library_key(library_path, buffered_output)
+    if loader.library_table is not None and (loaded := loader.library_table.get(library_key)) is not None: # Loaded by an earlier build of this process
+        nodes, cpp_code = loaded
+    elif cache is not None and (cached := cache.lookup_library(library_key)) is not None: # Built by a previous run
+        nodes, cpp_code = cached
+    else:
+        with open(library_path, "r") as f: # Libraries are read whole, their tokens are kept in a compact TokenBuffer
+            nodes = MapleParser(MapleLexer(f.read()).tokenize_buffer(), cache, loader).parse()
+        cpp_code = "#pragma once\n" + MapleTranspiler(nodes, True, buffered_output=buffered_output).transpile() # Included by every library importing it
+        if cache is not None:
+            cache.store_library(library_key, nodes, cpp_code)
+    if loader.library_table is not None:
+        loader.library_table.store(os.path.abspath(library_path), buffered_output, library_key, (nodes, cpp_code))
+
+    # Writing the C++ code to a header file next to the library, only if it changed so g++ doesn't see a new header
+    write_if_changed(library_header(library_path, buffered_output), cpp_code)
+    return nodes, cpp_code
+
+def parse_library(library_path, cache, resolved, buffered_output):
+    # Runs in a worker process of MapleLoader.preload, the libraries it imports are already loaded by the main process
+    return load_library(library_path, cache, MapleLoader(cache, resolved=resolved, buffered_output=buffered_output))
+
+class MapleLoader:
+    # Loads the libraries of one build, each of them once: diamond imports share the same AST, and import cycles are errors
+    # instead of endless recursion. preload loads every library a file imports before it's parsed, the libraries that
+    # don't import each other in parallel
+    def __init__(self, cache=None, library_dir="lib", jobs=1, resolved=(), modules=None, buffered_output=False, library_table=None):
+        self.cache = cache
+        self.library_table = library_table # LibraryTable of the process, None when nothing is kept after the build
+        self.buffered_output = buffered_output # Output mode of the program, the libraries are transpiled with it
+        self.library_dir = library_dir
+        self.jobs = jobs
+        self.modules = dict(modules or {}) # Absolute library path -> (AST, header code) of every library loaded, or loaded by another process
+        self.resolved = set(resolved) # Libraries loaded by another process of the build, only their header is needed
+        self.loading = [] # Libraries being parsed, each one imported by the previous one
+        self.seconds = 0.0 # Time spent loading libraries, parsing them included
+
+    def library_path(self, library_name):
+        return os.path.abspath(os.path.join(self.library_dir, library_name + ".mal"))
+
+    def load(self, library_path):
+        # Returns the (AST, header code) of the library, None for the libraries resolved by another process
+        if library_path in self.modules or library_path in self.resolved:
+            return self.modules.get(library_path)
+        if library_path in self.loading:
+            cycle = self.loading[self.loading.index(library_path):] + [library_path]
+            raise MapleError(f"Import cycle: {' -> '.join(os.path.splitext(os.path.basename(path))[0] for path in cycle)}")
+
+        start = time.perf_counter()
+        self.loading.append(library_path)
+        try:
+            self.modules[library_path] = load_library(library_path, self.cache, self)
+        finally:
+            self.loading.pop()
+        if not self.loading: # The nested imports are part of the time of the outermost one
+            self.seconds += time.perf_counter() - start
+        return self.modules[library_path]
+
+    def preload(self, file_path):
+        # Loads every library the file imports, directly or not, so parsing the file finds them all loaded
+        # The import graph is read without parsing, the libraries of a level only import libraries of the levels before it
+        start, seconds = time.perf_counter(), self.seconds
+        modules = MapleProject.dependency_graph([file_path], self.library_dir)
+        levels = {} # Path -> level
+        for path in MapleProject.build_order(modules): # Also makes sure there are no import cycles
+            levels[path] = max((levels[dependency] + 1 for dependency in modules[path].dependencies), default=0)
+        file_path = os.path.abspath(file_path)
+
+        workers = None
+        try:
+            for level in range(max(levels.values(), default=-1) + 1):
+                paths = [path for path, path_level in levels.items() if path_level == level and path != file_path
+                         and path not in self.modules and path not in self.resolved]
+                if self.jobs > 1 and len(paths) > 1:
+                    workers = workers or ProcessPoolExecutor(self.jobs)
+                    resolved = self.resolved | set(self.modules)
+                    futures = [workers.submit(parse_library, path, self.cache, resolved, self.buffered_output) for path in paths]
+                    for path, future in zip(paths, futures):
+                        self.modules[path] = future.result() # Raises the MapleError of the worker
+                        if self.library_table is not None:
+                            self.library_table.store(path, self.buffered_output, MapleCache.library_key(path, self.buffered_output), self.modules[path])
+                else:
+                    for path in paths:
+                        self.load(path)
+        finally:
+            if workers is not None:
+                workers.shutdown()
+        self.seconds = seconds + time.perf_counter() - start # Instead of the time of every load
+
+def library_nodes(ast, cache=None, library_dir="lib", loader=None):
+    # Library name -> AST of every library the AST imports, directly or through other libraries
+    loader = loader or MapleLoader(cache, library_dir)
+    libraries = {}
+    pending = [node.library_name for node in ast if node.type == "LIB"]
+    while pending:
+        library_name = pending.pop()
+        if library_name in libraries:
+            continue
+        nodes, _ = loader.load(loader.library_path(library_name))
+        libraries[library_name] = nodes
+        pending.extend(node.library_name for node in nodes if node.type == "LIB")
+    return libraries
+
+statement_parsers = {} # Token type -> method parsing the statement starting with it
+
+def parses(*token_types):
+    # Registers a MapleParser method as the parser of the statements starting with the given token types
+    def register(method):
+        for token_type in token_types:
+            statement_parsers[token_type] = method
+        return method
+    return register
+
 class MapleParser:
-    def __init__(self, tokens):
-        self.tokens = tokens
+    def __init__(self, tokens, cache=None, loader=None, arena=None): # With a MapleCache, imported libraries are kept between runs
+        self.tokens = tokens if hasattr(tokens, "__getitem__") else TokenStream(tokens) # Iterators are read through a lookahead buffer
         self.current_position = 0
-        self.nodes = [] # List of nodes in the AST
+        self.arena = arena # With an ASTArena the nodes are packed into it as they're parsed, instead of kept as objects
+        self.nodes = self.new_block() # List of nodes in the AST
         self.symbol_table = {} # Dictionary of variables and their values
+        self.arguments = {} # Arguments of the function being parsed, name -> type
+        self.loop_variables = [] # Variables of the loops being parsed, innermost last
+        self.cache = cache
+        self.loader = loader or MapleLoader(cache) # Shared by every file of the build, so each library is parsed once
     
+    def token(self, offset=0):
+        # Works the same on token lists and token streams, only looking a few tokens ahead
+        try:
+            return self.tokens[self.current_position + offset]
+        except IndexError:
+            raise MapleError("Unexpected end of file")
+
+    def has_token(self, offset=0):
+        try:
+            self.tokens[self.current_position + offset]
+            return True
+        except IndexError:
+            return False
+
     def is_function_call(self):
-        position = self.current_position
-        if self.tokens[position].type == "ID" and position + 1 < len(self.tokens) and self.tokens[position + 1].type == "COLON":
+        if self.token().type == "ID" and self.has_token(1) and self.token(1).type == "COLON":
             return True
         return False
 
+    def new_block(self):
+        return [] if self.arena is None else self.arena.block()
+
     def parse(self):
-        while self.current_position < len(self.tokens):
-            if self.is_function_call():
-                call_node = self.parse_call() # Call node returns instead of appending to nodes
-                self.nodes.append(call_node)
-            else:
-                self.parse_statement()
+        while self.has_token():
+            self.parse_statement(top_level=True)
 
+        if self.arena is not None:
+            return self.arena.root(self.nodes) # An ArenaBlock, iterating it makes the nodes one at a time
         return self.nodes
 
-    def parse_statement(self):
-        token = self.tokens[self.current_position]
-
-        if token.type == "RUN":
-            self.parse_run()
-        elif token.type == "DEC":
-            self.parse_dec()
-        elif token.type == "OUT":
-            self.parse_out()
-        elif token.type == "IF":
-            self.parse_if()
-        elif token.type == "ELIF":
-            self.parse_elif()
-        elif token.type == "ELSE":
-            self.parse_else()
-        elif token.type == "END":
-            self.parse_end()
-        elif token.type == "SET":
-            self.parse_set()
-        elif token.type == "LOOP":
-            self.parse_loop()
-        elif token.type == "ROLL":
-            self.parse_roll()
-        elif token.type == "BACK":
-            self.parse_back()
-        elif token.type == "LOAD":
-            self.parse_load()
-        elif token.type == "FUNC":
-            self.parse_fnc()
-        elif token.type == "RETURN":
-            self.parse_return()
+    def parse_statement(self, top_level=False):
+        parse = statement_parsers.get(self.token().type)
+
+        if parse is not None:
+            parse(self)
         elif self.is_function_call():
-            self.parse_call()
-        elif token.type == "ADD" or token.type == "SUB" or token.type == "MUL" or token.type == "DIV" or token.type == "MOD":
-            self.parse_expression()
-        elif token.type == "LIB":
-            self.parse_lib()
-        elif token.type == "INIT":
-            self.parse_init()
-        elif token.type == "LIBACCESS":
-            self.parse_libaccess()
+            call_node = self.parse_call() # Call node returns instead of appending to nodes
+            if top_level:
+                self.nodes.append(call_node)
         else:
             self.current_position += 1
    
+    @parses("LIBACCESS")
     def parse_libaccess(self):
-        token_value = self.tokens[self.current_position].value
+        token_value = self.token().value
         library_name, _ = token_value.split("@")[1].split("::")
         self.current_position += 1  # Move past LIBACCESS token
 
-        if self.current_position >= len(self.tokens) or self.tokens[self.current_position].type != "ID":
-            raise MapleError("Expected function name after library access", self.tokens[self.current_position].line_num)
+        if not self.has_token() or self.token().type != "ID":
+            raise MapleError("Expected function name after library access", self.token().line_num)
 
-        function_name = self.tokens[self.current_position].value
+        function_name = self.token().value
         self.current_position += 1  # Move past function name
 
         # Parsing the arguments like a regular function call
         args = []
-        if self.current_position < len(self.tokens) and self.tokens[self.current_position].type == "COLON":
+        if self.has_token() and self.token().type == "COLON":
             self.current_position += 1  # Move past the colon
-            while self.current_position < len(self.tokens) and self.tokens[self.current_position].type != "COLON":
-                arg = self.tokens[self.current_position].value
+            while self.has_token() and self.token().type != "COLON":
+                arg = self.token().value
                 args.append(arg)
                 self.current_position += 1
-                if self.current_position < len(self.tokens) and self.tokens[self.current_position].type == "COMMA":
+                if self.has_token() and self.token().type == "COMMA":
                     self.current_position += 1  # Skip comma
 
         access_node = LIBACCESSnode(library_name, function_name, args)
         self.nodes.append(access_node)
        
+    @parses("INIT")
     def parse_init(self):
         if self.current_position != 0: # Error checking
-            raise MapleError("INIT must be at the beginning of the file", self.tokens[self.current_position].line_num)
-        elif self.current_position + 1 >= len(self.tokens):
-            raise MapleError("Expected namespace name", self.tokens[self.current_position].line_num) # Error checking
-        namespace_name = self.tokens[self.current_position].value.split("@")[1]
+            raise MapleError("INIT must be at the beginning of the file", self.token().line_num)
+        elif not self.has_token(1):
+            raise MapleError("Expected namespace name", self.token().line_num) # Error checking
+        namespace_name = self.token().value.split("@")[1]
         self.nodes.append(INITnode(namespace_name))
         self.current_position += 1 # Skipping the namespace name
 
+    @parses("LIB")
     def parse_lib(self):
-        library_name = self.tokens[self.current_position].value.split("@")[1]
+        library_name = self.token().value.split("@")[1]
         
         # Error checking
-        library_path = f"lib/{library_name}.mal"
-        absolute_library_path = os.path.abspath(library_path)
+        absolute_library_path = self.loader.library_path(library_name)
 
         if not os.path.exists(absolute_library_path):
-                raise MapleError(f"Library {library_name} does not exist", self.tokens[self.current_position].line_num)
+                raise MapleError(f"Library {library_name} does not exist", self.token().line_num)
         if library_name in self.symbol_table:
-            raise MapleError(f"Library {library_name} already exists", self.tokens[self.current_position].line_num)
-
-        # Transpiling the library into C++ code
-        with open(absolute_library_path, "r") as f:
-            code = f.read()
-        tokens = MapleLexer(code).tokenize()
-        nodes = MapleParser(tokens).parse()
-        cpp_code = MapleTranspiler(nodes, True).transpile()
+            raise MapleError(f"Library {library_name} already exists", self.token().line_num)
 
-        # Writing the C++ code to a header file in the lib folder
-        with open(f"lib/{library_name}.hpp", "w") as f:
-            f.write(cpp_code)
+        self.loader.load(absolute_library_path)
 
         # Adding the library to the symbol table
         self.symbol_table[library_name] = f"{library_name}.hpp"
@@ -342,33 +560,35 @@ class MapleParser:
         lib_node = LIBnode(library_name) # Create the LIB node
         self.nodes.append(lib_node) 
 
+    @parses("RUN")
     def parse_run(self):
         self.current_position += 1
-        times_to_run = self.tokens[self.current_position].value
+        times_to_run = self.token().value
         self.current_position += 1
         
         run_node = RUNnode(times_to_run)
         self.nodes.append(run_node)
 
+    @parses("DEC")
     def parse_dec(self):
         self.current_position += 1
         # Check if "ch" keyword is present, if so, is_constant is False, else proceed as normal
-        if self.tokens[self.current_position].type == "CH":
+        if self.token().type == "CH":
             self.current_position += 1
             is_constant = False
         else:
             is_constant = True
 
-        variable_type = self.tokens[self.current_position].value
+        variable_type = self.token().value
         self.current_position += 1 # Move past variable type
-        variable_name = self.tokens[self.current_position].value
+        variable_name = self.token().value
         self.current_position += 1 # Move past variable name
 
         # Check for a function call
         if self.is_function_call():
             function_call_node = self.parse_call()
-            print(function_call_node)
             self.nodes.append(DECnode(variable_type, variable_name, function_call_node, is_constant))
+            self.symbol_table[variable_name] = {"type": variable_type, "is_constant": is_constant, "is_array": False, "array_values": None, "array_size": 0}
 
         else:
             # Initialize variable_value to None or a default value
@@ -376,31 +596,31 @@ class MapleParser:
 
             # Error handling
             if variable_name in self.symbol_table:  # Variable already exists
-                raise MapleError(f"Variable {variable_name} already exists", self.tokens[self.current_position].line_num, self.tokens[self.current_position].char_pos)
+                raise MapleError(f"Variable {variable_name} already exists", self.token().line_num, self.token().char_pos)
             elif variable_type not in variable_types:  # Invalid variable type 
-                raise MapleError(f"Invalid variable type {variable_type}", self.tokens[self.current_position].line_num, self.tokens[self.current_position].char_pos)
+                raise MapleError(f"Invalid variable type {variable_type}", self.token().line_num, self.token().char_pos)
 
             # Check for array declaration
             is_array = False
             array_size = None
             array_values = []
-            if self.current_position < len(self.tokens) and self.tokens[self.current_position].type == "LEFT_SQR_BRACKET":
+            if self.has_token() and self.token().type == "LEFT_SQR_BRACKET":
                 self.current_position += 2  # Move past '[' and ']'
                 is_array = True
-                array_size = self.tokens[self.current_position].value
+                array_size = self.token().value
                 self.current_position += 1  # Move past array size
-                if self.tokens[self.current_position].type == "ARROW":
+                if self.token().type == "ARROW":
                     self.current_position += 1  # Move past '->'
-                    while self.tokens[self.current_position].type != "RIGHT_CRLY_BRACKET":
-                        if self.tokens[self.current_position].type == "NUMBER":
-                            array_values.append(self.tokens[self.current_position].value)  # Add value to list
+                    while self.token().type != "RIGHT_CRLY_BRACKET":
+                        if self.token().type == "NUMBER":
+                            array_values.append(self.token().value)  # Add value to list
                         self.current_position += 1  # Move past value
                     self.current_position += 1  # Move past '}'
             else:
-                variable_value = self.tokens[self.current_position].value
+                variable_value = self.token().value
                 self.current_position += 1
 
-            dec_node = DECnode(variable_type, variable_name, variable_value if not is_array else array_size, is_constant, is_array, array_values) 
+            dec_node = DECnode(variable_type, variable_name, variable_value if not is_array else array_size, is_constant, is_array, array_values if is_array else None) 
             self.nodes.append(dec_node)
 
             # Add variable to symbol table
@@ -412,6 +632,7 @@ class MapleParser:
                 "array_size": array_size if is_array else 0  # Use array_size instead of variable_value
             }
     
+    @parses("ADD", "SUB", "MUL", "DIV", "MOD")
     def parse_expression(self):
         op_map = {
             "ADD": "+",
@@ -421,70 +642,89 @@ class MapleParser:
             "MOD": "%",
         }
         
-        operation = self.tokens[self.current_position].type # Get the operation
+        operation_token = self.token()
+        operation = operation_token.type # Get the operation
         self.current_position += 1 # Move past operation
-        left = self.tokens[self.current_position].value
+        left = self.token().value
         self.current_position += 1
-        right = self.tokens[self.current_position].value
+        right = self.token().value
         self.current_position += 1 # Move past right
 
         assign_to = None
-        if self.tokens[self.current_position].type == "INSIDE":
+        if self.token().type == "INSIDE":
             self.current_position += 1 # Move past 'INSIDE'
-            assign_to = self.tokens[self.current_position].value # Get the variable name
+            assign_to = self.token().value # Get the variable name
             if assign_to not in self.symbol_table:
-                raise MapleError(f"Variable {assign_to} does not exist", self.tokens[self.current_position].line_num, self.tokens[self.current_position].char_pos)
+                raise MapleError(f"Variable {assign_to} does not exist", self.token().line_num, self.token().char_pos)
             self.current_position += 1 # Move past variable name
 
-        expression_node = EXPRESSIONnode(left, op_map[operation], right, assign_to)
+        # Element-wise when an array is involved: the result goes into an array, the array operands must have its size
+        # and the scalar operands are used for every element
+        destination = assign_to if assign_to is not None else left
+        left_is_array, right_is_array = self.is_array(left), self.is_array(right)
+        array_size = None
+        if left_is_array or right_is_array or self.is_array(destination):
+            if not self.is_array(destination):
+                raise MapleError(f"The result of an array operation can't be stored in {destination}, it isn't an array", operation_token.line_num, operation_token.char_pos)
+            array_size = self.symbol_table[destination]["array_size"]
+            for operand, operand_is_array in ((left, left_is_array), (right, right_is_array)):
+                if operand_is_array and self.symbol_table[operand]["array_size"] != array_size:
+                    raise MapleError(f"Array {operand} has {self.symbol_table[operand]['array_size']} elements, {destination} has {array_size}", operation_token.line_num, operation_token.char_pos)
+
+        expression_node = EXPRESSIONnode(left, op_map[operation], right, assign_to, left_is_array, right_is_array, array_size)
         self.nodes.append(expression_node)
 
+    def is_array(self, name):
+        symbol = self.symbol_table.get(name) # Libraries are in the symbol table too, as the name of their header
+        return isinstance(symbol, dict) and symbol["is_array"]
+
+    @parses("SET")
     def parse_set(self):
         self.current_position += 1 # Move past 'SET'
-        target = self.tokens[self.current_position].value # Get the variable name
+        target = self.token().value # Get the variable name
         self.current_position += 1 # Move past variable name
         
         # Array handling
         target_is_array = False
         target_index = None
-        if self.tokens[self.current_position].type == "LEFT_SQR_BRACKET": # Target is an array
+        if self.token().type == "LEFT_SQR_BRACKET": # Target is an array
             target_is_array = True
             self.current_position += 1 # Move past '['
-            target_index = self.tokens[self.current_position].value # Get the index
+            target_index = self.token().value # Get the index
 
             # Error handling
             if int(target_index) > int(self.symbol_table[target]["array_size"]) - 1:
-                raise MapleError(f"Index {target_index} out of range for array {target}", self.tokens[self.current_position].line_num, self.tokens[self.current_position].char_pos)
+                raise MapleError(f"Index {target_index} out of range for array {target}", self.token().line_num, self.token().char_pos)
 
             self.current_position += 1 # Move past index
             self.current_position += 1 # Move past ']'
             
-            value = self.tokens[self.current_position].value # Get the value
+            value = self.token().value # Get the value
             self.current_position += 1 # Move past value
-            if self.tokens[self.current_position].type == "LEFT_SQR_BRACKET": # Value is an array
+            if self.token().type == "LEFT_SQR_BRACKET": # Value is an array
                 self.current_position += 1 # Move past '['
-                value_index = self.tokens[self.current_position].value # Get the value index
+                value_index = self.token().value # Get the value index
                 self.current_position += 1
                 self.current_position += 1
                 try:
                     value = self.symbol_table[value]["array_values"][int(value_index)] # Get the value from the array
                 except IndexError:
-                    raise MapleError(f"Index {value_index} out of range for array {value}", self.tokens[self.current_position].line_num, self.tokens[self.current_position].char_pos)
+                    raise MapleError(f"Index {value_index} out of range for array {value}", self.token().line_num, self.token().char_pos)
             else: # Value is a variable
                 value = self.symbol_table[value]["array_values"][int(value)]
         else: # Target is a variable
-            value = self.tokens[self.current_position].value
+            value = self.token().value
             self.current_position += 1
         
         # Error checking
         if target not in self.symbol_table: # Check if variable is declared
-            line_num = self.tokens[self.current_position].line_num
-            current_char = self.tokens[self.current_position].char_pos
+            line_num = self.token().line_num
+            current_char = self.token().char_pos
             raise MapleError(f"Variable '{target}' not declared", line_num, current_char)
 
         if self.symbol_table[target]["is_constant"]: # Check if variable is constant
-            line_num = self.tokens[self.current_position].line_num
-            current_char = self.tokens[self.current_position].char_pos
+            line_num = self.token().line_num
+            current_char = self.token().char_pos
             raise MapleError(f"Cannot set constant variable '{target}' (remember variables are constant by default)", line_num, current_char)
 
         if self.symbol_table[target]["type"]:
@@ -492,22 +732,23 @@ class MapleParser:
             if value in self.symbol_table:
                 # Checking if the variable types match
                 if self.symbol_table[target]["type"] != self.symbol_table[value]["type"]:
-                    line_num = self.tokens[self.current_position].line_num
-                    current_char = self.tokens[self.current_position].char_pos
+                    line_num = self.token().line_num
+                    current_char = self.token().char_pos
                     raise MapleError(f"Cannot set variable '{target}' of type '{self.symbol_table[target]['type']}' to variable '{value}' of type '{self.symbol_table[value]['type']}'", line_num, current_char)
 
         set_node = SETnode(target, value, target_is_array, target_index)
         self.nodes.append(set_node) # Add the node to the AST
 
+    @parses("OUT")
     def parse_out(self):
         self.current_position += 1 # Move past 'OUT'
-        variable_name = self.tokens[self.current_position].value # Get the variable name
+        variable_name = self.token().value # Get the variable name
         self.current_position += 1 # Move past variable name
         
         # Check for array access
-        if self.current_position < len(self.tokens) and self.tokens[self.current_position].type == "LEFT_SQR_BRACKET":
+        if self.has_token() and self.token().type == "LEFT_SQR_BRACKET":
             self.current_position += 1 # Move past '['
-            array_index = self.tokens[self.current_position].value # Get the array index
+            array_index = self.token().value # Get the array index
             self.current_position += 2 # Move past array index and ']' 
 
             out_node = OUTnode(variable_name, True, array_index)
@@ -516,14 +757,19 @@ class MapleParser:
 
         self.nodes.append(out_node)
         
+    @parses("FLUSH")
+    def parse_flush(self):
+        self.current_position += 1 # Move past 'FLUSH'
+        self.nodes.append(FLUSHnode())
+
+    @parses("IF")
     def parse_if(self):
         self.current_position += 1
-        left = self.tokens[self.current_position].value
+        left = self.token().value
         self.current_position += 1
-        operator = self.tokens[self.current_position].value # Get the operator
-        print(operator)
+        operator = self.token().value # Get the operator
         self.current_position += 1
-        right = self.tokens[self.current_position].value
+        right = self.token().value
         self.current_position += 1
 
         condition_node = CONDITIONnode(left, operator, right)
@@ -531,10 +777,10 @@ class MapleParser:
 
         # Temporarily store the current list of nodes
         current_nodes = self.nodes
-        self.nodes = []  # Create a new list for nodes inside the if block
+        self.nodes = self.new_block()  # Create a new list for nodes inside the if block
 
         # Parse the code inside the if statement
-        while self.current_position < len(self.tokens) and self.tokens[self.current_position].type != "END":
+        while self.has_token() and self.token().type != "END":
             self.parse_statement()
         
         # Add the parsed nodes to the if_node and restore the original nodes list
@@ -545,16 +791,17 @@ class MapleParser:
         # Parsing the END token 
         self.parse_end()
 
+    @parses("ELSE")
     def parse_else(self):
         self.current_position += 1 # Move past 'ELSE'
 
         # Temporarily store the current list of nodes
         else_node = ELSEnode()
         current_nodes = self.nodes
-        self.nodes = []
+        self.nodes = self.new_block()
 
         # Parse the code inside the else statement
-        while self.current_position < len(self.tokens) and self.tokens[self.current_position].type != "END":
+        while self.has_token() and self.token().type != "END":
             self.parse_statement()
 
         # Add the parsed nodes to the else_node and restore the original nodes list
@@ -565,13 +812,14 @@ class MapleParser:
         # Parsing the END token
         self.parse_end()
 
+    @parses("ELIF")
     def parse_elif(self):
         self.current_position += 1 # Move past 'ELIF'
-        left = self.tokens[self.current_position].value # Get the left side of the condition
+        left = self.token().value # Get the left side of the condition
         self.current_position += 1 # Move past left side of condition
-        operator = self.tokens[self.current_position].value # Get the operator
+        operator = self.token().value # Get the operator
         self.current_position += 1 # Move past operator
-        right = self.tokens[self.current_position].value # Get the right side of the condition
+        right = self.token().value # Get the right side of the condition
         self.current_position += 1 # Move past right side of condition
 
         condition_node = CONDITIONnode(left, operator, right)
@@ -579,10 +827,10 @@ class MapleParser:
 
         # Temporarily store the current list of nodes
         current_nodes = self.nodes
-        self.nodes = []
+        self.nodes = self.new_block()
 
         # Parse the code inside the elif statement
-        while self.current_position < len(self.tokens) and self.tokens[self.current_position].type != "END":
+        while self.has_token() and self.token().type != "END":
             self.parse_statement()
 
         # Add the parsed nodes to the elif_node and restore the original nodes list
@@ -593,36 +841,40 @@ class MapleParser:
         # Parsing the END token
         self.parse_end()
 
+    @parses("END")
     def parse_end(self):
         self.current_position += 1
 
         end_node = ENDnode()
         self.nodes.append(end_node)
     
+    @parses("LOOP")
     def parse_loop(self):
         self.current_position += 1 # Move past "LOOP" token
-        variable = self.tokens[self.current_position].value # Get the loop variable
+        variable = self.token().value # Get the loop variable
         self.current_position += 1 # Move past the loop variable
         
         # Checking for a range
         starting_index = 0
         ending_index = 0
-        if self.tokens[self.current_position + 1].type == "DOTDOT":
-            starting_index = self.tokens[self.current_position].value # Get the starting index
+        if self.token(1).type == "DOTDOT":
+            starting_index = self.token().value # Get the starting index
             self.current_position += 2 # Move past the starting index and '..'
-            ending_index = self.tokens[self.current_position].value # Get the ending index
+            ending_index = self.token().value # Get the ending index
             self.current_position += 1 # Move past the ending index
         else:
-            ending_index = self.tokens[self.current_position].value # Get the ending index
+            ending_index = self.token().value # Get the ending index
             self.current_position += 1 # Move past the ending index
 
         # Parsing everything inside the loop
         loop_node = LOOPnode(variable, ending_index, starting_index)
         current_nodes = self.nodes # Temporarily store the current list of nodes
-        self.nodes = [] # Create a new list for nodes inside the loop
+        self.nodes = self.new_block() # Create a new list for nodes inside the loop
 
-        while self.current_position < len(self.tokens) and self.tokens[self.current_position].type != "END":
+        self.loop_variables.append(variable)
+        while self.has_token() and self.token().type != "END":
             self.parse_statement()
+        self.loop_variables.pop()
 
         loop_node.children = self.nodes # Add the parsed nodes to the loop_node
         self.nodes = current_nodes # Restore the original nodes list
@@ -631,85 +883,106 @@ class MapleParser:
         # Parsing the ROLL token
         self.parse_roll()
 
+    @parses("ROLL")
     def parse_roll(self):
         self.current_position += 1 # Skipping the token
         
         roll_node = ROLLnode()
         self.nodes.append(roll_node)
 
+    @parses("BACK")
     def parse_back(self):
         self.current_position += 1 # Skipping the token
-        variable_name = self.tokens[self.current_position].value # Get the variable name
+        variable_name = self.token().value # Get the variable name
+        variable_type = self.backup_type(variable_name)
         self.current_position += 1 # Move past the variable name
 
-        back_node = BACKnode(variable_name)
+        back_node = BACKnode(variable_name, variable_type)
         self.nodes.append(back_node)
 
+    @parses("LOAD")
     def parse_load(self):
         self.current_position += 1
-        variable_name = self.tokens[self.current_position].value
+        variable_name = self.token().value
+        variable_type = self.backup_type(variable_name)
         self.current_position += 1
 
-        load_node = LOADnode(variable_name)
+        load_node = LOADnode(variable_name, variable_type)
         self.nodes.append(load_node)
+
+    def backup_type(self, variable_name):
+        # The backup of a variable is a local of the same type, so the type has to be known when parsing
+        if variable_name in self.loop_variables: # Loop variables are ints
+            return "i32"
+        if variable_name in self.arguments:
+            return self.arguments[variable_name]
+        if variable_name not in self.symbol_table:
+            raise MapleError(f"Variable {variable_name} does not exist", self.token().line_num, self.token().char_pos)
+        if self.symbol_table[variable_name]["is_array"]:
+            raise MapleError(f"Cannot back up array {variable_name}", self.token().line_num, self.token().char_pos)
+        return self.symbol_table[variable_name]["type"]
     
+    @parses("FUNC")
     def parse_fnc(self):
         self.current_position += 1 # Move past the "FUNCTION" token
-        function_type = self.tokens[self.current_position].value # Get the function type
+        function_type = self.token().value # Get the function type
         self.current_position += 1 # Move past the function type
-        function_name = self.tokens[self.current_position].value # Get the function name
+        function_name = self.token().value # Get the function name
         self.current_position += 1 # Move past the function name
-        if self.tokens[self.current_position].type == "COLON": # Check for the ':' token
+        if self.token().type == "COLON": # Check for the ':' token
             self.current_position += 1 # Move past the ':' token
         else:
-            raise MapleError(f"Expected ':' after function name, got '{self.tokens[self.current_position].value}'", self.tokens[self.current_position].line_num, self.tokens[self.current_position].char_pos)
+            raise MapleError(f"Expected ':' after function name, got '{self.token().value}'", self.token().line_num, self.token().char_pos)
 
         # Parsing the arguments
         arguments = {}
-        while self.current_position < len(self.tokens) and self.tokens[self.current_position].type != "COLON":
-            argument_type = self.tokens[self.current_position].value # Get the argument type
+        while self.has_token() and self.token().type != "COLON":
+            argument_type = self.token().value # Get the argument type
             self.current_position += 1 # Move past the argument type
-            argument_name = self.tokens[self.current_position].value # Get the argument name
+            argument_name = self.token().value # Get the argument name
             self.current_position += 1 # Move past the argument name
             arguments[argument_name] = argument_type # Add the argument to the dictionary
-            if self.current_position < len(self.tokens) and self.tokens[self.current_position].type == "COMMA":
+            if self.has_token() and self.token().type == "COMMA":
                 self.current_position += 1 # Move past the ',' token:
 
         # Parsing the function body
         function_node = FNCnode(function_type, function_name, arguments)
         current_nodes = self.nodes # Temporarily store the current list of nodes
-        self.nodes = [] # Create a new list for nodes inside the function
+        self.nodes = self.new_block() # Create a new list for nodes inside the function
+        self.arguments = arguments
 
-        while self.current_position < len(self.tokens) and self.tokens[self.current_position].type != "END":
+        while self.has_token() and self.token().type != "END":
             self.parse_statement()
 
         function_node.body = self.nodes # Add the parsed nodes to the function_node
         self.nodes = current_nodes
+        self.arguments = {}
         self.nodes.append(function_node) # Add the function_node to the AST
 
         # Parsing the END token
-        if self.current_position < len(self.tokens) and self.tokens[self.current_position].type == "END":
+        if self.has_token() and self.token().type == "END":
             self.current_position += 1
         else:
-            raise MapleError(f"Expected 'END' after function body, got '{self.tokens[self.current_position].value}'", self.tokens[self.current_position].line_num, self.tokens[self.current_position].char_pos)
+            raise MapleError(f"Expected 'END' after function body, got '{self.token().value}'", self.token().line_num, self.token().char_pos)
 
+    @parses("RETURN")
     def parse_return(self):
         self.current_position += 1 # Move past the "RETURN" token
-        value = self.tokens[self.current_position].value # Get the return value
+        value = self.token().value # Get the return value
         return_node = RETURNnode(value)
         self.nodes.append(return_node)
 
     def parse_call(self):
-        function_name = self.tokens[self.current_position].value # Get the function name
+        function_name = self.token().value # Get the function name
         self.current_position += 2 # Move past the function name and ":" token
 
         # Parsing the arguments
         arguments = []
-        while self.current_position < len(self.tokens) and self.tokens[self.current_position].type != "COLON":
-            argument = self.tokens[self.current_position].value # Get the argument
+        while self.has_token() and self.token().type != "COLON":
+            argument = self.token().value # Get the argument
             arguments.append(argument)
             self.current_position += 1
-            if self.current_position < len(self.tokens) and self.tokens[self.current_position].type == "COMMA":
+            if self.has_token() and self.token().type == "COMMA":
                 self.current_position += 1
 
         call_node = CALLnode(function_name, arguments)
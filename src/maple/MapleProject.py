@@ -0,0 +1,110 @@
+import os
+import re
+import glob
+
+from MapleError import MapleError
+from MapleCache import library_regex
+
+init_regex = re.compile(rb"\binit @(\w+)") # Namespace declared by a source file
+
+class ProjectModule:
+    # A source file of the project, with the libraries it imports
+    def __init__(self, path, namespace, imports):
+        self.path = path
+        self.namespace = namespace
+        self.imports = imports # Names of the imported libraries
+        self.dependencies = [] # Paths of the imported libraries
+        self.is_library = os.path.splitext(path)[1] == ".mal"
+
+    def __repr__(self):
+        return f"ProjectModule(path={self.path}, namespace={self.namespace}, imports={self.imports})"
+
+def project_files(paths):
+    # Directories are searched for .mpl files, files are taken as they are
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.mpl"), recursive=True)))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            raise MapleError(f"File {path} does not exist")
+    return files
+
+def scan_module(path):
+    # Only the init and lib declarations are needed for the graph, so the file isn't parsed
+    with open(path, "rb") as f:
+        source = f.read()
+    init = init_regex.search(source)
+    namespace = init.group(1).decode() if init else None
+    return ProjectModule(path, namespace, [name.decode() for name in library_regex.findall(source)])
+
+def dependency_graph(paths, library_dir="lib"):
+    # Path -> ProjectModule of every file of the project and every library they import
+    modules = {}
+    pending = [os.path.abspath(path) for path in project_files(paths)]
+    while pending:
+        path = pending.pop()
+        if path in modules:
+            continue
+        module = modules[path] = scan_module(path)
+        for name in module.imports:
+            library_path = os.path.abspath(os.path.join(library_dir, name + ".mal"))
+            if not os.path.exists(library_path):
+                raise MapleError(f"Library {name} does not exist (imported by {path})")
+            module.dependencies.append(library_path)
+            pending.append(library_path)
+    return modules
+
+def build_order(modules):
+    # Libraries always come before the modules importing them
+    remaining = {path: len(set(module.dependencies)) for path, module in modules.items()}
+    dependents = {path: [] for path in modules}
+    for path, module in modules.items():
+        for dependency in set(module.dependencies):
+            dependents[dependency].append(path)
+
+    order = [path for path, count in remaining.items() if count == 0]
+    for path in order: # The list grows while it's being walked
+        for dependent in dependents[path]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                order.append(dependent)
+
+    if len(order) != len(modules):
+        raise MapleError(f"Import cycle: {' -> '.join(find_cycle(modules, set(modules) - set(order)))}")
+    return order
+
+def find_cycle(modules, paths):
+    # Following the imports between the modules left out of the build order always ends up in a cycle
+    path = next(iter(sorted(paths)))
+    seen = []
+    while path not in seen:
+        seen.append(path)
+        path = next(dependency for dependency in modules[path].dependencies if dependency in paths)
+    cycle = seen[seen.index(path):] + [path]
+    return [modules[path].namespace or os.path.basename(path) for path in cycle]
+
+def imported_libraries(modules, path):
+    # Paths of every library the module imports, directly or through other libraries
+    libraries = []
+    pending = list(modules[path].dependencies)
+    while pending:
+        library_path = pending.pop()
+        if library_path not in libraries:
+            libraries.append(library_path)
+            pending.extend(modules[library_path].dependencies)
+    return libraries
+
+def output_names(modules):
+    # Source path -> name of its C++ file, the path relative to the directory all the sources are in
+    # so sources with the same file name in different directories don't write the same C++ file
+    sources = [path for path, module in modules.items() if not module.is_library]
+    if not sources:
+        return {}
+    root = os.path.commonpath([os.path.dirname(path) for path in sources])
+    names = {path: os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, "__") for path in sources}
+    clashes = sorted(path for path in sources if list(names.values()).count(names[path]) > 1)
+    if clashes:
+        raise MapleError(f"These sources would write the same C++ file: {', '.join(clashes)}")
+    return names
@@ -0,0 +1,125 @@
+import io
+import os
+import glob
+import shutil
+import socket
+import argparse
+import tempfile
+import contextlib
+import socketserver
+from concurrent.futures import ProcessPoolExecutor
+
+from MapleError import MapleError
+from MapleParser import MapleLoader, LibraryTable, load_library
+from MapleCache import MapleCache
+from MapleDriver import MapleDriver
+from MapleClient import default_socket, send_message, receive_message
+from MapleCompiler import MapleCompile, transpile_source
+
+# Options of a request, passed on to MapleCompile
+request_options = ("use_cache", "cache_size", "prelude", "incremental", "profile", "pgo", "train_command", "train_input", "optimize", "shake", "buffered_output", "bench", "interp", "jobs")
+
+library_table = LibraryTable() # Libraries parsed by this worker process, kept from one request to the next whatever directory it comes from
+
+def warm_up(library_dir):
+    # Runs once in every worker process, so the libraries are parsed in both output modes before the first request needs them
+    for library_path in glob.glob(os.path.join(library_dir, "*.mal")):
+        for buffered_output in (False, True):
+            try:
+                load_library(library_path, loader=MapleLoader(library_dir=library_dir, buffered_output=buffered_output, library_table=library_table))
+            except MapleError: # Reported by the requests importing it
+                pass
+
+def serve(request):
+    # Runs in a worker process, which keeps the compiler modules and the parsed libraries (library_table) from one request to the next
+    # A request has the path of the source, or the source itself and a file name, and returns the C++ code or the path of the binary
+    options = request.get("options", {})
+    unknown = set(options) - set(request_options)
+    if unknown:
+        return {"ok": False, "error": f"Unknown options: {', '.join(sorted(unknown))}"}
+
+    os.chdir(request["cwd"]) # The libraries and src/files/cpp are relative to the directory of the client
+    source_dir = name = None
+    try:
+        if "source" in request:
+            source_dir = tempfile.mkdtemp(prefix="maple_")
+            file = os.path.join(source_dir, os.path.basename(request.get("name", "main.mpl")))
+            with open(file, "w") as f:
+                f.write(request["source"])
+            # Requests sending the source often share its file name, the outputs get the unique name of the directory so they don't overwrite each other
+            name = os.path.splitext(os.path.basename(file))[0] + "_" + os.path.basename(source_dir)
+        else:
+            file = request["file"]
+
+        if request.get("output", "binary") == "cpp":
+            driver = MapleDriver(options.get("profile", "debug"), buffered_output=options.get("buffered_output"))
+            cache = MapleCache(max_size=options.get("cache_size", 512) * 1024 * 1024) if options.get("use_cache", True) else None
+            loader = MapleLoader(cache, buffered_output=driver.buffered_output, library_table=library_table)
+            file_path, _ = transpile_source(file, driver, cache, options.get("prelude", False), options.get("optimize", True), options.get("shake", True), options.get("bench"), loader=loader, name=name)
+            with open(file_path, "r") as f:
+                response = {"ok": True, "cpp": f.read(), "cpp_path": file_path}
+        elif options.get("interp"):
+            # The interpreter runs here, what it prints is sent back to the client
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                driver = MapleCompile(file, run=request.get("run", True), name=name, library_table=library_table, **{"jobs": 1, **options})
+            response = {"ok": True, "output": output.getvalue()}
+        else:
+            driver = MapleCompile(file, run=False, name=name, library_table=library_table, **{"jobs": 1, **options}) # The server's workers are the parallelism
+            response = {"ok": True, "binary": driver.binary}
+    except (MapleError, OSError) as error:
+        return {"ok": False, "error": str(error)}
+    except Exception as error: # Some broken sources still crash the compiler, the client gets the error and the worker goes on
+        return {"ok": False, "error": f"{type(error).__name__}: {error}"}
+    finally:
+        if source_dir is not None:
+            shutil.rmtree(source_dir, ignore_errors=True)
+
+    response["steps"] = [(step.name, step.seconds) for step in driver.steps]
+    response["notes"] = driver.notes
+    response["diagnostics"] = driver.diagnostics()
+    response["counters"] = driver.counters
+    response["metrics"] = driver.metrics()
+    return response
+
+class MapleRequestHandler(socketserver.StreamRequestHandler):
+    # Every connection gets a thread, which waits on the worker pool for each of its requests
+    def handle(self):
+        while (request := receive_message(self.rfile)) is not None:
+            send_message(self.wfile, self.server.workers.submit(serve, request).result())
+
+class MapleServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Compile server: requests are served by a pool of worker processes, so builds run in parallel up to the number of workers
+    daemon_threads = True
+
+    def __init__(self, socket_path=default_socket, jobs=None, library_dir="lib"):
+        self.socket_path = socket_path
+        if os.path.exists(socket_path): # Only taken over when it's left behind by a server that didn't shut down cleanly
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(socket_path)
+                except ConnectionRefusedError:
+                    os.remove(socket_path)
+                else:
+                    raise MapleError(f"A Maple server is already listening on {socket_path}")
+        self.workers = ProcessPoolExecutor(jobs or os.cpu_count(), initializer=warm_up, initargs=(os.path.abspath(library_dir),))
+        self.workers.submit(os.getpid).result() # Starts the workers now, before the server has any threads
+        super().__init__(socket_path, MapleRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.workers.shutdown()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves Maple builds on a Unix socket, see MapleClient.py")
+    parser.add_argument("--socket", default=default_socket, help="Unix socket to listen on")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes, defaults to the number of cores")
+    args = parser.parse_args()
+
+    with MapleServer(args.socket, args.jobs) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
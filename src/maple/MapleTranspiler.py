@@ -1,23 +1,91 @@
 from MapleTypes import *
+from MapleError import MapleError
 
 import MapleParser
+from MapleArena import block_key
+
+# Emitted once before the libraries in bench mode
+# maple_do_not_optimize makes g++ believe the value is used, so the benchmarked code isn't removed
+# maple_bench_report prints min, median, mean and p99 in microseconds, as text on stderr and as JSON on stdout
+bench_helpers = """#ifndef MAPLE_BENCH_HELPERS
+#define MAPLE_BENCH_HELPERS
+template <class T> inline void maple_do_not_optimize(T const& value) {
+asm volatile("" : : "r,m"(value) : "memory");
+}
+inline void maple_bench_report(std::vector<double> times, int warmup) {
+std::sort(times.begin(), times.end());
+double total = 0;
+for (double time : times) total += time;
+const size_t count = times.size();
+const double minimum = count ? times[0] : 0;
+const double median = count ? (count % 2 ? times[count / 2] : (times[count / 2 - 1] + times[count / 2]) / 2) : 0;
+const double mean = count ? total / count : 0;
+const double p99 = count ? times[(count * 99 + 99) / 100 - 1] : 0;
+std::cerr << "runs: " << count << " (" << warmup << " warm-up discarded)\\n"
+<< "min: " << minimum << " us\\nmedian: " << median << " us\\nmean: " << mean << " us\\np99: " << p99 << " us\\n";
+std::cout << "{\\"runs\\": " << count << ", \\"warmup\\": " << warmup << ", \\"min_us\\": " << minimum << ", \\"median_us\\": " << median
+<< ", \\"mean_us\\": " << mean << ", \\"p99_us\\": " << p99 << "}" << std::endl;
+}
+#endif
+"""
+
+class CodeEmitter:
+    # Collects the generated code as a list of fragments, joined only once at the end
+    # With a file the fragments are written out every few KB instead, so the whole code is never in memory
+    def __init__(self, file=None, flush_size=1 << 16):
+        self.file = file
+        self.flush_size = flush_size
+        self.fragments = []
+        self.size = 0 # Characters waiting in the fragments list
+
+    def write(self, code):
+        self.fragments.append(code)
+        if self.file is not None:
+            self.size += len(code)
+            if self.size >= self.flush_size:
+                self.flush()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.write("".join(self.fragments))
+            self.fragments.clear()
+            self.size = 0
+
+    def getvalue(self):
+        return "".join(self.fragments)
+
+node_transpilers = {} # Node type -> method transpiling the node
+
+def transpiles(*node_types):
+    # Registers a MapleTranspiler method as the transpiler of the given node types
+    def register(method):
+        for node_type in node_types:
+            node_transpilers[node_type] = method
+        return method
+    return register
 
 class MapleTranspiler:
-    def __init__(self, ast, is_library=False):
+    def __init__(self, ast, is_library=False, prelude=False, libraries=None, buffered_output=False, bench=False, bench_warmup=1):
         self.ast = ast
-        self.cpp_code = ""
+        self.emitter = CodeEmitter()
         self.namesapce = ""
         self.is_library = is_library
+        self.prelude = prelude # Include the shared (precompiled) prelude instead of only the needed headers
+        self.libraries = libraries # Library name -> tree shaken AST, the libraries are then emitted in the code instead of included
+        self.emitted_libraries = set() # Shared with the transpilers of the libraries, so a library imported twice is emitted once
+        self.buffered_output = buffered_output # out writes a newline instead of std::endl, the output is only flushed when the buffer is full, by flush and at exit
+        self.bench = bench # The run loop times every iteration and out doesn't print, the code after run is what's benchmarked
+        self.bench_warmup = bench_warmup # Iterations run before the measured ones
+        self.backups = {} # (block, name) -> type of the backups of the function being transpiled
+
+    def emit(self, code):
+        self.emitter.write(code)
 
-    def transpile(self):
+    def transpile(self, file=None): # With a file the code is written into it and nothing is returned
+        self.emitter = CodeEmitter(file)
 
         # Write includes and start of main function
-        self.cpp_code += "#include <iostream>\n#include <string>\n#include <vector>\n#include <fstream>\n#include <sstream>\n#include <algorithm>\n#include <random>\n#include <chrono>\n#include <map>\n#include <cstdint>\n\n"
-        
-        # BUT FIRST... let's transpile the function from the imported libraries
-        for node in self.ast:
-            if node.type == "LIB":
-                self.transpile_node(node)
+        self.transpile_includes()
 
         # Actually, first of all before anything else (for real this time), we need to transpile the namespace
         node = self.ast[0] # The first node is always the namespace
@@ -30,81 +98,178 @@ class MapleTranspiler:
                 self.transpile_node(node)
 
         # Ending the namespace
-        self.cpp_code += "}\n" # End of namespace
+        self.emit("}\n") # End of namespace
+
+        self.transpile_main()
+
+        if file is not None:
+            self.emitter.flush()
+            return None
+        return self.emitter.getvalue()
+
+    def transpile_units(self, name):
+        # Incremental builds: a header declaring every function, then one translation unit for each function and one for main
+        # Editing a function only changes its own unit, so only that one has to be compiled again
+        # Returns {file name: code}, overloads of the same function share a unit
+        # The unit of main is {name}.entry.cpp, a function name can't have a dot so no function unit ever takes its place
+        units = {}
+        header_name = f"{name}_decls.hpp"
+        init_node = self.ast[0] # The first node is always the namespace
+        self.namespace = init_node.namespace_name
+        functions = [node for node in self.ast if node.type == "FUNC"]
+
+        self.emitter = CodeEmitter()
+        self.emit("#pragma once\n")
+        self.transpile_includes()
+        self.transpile_INITnode(init_node)
+        for node in functions:
+            self.emit(self.function_signature(node) + ";\n")
+        self.emit("}\n") # End of namespace
+        units[header_name] = self.emitter.getvalue()
 
+        for node in functions:
+            unit_name = f"{name}_{node.function_name}.cpp"
+            self.emitter = CodeEmitter()
+            if unit_name not in units:
+                self.emit(f"#include \"{header_name}\"\n\n")
+            self.transpile_INITnode(init_node)
+            self.transpile_node(node)
+            self.emit("}\n") # End of namespace
+            units[unit_name] = units.get(unit_name, "") + self.emitter.getvalue()
+
+        self.emitter = CodeEmitter()
+        self.emit(f"#include \"{header_name}\"\n\n")
+        self.transpile_main()
+        units[f"{name}.entry.cpp"] = self.emitter.getvalue()
+        return units
+
+    def transpile_includes(self):
+        if self.prelude:
+            self.emit("#include \"../../../lib/maple_prelude.hpp\"\n\n")
+        else:
+            self.emit("".join(f"#include <{header}>\n" for header in self.required_headers()) + "\n")
+        if self.bench:
+            self.emit(bench_helpers)
+        
+        # BUT FIRST... let's transpile the function from the imported libraries
+        for node in self.ast:
+            if node.type == "LIB":
+                self.transpile_node(node)
+
+    def transpile_main(self):
         # Main function transpilation
         if self.is_library == False: # If we are transpiling a library we don't need a main function
-            self.cpp_code += "int main() {\n" 
-            self.cpp_code += "std::map<std::string, int8_t> backups;\n"
+            self.emit("int main() {\n")
+            if self.buffered_output:
+                # Not synced with C stdio, cout gets its own big buffer (set before anything is written)
+                self.emit("std::ios::sync_with_stdio(false);\n")
+                self.emit("static char output_buffer[1 << 20];\n")
+                self.emit("std::cout.rdbuf()->pubsetbuf(output_buffer, sizeof(output_buffer));\n")
 
         # Then transpile the rest of the nodes
-        for node in self.ast:
-            if node.type != "FUNC" and node.type != "LIB" and node.type != "INIT": # We already transpiled functions, libraries and namespaces
-                self.transpile_node(node)
-        
-        if self.ast[0].type == "RUN":
-            self.cpp_code += "}\n" # End of run function
+        main_nodes = MapleParser.main_nodes(self.ast) # We already transpiled functions, libraries and namespaces
+        self.scope_backups(main_nodes)
+        if self.is_library == False:
+            self.emit_backups(main_nodes)
+        runs = sum(node.type == "RUN" for node in main_nodes)
+        if self.bench and not self.is_library and runs != 1:
+            raise MapleError("Benchmarking needs exactly one run statement, the code after it is what's measured")
+        for node in main_nodes:
+            self.transpile_node(node)
+
+        # The run loops go on until the end of main
+        for _ in range(runs):
+            if self.bench:
+                self.emit("const auto maple_bench_end = std::chrono::steady_clock::now();\n")
+                self.emit(f"if (run >= {self.bench_warmup}) maple_bench_times.push_back(std::chrono::duration<double, std::micro>(maple_bench_end - maple_bench_start).count());\n")
+                self.emit("}\n") # End of run function
+                self.emit(f"maple_bench_report(maple_bench_times, {self.bench_warmup});\n")
+            else:
+                self.emit("}\n") # End of run function
 
         if self.is_library == False: # If we are transpiling a library we don't need a main function
-            self.cpp_code += "\nstd::cin.get();\nreturn 0;\n}\n" # End of main function
-        return self.cpp_code
+            self.emit("\nstd::cin.get();\nreturn 0;\n}\n") # End of main function
+
+    def function_signature(self, node):
+        function_type = type_dic[node.function_type] # Converting the type to C++ type
+        arguments = ", ".join(f"{type_dic[argument_type]} {argument_name}" for argument_name, argument_type in node.args.items()) # Converting the types to C++ types
+        return f"{function_type} {node.function_name}({arguments})"
+
+    def scope_backups(self, nodes):
+        # Finds the block declaring every variable backed up or loaded in a function (or main), keyed by (block, name)
+        # A variable shadowing another one of a different type gets its own backup, declared in its own block
+        # Arguments and globals are declared by the function itself
+        self.backups = backups = {}
+        if not any(True for _ in MapleParser.iter_nodes(nodes, ("BACK", "LOAD"))): # Most functions back nothing up, an arena finds out from the node kinds alone
+            return
+        def scan(block, scopes):
+            declared = scopes[-1][1]
+            for node in block:
+                if node.type == "DEC":
+                    declared[node.variable_name] = node.variable_type
+                elif node.type == "BACK" or node.type == "LOAD":
+                    scope, variables = next((scope for scope in reversed(scopes) if node.variable_name in scope[1]), scopes[0])
+                    backups.setdefault((block_key(scope), node.variable_name), variables.get(node.variable_name, node.variable_type))
+                if node.children:
+                    inner = {node.variable: "i32"} if node.type == "LOOP" else {} # The loop variable is declared by the loop
+                    scan(node.children, scopes + [(node.children, inner)])
+        scan(nodes, [(nodes, {})])
+
+    def emit_backups(self, block):
+        # Declares the backups of the variables declared in the block, plain locals of the same type
+        # They're declared at the start of the block, so back and load can be in different inner blocks
+        for (scope, variable_name), variable_type in self.backups.items():
+            if scope == block_key(block):
+                self.emit(f"{type_dic[variable_type]} maple_backup_{variable_name}{{}};\n")
+
+    def required_headers(self):
+        # Only the standard headers the program actually uses, most of the g++ time goes into parsing them
+        headers = set()
+        if not self.is_library:
+            headers.add("iostream") # std::cin.get() at the end of main
+
+        for node in MapleParser.iter_nodes(self.ast, ("OUT", "FLUSH", "RUN", "DEC", "FUNC", "BACK", "LOAD")):
+            if node.type == "OUT" or node.type == "FLUSH":
+                headers.add("iostream")
+            elif node.type == "RUN" and self.bench:
+                headers.update(("iostream", "chrono", "vector", "algorithm"))
+            elif node.type == "DEC" and node.variable_type in type_headers:
+                headers.add(type_headers[node.variable_type])
+            elif node.type == "FUNC":
+                for variable_type in (node.function_type, *node.args.values()):
+                    if variable_type in type_headers:
+                        headers.add(type_headers[variable_type])
+            elif (node.type == "BACK" or node.type == "LOAD") and node.variable_type in type_headers:
+                headers.add(type_headers[node.variable_type])
+
+        return [header for header in prelude_headers if header in headers] # Always in the same order
 
     def transpile_node(self, node):
-        if node.type == "RUN":
-            self.transpile_RUNnode(node)
-        elif node.type == "DEC":
-            self.transpile_DECnode(node)
-        elif node.type == "OUT":
-            self.transpile_OUTnode(node)
-        elif node.type == "IF":
-            self.transpile_IFnode(node)
-        elif node.type == "ELSE":
-            self.transpile_ELSEnode(node)
-        elif node.type == "ELIF":
-            self.transpile_ELIFnode(node)
-        elif node.type == "END":
-            self.transpile_ENDnode(node)
-        elif node.type == "SET":
-            self.transpile_SETnode(node)
-        elif node.type == "LOOP":
-            self.transpile_LOOPnode(node)
-        elif node.type == "ROLL":
-            self.transpile_ROLLnode(node)
-        elif node.type == "BACK":
-            self.transpile_BACKnode(node)
-        elif node.type == "LOAD":
-            self.transpile_LOADnode(node)
-        elif node.type == "FUNC":
-            self.transpile_FNCnode(node)
-        elif node.type == "RETURN":
-            self.transpile_RETURNnode(node)
-        elif node.type == "CALL":
-            self.transpile_CALLnode(node)
-        elif node.type == "EXPRESSION":
-            self.transpile_EXPRESSIONnode(node)
-        elif node.type == "LIB":
-            self.transpile_LIBnode(node)
-        elif node.type == "INIT":
-            self.transpile_INITnode(node)
-        elif node.type == "LIBACCESS":
-            self.transpile_LIBACCESSnode(node)
-        else:
+        transpile = node_transpilers.get(node.type)
+        if transpile is None:
             raise Exception(f"Invalid node type: {node.type}")
+        transpile(self, node)
    
+    @transpiles("LIBACCESS")
     def transpile_LIBACCESSnode(self, node):
-        self.cpp_code += f"{node.library_name}::{node.function_name}" + "("
-        for argument in node.args:
-            self.cpp_code += f"{argument}, "
-        self.cpp_code = self.cpp_code[:-2] + ");\n" # Remove the last comma and space and add the closing bracket 
+        self.emit(f"{node.library_name}::{node.function_name}(" + ", ".join(node.args) + ");\n")
 
+    @transpiles("INIT")
     def transpile_INITnode(self, node):
-        self.cpp_code += "namespace " + node.namespace_name + " {\n"
+        self.emit("namespace " + node.namespace_name + " {\n")
 
+    @transpiles("RUN")
     def transpile_RUNnode(self, node):
-        self.cpp_code += f"for (int run = 0; run < {node.times_to_run}; run++) {{\n"
+        if self.bench:
+            self.emit("std::vector<double> maple_bench_times;\n")
+            self.emit(f"maple_bench_times.reserve({node.times_to_run});\n")
+            self.emit(f"for (int run = 0; run < {self.bench_warmup} + {node.times_to_run}; run++) {{\n")
+            self.emit("const auto maple_bench_start = std::chrono::steady_clock::now();\n")
+        else:
+            self.emit(f"for (int run = 0; run < {node.times_to_run}; run++) {{\n")
 
+    @transpiles("DEC")
     def transpile_DECnode(self, node):
-        print(node)
         cpp_type = type_dic[node.variable_type]
         const_str = "const " if node.is_constant else ""
         array_str = f"[{node.variable_value}]" if node.is_array else ""
@@ -120,92 +285,134 @@ class MapleTranspiler:
         if node.is_array and node.array_values is not None:
             value_str = " = {" + ", ".join(node.array_values) + "}"
         
-        self.cpp_code += f"{const_str}{cpp_type} {node.variable_name}{array_str}{value_str};\n"
+        self.emit(f"{const_str}{cpp_type} {node.variable_name}{array_str}{value_str};\n")
 
     
+    @transpiles("SET")
     def transpile_SETnode(self, node):
         if node.target_is_array:
-            self.cpp_code += f"{node.target}[{node.target_array_index}] = {node.value};\n"
+            self.emit(f"{node.target}[{node.target_array_index}] = {node.value};\n")
         else:
-            self.cpp_code += f"{node.target} = {node.value};\n"
+            self.emit(f"{node.target} = {node.value};\n")
 
+    @transpiles("OUT")
     def transpile_OUTnode(self, node):
+        if self.bench: # Quiet, but the value still has to be computed
+            index = f"[{node.array_index}]" if node.is_array else ""
+            self.emit(f"maple_do_not_optimize({node.variable_name}{index});\n")
+            return
+        end = "'\\n'" if self.buffered_output else "std::endl" # std::endl flushes, so it's one write per out
         if node.is_array:
-            self.cpp_code += f"std::cout << {node.variable_name}[{node.array_index}] << std::endl;\n"
+            self.emit(f"std::cout << {node.variable_name}[{node.array_index}] << {end};\n")
         else:
-            self.cpp_code += f"std::cout << {node.variable_name} << std::endl;\n"
+            self.emit(f"std::cout << {node.variable_name} << {end};\n")
 
+    @transpiles("FLUSH")
+    def transpile_FLUSHnode(self, node):
+        if not self.bench:
+            self.emit("std::cout << std::flush;\n")
+
+    @transpiles("IF")
     def transpile_IFnode(self, node):
-        self.cpp_code += f"if ({node.condition.left} {node.condition.operator} {node.condition.right}) {{\n"
+        self.emit(f"if ({node.condition.left} {node.condition.operator} {node.condition.right}) {{\n")
+        self.emit_backups(node.children)
         for child in node.children:
             self.transpile_node(child)
 
+    @transpiles("ELSE")
     def transpile_ELSEnode(self, node):
-        self.cpp_code += "else {\n"
+        self.emit("else {\n")
+        self.emit_backups(node.children)
         for child in node.children:
             self.transpile_node(child)
 
+    @transpiles("ELIF")
     def transpile_ELIFnode(self, node):
-        self.cpp_code += "else if ({node.condition.left} {node.condition.operator} {node.condition.right}) {{\n"
+        self.emit("else if ({node.condition.left} {node.condition.operator} {node.condition.right}) {{\n")
+        self.emit_backups(node.children)
         for child in node.children:
             self.transpile_node(child)
 
+    @transpiles("BLOCK")
+    def transpile_BLOCKnode(self, node):
+        self.emit("{\n")
+        self.emit_backups(node.children)
+        for child in node.children:
+            self.transpile_node(child)
+
+    @transpiles("END")
     def transpile_ENDnode(self, node):
-        self.cpp_code += "}\n"
+        self.emit("}\n")
 
+    @transpiles("LOOP")
     def transpile_LOOPnode(self, node):
-        self.cpp_code += f"for (int {node.variable} = {node.start_index}; {node.variable} < {node.times_to_run}; {node.variable}++) {{\n" 
+        self.emit(f"for (int {node.variable} = {node.start_index}; {node.variable} < {node.times_to_run}; {node.variable}++) {{\n")
+        self.emit_backups(node.children)
         for child in node.children:
             self.transpile_node(child)
 
+    @transpiles("ROLL")
     def transpile_ROLLnode(self, node):
-        self.cpp_code += "}\n"
+        self.emit("}\n")
 
+    @transpiles("BACK")
     def transpile_BACKnode(self, node):
         # Backing up the state of the variable
-        self.cpp_code += f"backups[\"{node.variable_name}\"] = {node.variable_name};\n"
+        self.emit(f"maple_backup_{node.variable_name} = {node.variable_name};\n")
     
+    @transpiles("LOAD")
     def transpile_LOADnode(self, node):
         # Restoring the state of the variable
-        self.cpp_code += f"{node.variable_name} = backups[\"{node.variable_name}\"];\n"
+        self.emit(f"{node.variable_name} = maple_backup_{node.variable_name};\n")
 
+    @transpiles("FUNC")
     def transpile_FNCnode(self, node):
-        function_type = node.function_type 
-        function_name = node.function_name
-        arguments = node.args
-        function_body = node.body
-        
-        # Creating the function header
-        function_type = type_dic[function_type] # Converting the type to C++ type    
-        self.cpp_code += f"{function_type} {function_name}("
-        for argument_name, argument_type in arguments.items():
-            argument_type = type_dic[argument_type] # Converting the type to C++ type
-            self.cpp_code += f"{argument_type} {argument_name}, "
-        self.cpp_code = self.cpp_code[:-2] + ") {\n" # Remove the last comma and space and add the closing bracket
+        # Creating the function header, library functions are defined in a header so they have to be inline
+        self.emit(("inline " if self.is_library else "") + self.function_signature(node) + " {\n")
 
         # Adding the function body
-        for child in function_body:
+        self.scope_backups(node.body)
+        self.emit_backups(node.body)
+        for child in node.body:
             self.transpile_node(child)
 
         # Adding the closing bracket
-        self.cpp_code += "}\n"
+        self.emit("}\n")
 
+    @transpiles("RETURN")
     def transpile_RETURNnode(self, node):
-        self.cpp_code += f"return {node.value};\n"
+        self.emit(f"return {node.value};\n")
 
+    @transpiles("CALL")
     def transpile_CALLnode(self, node):
-        self.cpp_code += f"{self.namespace}::{node.function_name}("
-        for argument in node.args:
-            self.cpp_code += f"{argument}, "
-        self.cpp_code = self.cpp_code[:-2] + ");\n" # Remove the last comma and space and add the closing bracket
+        self.emit(f"{self.namespace}::{node.function_name}(" + ", ".join(node.args) + ");\n")
     
+    @transpiles("EXPRESSION")
     def transpile_EXPRESSIONnode(self, node):
-        print(node)
-        if node.store_variable is not None:
-            self.cpp_code += f"{node.store_variable} = {node.left} {node.operator} {node.right};\n"
+        if node.array_size is not None:
+            # Element-wise, a counted loop over local arrays of a known size that g++ vectorizes (-O3, or -O2 since GCC 12)
+            # Every element only reads the elements at its own index, so storing into one of the operands is fine
+            left = f"{node.left}[maple_index]" if node.left_is_array else node.left
+            right = f"{node.right}[maple_index]" if node.right_is_array else node.right
+            loop = f"for (int maple_index = 0; maple_index < {node.array_size}; maple_index++) "
+            if node.store_variable is not None:
+                self.emit(f"{loop}{node.store_variable}[maple_index] = {left} {node.operator} {right};\n")
+            else:
+                self.emit(f"{loop}{left} {node.operator}= {right};\n")
+        elif node.store_variable is not None:
+            self.emit(f"{node.store_variable} = {node.left} {node.operator} {node.right};\n")
         else:
-            self.cpp_code += f"{node.left} {node.operator}= {node.right};\n"
+            self.emit(f"{node.left} {node.operator}= {node.right};\n")
     
+    @transpiles("LIB")
     def transpile_LIBnode(self, node):
-        self.cpp_code += f"#include \"../../../lib/{node.library_name}.hpp\"\n"
+        if self.libraries is None:
+            header = f"{node.library_name}.buffered.hpp" if self.buffered_output else f"{node.library_name}.hpp" # See library_header
+            self.emit(f"#include \"{header}\"\n" if self.is_library else f"#include \"../../../lib/{header}\"\n") # Library headers are next to each other
+        elif node.library_name in self.libraries and node.library_name not in self.emitted_libraries:
+            # Only the functions the program uses are left, so this program gets its own copy of the library
+            self.emitted_libraries.add(node.library_name)
+            library = MapleTranspiler(self.libraries[node.library_name], True, libraries=self.libraries, buffered_output=self.buffered_output, bench=self.bench)
+            library.emitted_libraries = self.emitted_libraries
+            self.emit(library.transpile())
 
@@ -0,0 +1,69 @@
+from MapleParser import CALLnode, iter_nodes, main_nodes
+from MapleTranspiler import MapleTranspiler, CodeEmitter
+from MapleArena import ArenaBlock
+
+class MapleTreeShaker:
+    # Keeps only the functions reachable from the top level code, in the program and in the libraries it imports
+    # Functions are identified by (owner, name), the owner is "" for the program and the library name for libraries
+    def __init__(self, ast, libraries):
+        self.ast = ast
+        self.libraries = libraries # Library name -> AST, the library ASTs are shared so they're never changed
+        self.removed = [] # (owner, FNCnode) of every function removed
+
+    def shake(self):
+        # Removes the unreachable functions from the program, returns the libraries with only their reachable functions
+        # Libraries left without any function are not returned, they don't have to be emitted at all
+        functions = {} # (owner, name) -> FNCnodes, overloads share their name
+        for owner, nodes in (("", self.ast), *self.libraries.items()):
+            for node in nodes:
+                if node.type == "FUNC":
+                    functions.setdefault((owner, node.function_name), []).append(node)
+
+        reachable = set()
+        pending = list(self.calls("", main_nodes(self.ast)))
+        while pending:
+            function = pending.pop()
+            if function in reachable or function not in functions:
+                continue
+            reachable.add(function)
+            for node in functions[function]:
+                pending.extend(self.calls(function[0], node.body))
+
+        self.removed = [(owner, node) for (owner, _), nodes in functions.items() for node in nodes if (owner, node.function_name) not in reachable]
+        kept = lambda node: node.type != "FUNC" or ("", node.function_name) in reachable
+        if isinstance(self.ast, ArenaBlock): # The functions removed are only dropped from the top level block
+            self.ast.retain(kept)
+        else:
+            self.ast[:] = [node for node in self.ast if kept(node)]
+
+        shaken = {}
+        for library_name, nodes in self.libraries.items():
+            kept = [node for node in nodes if node.type != "FUNC" or (library_name, node.function_name) in reachable]
+            if any(node.type == "FUNC" for node in kept):
+                shaken[library_name] = kept
+        return shaken
+
+    @staticmethod
+    def calls(owner, nodes):
+        # Every function called by the nodes, calls without a library are to the functions of the same owner
+        for node in iter_nodes(nodes, ("CALL", "LIBACCESS", "DEC")):
+            if node.type == "CALL":
+                yield (owner, node.function_name)
+            elif node.type == "LIBACCESS":
+                yield (node.library_name, node.function_name)
+            elif node.type == "DEC" and isinstance(node.variable_value, CALLnode):
+                yield (owner, node.variable_value.function_name)
+
+    def report(self):
+        # How much C++ code the removed functions would have been
+        if not self.removed:
+            return "Tree shaking removed nothing"
+        transpiler = MapleTranspiler([])
+        size = 0
+        for owner, node in self.removed:
+            transpiler.emitter = CodeEmitter()
+            transpiler.namespace = owner
+            transpiler.transpile_node(node)
+            size += len(transpiler.emitter.getvalue())
+        names = ", ".join(f"{owner}::{node.function_name}" if owner else node.function_name for owner, node in self.removed)
+        return f"Tree shaking removed {len(self.removed)} functions ({size} characters of C++): {names}"
@@ -11,3 +11,15 @@ type_dic = {
     "str": "std::string",
     "empty": "void"
 }
+
+# Standard headers needed by each type
+type_headers = {
+    "i8": "cstdint",
+    "i16": "cstdint",
+    "i32": "cstdint",
+    "i64": "cstdint",
+    "str": "string",
+}
+
+# Every header a Maple program can need, included by the shared prelude
+prelude_headers = ["iostream", "string", "vector", "fstream", "sstream", "algorithm", "random", "chrono", "map", "cstdint"]
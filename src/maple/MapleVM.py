@@ -0,0 +1,560 @@
+import sys
+import math
+from array import array
+
+from MapleError import MapleError
+from MapleParser import CALLnode
+from MapleOptimizer import integer_regex, decimal_regex, round_f32
+
+# Opcodes, every instruction is an opcode followed by four operands in one flat array of ints
+# Operands are register numbers, jump targets (positions in the array) and indexes into the converter and formatter tables
+(
+    MOVE, # dst, src, converter: dst = converter(src)
+    ADD, SUB, MUL, IDIV, IMOD, FDIV, # dst, left, right, converter: dst = converter(left op right)
+    JUMP, # target
+    UNLESS_LT, UNLESS_GT, UNLESS_LE, UNLESS_GE, UNLESS_EQ, UNLESS_NE, # left, right, target: jumps when the comparison is false
+    LOOP, # variable, end, target: steps the loop variable and jumps back to the body while it's below the end
+    OUT, # src, formatter
+    OUT_ITEM, # array, index, formatter
+    GET_ITEM, # dst, array, index
+    SET_ITEM, # array, index, src, converter
+    NEW_ARRAY, # dst, size, initial values, zero
+    CALL, # function, arguments (a tuple of registers), dst (-1 when the result isn't used)
+    RETURN, # src (-1 for void functions), converter
+    FLUSH,
+) = range(23)
+
+width = 5 # Opcode and operands of an instruction
+
+unless_opcodes = {"<": UNLESS_LT, ">": UNLESS_GT, "<=": UNLESS_LE, ">=": UNLESS_GE, "==": UNLESS_EQ, "!=": UNLESS_NE}
+arithmetic_opcodes = {"+": ADD, "-": SUB, "*": MUL}
+
+def wrapping(bits):
+    # Converts to a signed integer of the given size, wrapping around like the conversion in C++
+    offset = 1 << (bits - 1)
+    mask = (1 << bits) - 1
+    return lambda value: ((int(value) + offset) & mask) - offset
+
+def format_float(value):
+    # std::cout prints floating point numbers with 6 significant digits, like printf's %g
+    return format(value, "g")
+
+# Maple type -> number of its converter and formatter
+type_codes = {"i8": 1, "i16": 2, "i32": 3, "i64": 4, "bool": 5, "f32": 6, "f64": 7, "str": 8}
+converters = [
+    lambda value: value, # Values already of the right type
+    wrapping(8), wrapping(16), wrapping(32), wrapping(64),
+    bool,
+    lambda value: round_f32(float(value)),
+    float,
+    str,
+]
+formatters = [
+    str,
+    lambda value: chr(value & 0xFF), # int8_t is a char for std::cout
+    str, str, str,
+    lambda value: "1" if value else "0",
+    format_float, format_float,
+    str,
+]
+zero_values = {"i8": 0, "i16": 0, "i32": 0, "i64": 0, "bool": False, "f32": 0.0, "f64": 0.0, "str": ""}
+
+# What arithmetic is computed in: the integers smaller than int are promoted to int, so is bool
+arithmetic_types = {"i8": "i32", "i16": "i32", "i32": "i32", "i64": "i64", "bool": "i32", "f32": "f32", "f64": "f64"}
+
+def truncating_division(left, right):
+    # C++ rounds the quotient towards zero
+    if right == 0:
+        raise MapleError("Division by zero")
+    quotient = abs(left) // abs(right)
+    return -quotient if (left < 0) != (right < 0) else quotient
+
+def truncating_remainder(left, right):
+    # The remainder has the sign of the left operand
+    return left - right * truncating_division(left, right)
+
+def float_division(left, right):
+    # Dividing by zero gives an infinity or NaN, like IEEE floats do
+    try:
+        return left / right
+    except ZeroDivisionError:
+        if left == 0 or left != left:
+            return math.nan
+        return math.copysign(math.inf, left) * math.copysign(1.0, right)
+
+class Function:
+    # A compiled function: its bytecode and the registers a call starts with, the arguments first then the constants
+    __slots__ = ("name", "code", "registers", "argument_converters")
+
+    def __init__(self, name, argument_converters):
+        self.name = name
+        self.code = array("i")
+        self.registers = [None] * len(argument_converters)
+        self.argument_converters = argument_converters
+
+    def __repr__(self):
+        return f"Function(name={self.name}, instructions={len(self.code) // width}, registers={len(self.registers)})"
+
+class Program:
+    # Every function of the program and of its libraries, and the top level code as the "main" function
+    def __init__(self, functions, main):
+        self.functions = functions
+        self.main = main
+
+class MapleBytecodeCompiler:
+    # Compiles the AST and the ASTs of the libraries into the bytecode of the MapleVM
+    # Every variable, argument and constant of a function has its own register, so operands never have to be looked up at run time
+    def __init__(self, ast, libraries):
+        self.ast = ast
+        self.libraries = libraries # Library name -> AST
+        self.functions = [] # Every Function, the CALL instructions refer to them by position
+        self.overloads = {} # (owner, name) -> [(position, FNCnode)], the owner is "" for the program and the library name for libraries
+
+    def compile(self):
+        # Functions are numbered before any body is compiled, so they can call each other in any order
+        declarations = [("", node) for node in self.ast if node.type == "FUNC"]
+        declarations += [(library_name, node) for library_name, nodes in self.libraries.items() for node in nodes if node.type == "FUNC"]
+        for owner, node in declarations:
+            function = Function(f"{owner}::{node.function_name}" if owner else node.function_name, [converters[self.type_code(variable_type)] for variable_type in node.args.values()])
+            self.overloads.setdefault((owner, node.function_name), []).append((len(self.functions), node))
+            self.functions.append(function)
+
+        for position, (owner, node) in enumerate(declarations):
+            self.compile_function(self.functions[position], owner, node.function_type, node.args, node.body)
+
+        main = Function("main", [])
+        self.compile_function(main, "", "empty", {}, [node for node in self.ast if node.type != "FUNC" and node.type != "LIB" and node.type != "INIT"])
+        return Program(self.functions, main)
+
+    def compile_function(self, function, owner, return_type, arguments, body):
+        self.function = function
+        self.owner = owner
+        self.return_type = return_type
+        self.variables = {} # Name -> register of the variables in scope
+        self.types = {} # Register -> Maple type
+        self.arrays = set() # Registers holding arrays
+        self.constants = {} # (type, value) -> register
+        self.scratch = {} # (type, slot) -> register holding intermediate results, they never live past a statement
+        self.backups = {} # Name -> register of the back up of the variable
+
+        for register, (name, variable_type) in enumerate(arguments.items()):
+            self.variables[name] = register
+            self.types[register] = variable_type
+
+        self.compile_block(body)
+        if return_type == "empty":
+            self.emit(RETURN, -1, 0)
+        else: # Falling off the end of a function returning a value is undefined in C++, the interpreter returns zero
+            self.emit(RETURN, self.constant(zero_values.get(return_type), return_type), self.converter(return_type))
+
+    def emit(self, opcode, a=0, b=0, c=0, d=0):
+        # Returns the position of the instruction, to patch its jump target later
+        position = len(self.function.code)
+        self.function.code.extend((opcode, a, b, c, d))
+        return position
+
+    def patch(self, position, operand, target):
+        self.function.code[position + operand] = target
+
+    def here(self):
+        return len(self.function.code)
+
+    def register(self, variable_type, value=None):
+        register = len(self.function.registers)
+        self.function.registers.append(value)
+        self.types[register] = variable_type
+        return register
+
+    def constant(self, value, variable_type):
+        key = (variable_type, type(value), value)
+        if key not in self.constants:
+            self.constants[key] = self.register(variable_type, value)
+        return self.constants[key]
+
+    def temporary(self, variable_type, slot="result"):
+        if (variable_type, slot) not in self.scratch:
+            self.scratch[(variable_type, slot)] = self.register(variable_type)
+        return self.scratch[(variable_type, slot)]
+
+    @staticmethod
+    def type_code(variable_type):
+        if variable_type not in type_codes:
+            raise MapleError(f"Invalid variable type {variable_type}")
+        return type_codes[variable_type]
+
+    def converter(self, variable_type):
+        return self.type_code(variable_type)
+
+    def operand(self, operand):
+        # The register of a variable or of a literal
+        operand = str(operand)
+        if operand in self.variables:
+            register = self.variables[operand]
+            if register in self.arrays:
+                raise MapleError(f"Array {operand} can't be used as a value")
+            return register
+        if operand == "true" or operand == "false":
+            return self.constant(operand == "true", "bool")
+        if integer_regex.fullmatch(operand):
+            return self.constant(int(operand), "i32" if int(operand) < 2 ** 31 else "i64")
+        if decimal_regex.fullmatch(operand):
+            return self.constant(float(operand), "f64")
+        raise MapleError(f"Variable {operand} does not exist")
+
+    def variable(self, name):
+        if name not in self.variables:
+            raise MapleError(f"Variable {name} does not exist")
+        return self.variables[name]
+
+    def compile_block(self, nodes):
+        # Variables declared inside a block go out of scope at its end, like in C++
+        outer_variables = self.variables
+        self.variables = dict(outer_variables)
+        position = 0
+        while position < len(nodes):
+            node = nodes[position]
+            if node.type == "IF":
+                position = self.compile_branches(nodes, position)
+                continue
+            if node.type == "RUN": # Everything after it is run again, the loop is closed at the end of the block
+                self.compile_run(node, nodes[position + 1:])
+                break
+
+            compile_node = node_compilers.get(node.type)
+            if compile_node is None:
+                raise MapleError(f"Invalid node type: {node.type}")
+            compile_node(self, node)
+            position += 1
+        self.variables = outer_variables
+
+    def compile_branches(self, nodes, position):
+        # An if, the elifs and the else after it, every one of them followed by its END
+        exits = [] # Jumps from the end of every branch taken to the end of the chain
+        while position < len(nodes) and (nodes[position].type == "IF" if not exits else nodes[position].type in ("ELIF", "ELSE")):
+            branch = nodes[position]
+            position += 2 if position + 1 < len(nodes) and nodes[position + 1].type == "END" else 1
+            skip = self.compile_condition(branch.condition) if branch.type != "ELSE" else None
+            self.compile_block(branch.children)
+            if branch.type == "ELSE":
+                break
+            exits.append(self.emit(JUMP))
+            self.patch(skip, 3, self.here())
+
+        for jump in exits:
+            self.patch(jump, 1, self.here())
+        return position
+
+    def compile_condition(self, condition):
+        # Returns the position of the jump taken when the condition is false
+        if condition.operator not in unless_opcodes:
+            raise MapleError(f"Invalid comparison operator {condition.operator}")
+        return self.emit(unless_opcodes[condition.operator], self.operand(condition.left), self.operand(condition.right))
+
+    def compile_loop(self, variable, start, end, body):
+        # for (int variable = start; variable < end; variable++), the loop variable hides any variable with its name
+        # start and end are registers, the end is read again after every iteration like in C++
+        variable_register = self.register("i32")
+        self.emit(MOVE, variable_register, start, self.converter("i32"))
+        skip = self.emit(UNLESS_LT, variable_register, end)
+
+        outer_variables = self.variables
+        self.variables = dict(outer_variables)
+        if variable is not None:
+            self.variables[variable] = variable_register
+        body_start = self.here()
+        body()
+        self.variables = outer_variables
+
+        self.emit(LOOP, variable_register, end, body_start)
+        self.patch(skip, 3, self.here())
+
+    def compile_run(self, node, nodes):
+        self.compile_loop(None, self.constant(0, "i32"), self.operand(node.times_to_run), lambda: self.compile_block(nodes))
+
+    def resolve(self, owner, function_name, arguments):
+        # The position and the FNCnode of the overload taking that many arguments
+        if (owner, function_name) not in self.overloads:
+            raise MapleError(f"Function {owner + '::' if owner else ''}{function_name} does not exist")
+        for position, node in self.overloads[(owner, function_name)]:
+            if len(node.args) == len(arguments):
+                return position, node
+        raise MapleError(f"Function {function_name} doesn't take {len(arguments)} arguments")
+
+    def compile_call(self, owner, function_name, arguments, destination=-1):
+        position, _ = self.resolve(owner, function_name, arguments)
+        registers = tuple(self.operand(argument) for argument in arguments)
+        self.emit(CALL, position, self.constant(registers, "arguments"), destination)
+
+    def compile_arithmetic(self, destination, left, operator, right):
+        # Computes in the type C++ converts both operands to, then converts the result to the type of the destination
+        left_type, right_type = self.types[left], self.types[right]
+        if left_type not in arithmetic_types or right_type not in arithmetic_types:
+            raise MapleError(f"Cannot compute {left_type} {operator} {right_type}")
+        operand_types = {arithmetic_types[left_type], arithmetic_types[right_type]}
+        result_type = next(variable_type for variable_type in ("f64", "f32", "i64", "i32") if variable_type in operand_types)
+
+        if result_type == "f32": # The integer operands are converted to float before the operation
+            if left_type != "f32":
+                self.emit(MOVE, self.temporary("f32", "left"), left, self.converter("f32"))
+                left = self.temporary("f32", "left")
+            if right_type != "f32":
+                self.emit(MOVE, self.temporary("f32", "right"), right, self.converter("f32"))
+                right = self.temporary("f32", "right")
+
+        if operator in arithmetic_opcodes:
+            opcode = arithmetic_opcodes[operator]
+        elif operator == "/":
+            opcode = FDIV if result_type[0] == "f" else IDIV
+        elif operator == "%" and result_type[0] != "f":
+            opcode = IMOD
+        else:
+            raise MapleError(f"Cannot compute {left_type} {operator} {right_type}")
+
+        destination_type = self.types[destination]
+        converter = self.converter(result_type) if result_type != "f64" else 0
+        if destination_type == result_type:
+            self.emit(opcode, destination, left, right, converter)
+        else:
+            self.emit(opcode, self.temporary(result_type), left, right, converter)
+            self.emit(MOVE, destination, self.temporary(result_type), self.converter(destination_type))
+
+node_compilers = {} # Node type -> method compiling the node
+
+def compiles(*node_types):
+    # Registers a MapleBytecodeCompiler method as the compiler of the given node types
+    def register(method):
+        for node_type in node_types:
+            node_compilers[node_type] = method
+        return method
+    return register
+
+@compiles("DEC")
+def compile_DECnode(self, node):
+    if node.is_array:
+        size = self.operand(node.variable_value)
+        convert = converters[self.type_code(node.variable_type)]
+        values = tuple(convert(float(value) if "." in value else int(value)) for value in node.array_values)
+        register = self.register(node.variable_type)
+        self.emit(NEW_ARRAY, register, size, self.constant(values, "values"), self.constant(zero_values[node.variable_type], node.variable_type))
+        self.arrays.add(register)
+        self.variables[node.variable_name] = register
+        return
+
+    register = self.register(node.variable_type)
+    if isinstance(node.variable_value, CALLnode):
+        call = node.variable_value
+        _, function = self.resolve(self.owner, call.function_name, call.args)
+        if function.function_type == "empty":
+            raise MapleError(f"Function {call.function_name} doesn't return a value")
+        self.compile_call(self.owner, call.function_name, call.args, self.temporary(function.function_type))
+        self.emit(MOVE, register, self.temporary(function.function_type), self.converter(node.variable_type))
+    elif node.variable_type == "str" and str(node.variable_value) not in self.variables:
+        self.emit(MOVE, register, self.constant(str(node.variable_value), "str"))
+    else:
+        self.emit(MOVE, register, self.operand(node.variable_value), self.converter(node.variable_type))
+    self.variables[node.variable_name] = register # After the value, which can't refer to the variable being declared
+
+@compiles("SET")
+def compile_SETnode(self, node):
+    target = self.variable(node.target)
+    if node.target_is_array:
+        self.emit(SET_ITEM, target, self.operand(node.target_array_index), self.operand(node.value), self.converter(self.types[target]))
+    else:
+        self.emit(MOVE, target, self.operand(node.value), self.converter(self.types[target]))
+
+@compiles("EXPRESSION")
+def compile_EXPRESSIONnode(self, node):
+    # Without a store variable the result goes into the left variable, like "left op= right"
+    destination = self.variable(node.store_variable if node.store_variable is not None else node.left)
+    if node.array_size is None:
+        self.compile_arithmetic(destination, self.operand(node.left), node.operator, self.operand(node.right))
+        return
+
+    # Element-wise, the same loop over the indexes as the C++ code
+    def element(operand, is_array, slot):
+        if not is_array:
+            return self.operand(operand)
+        array_register = self.variable(operand)
+        register = self.temporary(self.types[array_register], slot)
+        self.emit(GET_ITEM, register, array_register, self.variables["maple_index"])
+        return register
+
+    def body():
+        element_type = self.types[destination]
+        result = self.temporary(element_type, "element")
+        self.compile_arithmetic(result, element(node.left, node.left_is_array, "left element"), node.operator, element(node.right, node.right_is_array, "right element"))
+        self.emit(SET_ITEM, destination, self.variables["maple_index"], result, self.converter(element_type))
+    self.compile_loop("maple_index", self.constant(0, "i32"), self.operand(node.array_size), body)
+
+@compiles("OUT")
+def compile_OUTnode(self, node):
+    if node.is_array:
+        array_register = self.variable(node.variable_name)
+        self.emit(OUT_ITEM, array_register, self.operand(node.array_index), self.type_code(self.types[array_register]))
+    else:
+        register = self.operand(node.variable_name)
+        self.emit(OUT, register, self.type_code(self.types[register]))
+
+@compiles("FLUSH")
+def compile_FLUSHnode(self, node):
+    self.emit(FLUSH)
+
+@compiles("BLOCK")
+def compile_BLOCKnode(self, node):
+    self.compile_block(node.children)
+
+@compiles("ELIF", "ELSE")
+def compile_branch(self, node):
+    raise MapleError(f"{node.type.lower()} without an if before it")
+
+@compiles("END", "ROLL")
+def compile_end(self, node):
+    pass # The blocks are closed by the nodes they belong to
+
+@compiles("LOOP")
+def compile_LOOPnode(self, node):
+    self.compile_loop(node.variable, self.operand(node.start_index), self.operand(node.times_to_run), lambda: self.compile_block(node.children))
+
+@compiles("BACK", "LOAD")
+def compile_backup(self, node):
+    # The back up is a local of the function, zero until the first back
+    if node.variable_name not in self.backups:
+        self.backups[node.variable_name] = self.register(node.variable_type, zero_values[node.variable_type])
+    variable, backup = self.variable(node.variable_name), self.backups[node.variable_name]
+    if node.type == "BACK":
+        self.emit(MOVE, backup, variable)
+    else:
+        self.emit(MOVE, variable, backup)
+
+@compiles("RETURN")
+def compile_RETURNnode(self, node):
+    if self.return_type == "empty":
+        self.emit(RETURN, -1, 0)
+    else:
+        self.emit(RETURN, self.operand(node.value), self.converter(self.return_type))
+
+@compiles("CALL")
+def compile_CALLnode(self, node):
+    self.compile_call(self.owner, node.function_name, node.args)
+
+@compiles("LIBACCESS")
+def compile_LIBACCESSnode(self, node):
+    self.compile_call(node.library_name, node.function_name, node.args)
+
+class MapleVM:
+    # Runs the bytecode of a Program, printing what the native program would print
+    def __init__(self, program, output=None):
+        self.program = program
+        self.output = output if output is not None else sys.stdout
+        self.lines = [] # Printed text not written yet, written in big chunks like a buffered std::cout
+
+    def run(self):
+        try:
+            self.call(self.program.main, ())
+        except RecursionError:
+            raise MapleError("Stack overflow, the calls are nested too deep")
+        finally:
+            self.flush()
+
+    def flush(self):
+        text = "".join(self.lines)
+        self.lines.clear()
+        if hasattr(self.output, "buffer"): # The chars of int8_t are bytes, so they're written as they are
+            self.output.flush()
+            self.output.buffer.write(text.encode("latin-1", "replace"))
+            self.output.buffer.flush()
+        else:
+            self.output.write(text)
+
+    def call(self, function, arguments):
+        registers = function.registers[:]
+        for position, (convert, value) in enumerate(zip(function.argument_converters, arguments)):
+            registers[position] = convert(value)
+        code = function.code
+        functions = self.program.functions
+        lines = self.lines
+        program_counter = 0
+
+        while True:
+            opcode = code[program_counter]
+            if opcode == MOVE:
+                registers[code[program_counter + 1]] = converters[code[program_counter + 3]](registers[code[program_counter + 2]])
+            elif opcode == ADD:
+                registers[code[program_counter + 1]] = converters[code[program_counter + 4]](registers[code[program_counter + 2]] + registers[code[program_counter + 3]])
+            elif opcode == SUB:
+                registers[code[program_counter + 1]] = converters[code[program_counter + 4]](registers[code[program_counter + 2]] - registers[code[program_counter + 3]])
+            elif opcode == MUL:
+                registers[code[program_counter + 1]] = converters[code[program_counter + 4]](registers[code[program_counter + 2]] * registers[code[program_counter + 3]])
+            elif opcode == LOOP:
+                variable = code[program_counter + 1]
+                registers[variable] += 1
+                if registers[variable] < registers[code[program_counter + 2]]:
+                    program_counter = code[program_counter + 3]
+                    continue
+            elif opcode == OUT:
+                lines.append(formatters[code[program_counter + 2]](registers[code[program_counter + 1]]) + "\n")
+                if len(lines) >= 4096:
+                    self.flush()
+            elif opcode <= UNLESS_NE and opcode >= UNLESS_LT:
+                left, right = registers[code[program_counter + 1]], registers[code[program_counter + 2]]
+                if opcode == UNLESS_LT:
+                    taken = left < right
+                elif opcode == UNLESS_GT:
+                    taken = left > right
+                elif opcode == UNLESS_LE:
+                    taken = left <= right
+                elif opcode == UNLESS_GE:
+                    taken = left >= right
+                elif opcode == UNLESS_EQ:
+                    taken = left == right
+                else:
+                    taken = left != right
+                if not taken:
+                    program_counter = code[program_counter + 3]
+                    continue
+            elif opcode == JUMP:
+                program_counter = code[program_counter + 1]
+                continue
+            elif opcode == IDIV:
+                registers[code[program_counter + 1]] = converters[code[program_counter + 4]](truncating_division(registers[code[program_counter + 2]], registers[code[program_counter + 3]]))
+            elif opcode == IMOD:
+                registers[code[program_counter + 1]] = converters[code[program_counter + 4]](truncating_remainder(registers[code[program_counter + 2]], registers[code[program_counter + 3]]))
+            elif opcode == FDIV:
+                registers[code[program_counter + 1]] = converters[code[program_counter + 4]](float_division(registers[code[program_counter + 2]], registers[code[program_counter + 3]]))
+            elif opcode == CALL:
+                result = self.call(functions[code[program_counter + 1]], [registers[register] for register in registers[code[program_counter + 2]]])
+                if code[program_counter + 3] >= 0:
+                    registers[code[program_counter + 3]] = result
+            elif opcode == RETURN:
+                source = code[program_counter + 1]
+                return converters[code[program_counter + 2]](registers[source]) if source >= 0 else None
+            elif opcode == OUT_ITEM:
+                lines.append(formatters[code[program_counter + 3]](self.item(registers[code[program_counter + 1]], registers[code[program_counter + 2]])) + "\n")
+                if len(lines) >= 4096:
+                    self.flush()
+            elif opcode == GET_ITEM:
+                registers[code[program_counter + 1]] = self.item(registers[code[program_counter + 2]], registers[code[program_counter + 3]])
+            elif opcode == SET_ITEM:
+                values, index = registers[code[program_counter + 1]], registers[code[program_counter + 2]]
+                self.item(values, index) # Checks the index
+                values[index] = converters[code[program_counter + 4]](registers[code[program_counter + 3]])
+            elif opcode == NEW_ARRAY:
+                size, values = registers[code[program_counter + 2]], registers[code[program_counter + 3]]
+                if len(values) > size:
+                    raise MapleError(f"Too many values for an array of size {size}")
+                registers[code[program_counter + 1]] = list(values) + [registers[code[program_counter + 4]]] * (size - len(values))
+            elif opcode == FLUSH:
+                self.flush()
+            program_counter += width
+
+    @staticmethod
+    def item(values, index):
+        if not 0 <= index < len(values):
+            raise MapleError(f"Index {index} out of range for an array of size {len(values)}")
+        return values[index]
+
+def interpret(ast, libraries, output=None):
+    # Compiles and runs the program, returns the Program
+    program = MapleBytecodeCompiler(ast, libraries).compile()
+    MapleVM(program, output).run()
+    return program
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+
+from MapleError import MapleError
+from MapleParser import LibraryTable
+import MapleProject
+
+class MapleWatcher:
+    # Keeps one process alive and rebuilds the sources that change on disk
+    # The compiler modules, the lexer tables and the parsed libraries (a LibraryTable given to every build) stay loaded between rebuilds
+    def __init__(self, paths, build, interval=0.2, output=None, libraries=None):
+        self.paths = paths # Files and directories to watch, like the ones given to MapleBuild
+        self.build = build # Called with the path of every .mpl file to rebuild
+        self.interval = interval # Seconds between two looks at the files
+        self.output = output if output is not None else sys.stderr
+        self.stamps = {} # Path -> (modification time, size) of every watched file, when it was last built
+        self.libraries = libraries if libraries is not None else LibraryTable() # The changed and removed libraries are evicted from it
+
+    def scan(self):
+        # The project files and the libraries they import, with their stamps
+        modules = MapleProject.dependency_graph(self.paths)
+        stamps = {}
+        for path in modules:
+            stat = os.stat(path)
+            stamps[path] = (stat.st_mtime_ns, stat.st_size)
+        return modules, stamps
+
+    def changed(self):
+        # The .mpl files to rebuild: the ones that changed and the ones importing a library that changed, directly or not
+        modules, stamps = self.scan()
+        pending = [path for path, stamp in stamps.items() if self.stamps.get(path) != stamp]
+        for path in [*pending, *(path for path in self.stamps if path not in stamps)]:
+            self.libraries.evict(path)
+        self.stamps = stamps
+
+        importers = {path: [] for path in modules}
+        for path, module in modules.items():
+            for dependency in module.dependencies:
+                importers[dependency].append(path)
+        affected = set()
+        while pending:
+            path = pending.pop()
+            if path not in affected:
+                affected.add(path)
+                pending.extend(importers[path])
+        return sorted(path for path in affected if not modules[path].is_library)
+
+    def rebuild(self, paths):
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                self.build(path)
+                status = "Rebuilt"
+            except MapleError as error: # A broken file is reported, the watch goes on
+                print(error, file=self.output)
+                status = "Failed to build"
+            except Exception as error: # Some broken files still crash the compiler, that mustn't stop the watch either
+                print(f"{type(error).__name__}: {error}", file=self.output)
+                status = "Failed to build"
+            print(f"{status} {os.path.relpath(path)} in {(time.perf_counter() - start) * 1000:.1f} ms", file=self.output)
+
+    def watch(self, rounds=None):
+        # Builds everything once, then every file that changes, rounds is the number of looks at the files (None never stops)
+        while rounds is None or rounds > 0:
+            try:
+                self.rebuild(self.changed())
+            except (MapleError, OSError) as error: # Like a file importing a library that doesn't exist yet, it's looked at again next time
+                print(error, file=self.output)
+            except Exception as error: # Like a file that isn't text, the watch goes on
+                print(f"{type(error).__name__}: {error}", file=self.output)
+            if rounds is not None:
+                rounds -= 1
+            time.sleep(self.interval)
@@ -0,0 +1,222 @@
+# Regression tests of the compiler: the native program against the interpreter, and the optimizer, project and parser helpers
+# Usage: python -m pytest -q, run from the repository root (the native tests need g++)
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(root, "src", "maple"))
+
+from MapleError import MapleError
+from MapleLexer import MapleLexer
+from MapleParser import MapleParser
+from MapleTranspiler import MapleTranspiler
+from MapleOptimizer import MapleOptimizer, Constant, round_f32
+from MapleProject import ProjectModule, find_cycle, build_order
+from MapleArena import ASTArena
+
+compiler = os.path.join(root, "src", "maple", "MapleCompiler.py")
+
+# Small programs the interpreter and the native binary must print the same for, the optimizer folds most of them
+programs = {
+    "folding": """init @folding
+dec i32 k 7
+dec ch i32 x 5
+add x 3
+out x
+mul x k
+out x
+dec ch i32 y 0
+add x k => y
+out y
+sub y 1
+out y
+dec ch f32 f 1.5
+add f 0.25
+out f
+dec f64 c 2.5
+dec ch f64 d 1.0
+mul d c
+out d
+dec ch i64 big 2000000000
+add big 2000000000
+out big
+dec ch i32 n 0
+sub n 7
+div n 2
+out n
+dec ch i32 m 0
+sub m 7
+mod m 2
+out m
+dec ch f64 q 7
+div q 2
+out q
+""",
+    "control": """init @control
+dec ch i32 z 10
+loop i 0 .. 3
+    add z i
+end
+out z
+if z > 10
+    set z 2
+end
+out z
+back z
+add z 100
+out z
+load z
+out z
+dec ch i32 x 0
+run 3
+add x 1
+out x
+""",
+    "backups": """init @backups
+dec ch f64 i 1.5
+loop i 0 .. 3
+    back i
+    load i
+    out i
+end
+back i
+set i 9.5
+load i
+out i
+""",
+    "arrays": """init @arrays
+dec ch i32 a[] 4 -> {1, 2, 3, 4}
+dec ch i32 b[] 4 -> {10, 20, 30, 40}
+dec ch i32 c[] 4 -> {}
+dec ch f64 f[] 3 -> {1.5, 2.5, 3.5}
+dec ch f64 g[] 3 -> {}
+dec i32 k 3
+add a b => c
+out c[0]
+out c[3]
+mul c k
+out c[1]
+sub 100 a => c
+out c[2]
+div f 2 => g
+out g[2]
+mod b k => c
+out c[3]
+""",
+    "library": """init @library
+lib @sugar
+@sugar::pow : 2, 10 :
+""",
+}
+
+def run_program(tmp_path, name, source, *flags):
+    # Output of the compiler running the program, which is written as {name}.mpl so its C++ files don't clash with other programs
+    program_path = tmp_path / f"test_{name}.mpl"
+    program_path.write_text(source)
+    try:
+        result = subprocess.run([sys.executable, compiler, str(program_path), "--no-cache", *flags], cwd=root, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    finally:
+        for extension in (".cpp", ".cpp.exe"):
+            path = os.path.join(root, "src", "files", "cpp", f"test_{name}_Maple{extension}")
+            if os.path.exists(path):
+                os.remove(path)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+@pytest.mark.skipif(shutil.which("g++") is None, reason="needs g++")
+@pytest.mark.parametrize("name", list(programs))
+def test_native_matches_interpreter(tmp_path, name):
+    interpreted = run_program(tmp_path, name, programs[name], "--interp")
+    assert interpreted.strip()
+    assert run_program(tmp_path, name, programs[name]) == interpreted
+
+def parse(source, arena=None):
+    return MapleParser(MapleLexer(source).tokenize_buffer(), arena=arena).parse()
+
+@pytest.mark.parametrize("name", [name for name in programs if name != "library"])
+def test_arena_transpiles_the_same(name):
+    assert MapleTranspiler(parse(programs[name], ASTArena())).transpile() == MapleTranspiler(parse(programs[name])).transpile()
+
+def evaluate(left, operator, right):
+    result = MapleOptimizer([]).evaluate(Constant(*left), operator, Constant(*right))
+    return None if result is None else (result.value, result.type)
+
+def test_evaluate_integer_division_truncates():
+    assert evaluate((7, "i32"), "/", (2, "i32")) == (3, "i32")
+    assert evaluate((-7, "i32"), "/", (2, "i32")) == (-3, "i32")
+    assert evaluate((7, "i32"), "/", (-2, "i32")) == (-3, "i32")
+    assert evaluate((-7, "i32"), "%", (2, "i32")) == (-1, "i32")
+    assert evaluate((7, "i32"), "%", (-2, "i32")) == (1, "i32")
+
+def test_evaluate_promotes_like_cpp():
+    assert evaluate((100, "i8"), "+", (100, "i8")) == (200, "i32") # i8 is computed as int
+    assert evaluate((2_000_000_000, "i64"), "+", (2_000_000_000, "i32")) == (4_000_000_000, "i64")
+    assert evaluate((1, "i32"), "/", (2.0, "f64")) == (0.5, "f64")
+
+def test_evaluate_leaves_undefined_behavior_alone():
+    assert evaluate((2 ** 31 - 1, "i32"), "+", (1, "i32")) is None # Signed overflow
+    assert evaluate((-2 ** 31 + 1, "i32"), "-", (1, "i32")) is None # The lowest value has no literal
+    assert evaluate((2 ** 62, "i64"), "*", (2, "i64")) is None
+    assert evaluate((1, "i32"), "/", (0, "i32")) is None
+    assert evaluate((1, "i32"), "%", (0, "i32")) is None
+    assert evaluate((1.0, "f64"), "/", (0.0, "f64")) is None
+    assert evaluate((1.5, "f64"), "%", (1.0, "f64")) is None
+
+def test_evaluate_rounds_f32():
+    value, value_type = evaluate((0.1, "f32"), "+", (0.2, "f32"))
+    assert value_type == "f32"
+    assert value == round_f32(round_f32(0.1) + round_f32(0.2))
+    assert value != 0.1 + 0.2
+    assert evaluate((0.1, "f32"), "+", (0.2, "f64"))[1] == "f64" # double wins over float
+
+def modules(imports):
+    # Path -> ProjectModule of libraries importing each other, named by their path
+    graph = {}
+    for name, dependencies in imports.items():
+        module = graph[f"/lib/{name}.mal"] = ProjectModule(f"/lib/{name}.mal", name, dependencies)
+        module.dependencies = [f"/lib/{dependency}.mal" for dependency in dependencies]
+    return graph
+
+def test_find_cycle():
+    graph = modules({"a": ["b"], "b": ["c"], "c": ["a"]})
+    assert find_cycle(graph, set(graph)) == ["a", "b", "c", "a"]
+
+def test_find_cycle_from_a_module_outside_of_it():
+    graph = modules({"a": ["b"], "b": ["c"], "c": ["b"]}) # a imports the cycle but isn't part of it
+    assert find_cycle(graph, set(graph)) == ["b", "c", "b"]
+
+def test_build_order_reports_the_cycle():
+    graph = modules({"main": ["x"], "x": ["y"], "y": ["x"], "z": []})
+    with pytest.raises(MapleError, match="x -> y -> x"):
+        build_order(graph)
+    assert build_order(modules({"main": ["x", "y"], "x": ["y"], "y": []})) == ["/lib/y.mal", "/lib/x.mal", "/lib/main.mal"]
+
+def backup_types(source):
+    return [(node.variable_name, node.variable_type) for node in iter_backups(parse(source))]
+
+def iter_backups(nodes):
+    for node in nodes:
+        if node.type == "BACK" or node.type == "LOAD":
+            yield node
+        yield from iter_backups(node.body if node.type == "FUNC" else node.children)
+
+def test_backup_type_of_loop_variables_and_globals():
+    # The loop variable shadows the global of the same name inside the loop
+    assert backup_types(programs["backups"]) == [("i", "i32"), ("i", "i32"), ("i", "f64"), ("i", "f64")]
+
+def test_backup_type_of_arguments():
+    assert backup_types("init @t\nfnc f32 f : f32 a :\n    back a\n    return a\nend\n") == [("a", "f32")]
+
+def test_backup_type_of_declaration_calling_a_function():
+    source = "init @t\nfnc i64 f : i64 a :\n    return a\nend\ndec ch i64 t f : 1 :\nback t\n"
+    assert backup_types(source) == [("t", "i64")]
+
+def test_backup_type_errors():
+    with pytest.raises(MapleError, match="does not exist"):
+        parse("init @t\nback missing\n")
+    with pytest.raises(MapleError, match="Cannot back up array"):
+        parse("init @t\ndec ch i32 a[] 2 -> {1, 2}\nback a\n")